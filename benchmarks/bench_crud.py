@@ -0,0 +1,142 @@
+"""Latency and throughput of every crud function on generated data.
+
+    python -m benchmarks.generate --scale medium --manifest synthetic.json
+    python -m benchmarks.bench_crud synthetic.json --output crud.json [--iterations 200] [--only radius]
+
+Arguments are drawn from the manifest: users, songs and tracks of the run, locations near its cities. The
+identity map is cleared before every call, as every request starts with a fresh session. The write cases add
+rows to the generated data, run them against a copy of the database if it is shared.
+"""
+import argparse
+import sys
+import time
+import uuid
+from datetime import datetime
+
+from songmap import crud, schemas
+from benchmarks import results
+from benchmarks.common import session, now
+from benchmarks.generate import Synthetic, load_manifest
+
+ITERATIONS = 200
+WARMUP = 10
+RADIUS = 500
+TILE_ZOOM = 12
+# degrees of longitude and latitude of a phone sized viewport at city zoom
+VIEWPORT = (0.05, 0.03)
+BATCH = 100
+
+
+def _song_points(data: Synthetic, n: int):
+    return [
+        schemas.SongPointCreate(song_id=data.song_id(), longitude=longitude, latitude=latitude, time_added=now())
+        for longitude, latitude in (data.location() for _ in range(n))
+    ]
+
+
+def _song(data: Synthetic):
+    return schemas.SongCreate(artist="Bench", title="Bench", spotify_id="bench-{}".format(uuid.uuid4().hex))
+
+
+def _viewport(data: Synthetic):
+    longitude, latitude = data.location()
+    return (
+        longitude - VIEWPORT[0] / 2, latitude - VIEWPORT[1] / 2, longitude + VIEWPORT[0] / 2, latitude + VIEWPORT[1] / 2
+    )
+
+
+def cases(db, data: Synthetic):
+    # name -> call, arguments are drawn on every call
+    return {
+        # USER
+        "get_user": lambda: crud.get_user(db, data.user_id()),
+        "get_users_by_username": lambda: crud.get_users_by_username(db, data.username()),
+        "get_users": lambda: crud.get_users(db, skip=data.user_index(), limit=100),
+        "create_user": lambda: crud.create_user(db, schemas.UserCreate(
+            username="bench-{}".format(uuid.uuid4().hex), email="bench@songmap", password="bench"
+        )),
+        "revoke_user_tokens": lambda: crud.revoke_user_tokens(db, data.user_id()),
+        # SONG
+        "get_song": lambda: crud.get_song(db, data.song_id()),
+        "get_song_by_spotifyid": lambda: crud.get_song_by_spotifyid(db, data.spotify_id()),
+        "get_songs_by_spotifyids": lambda: crud.get_songs_by_spotifyids(db, [data.spotify_id() for _ in range(50)]),
+        "create_song": lambda: crud.create_song(db, _song(data)),
+        "create_songs": lambda: crud.create_songs(db, [_song(data) for _ in range(10)]),
+        # SONG POINT
+        "create_song_point_for_user": lambda: crud.create_song_point_for_user(
+            db, _song_points(data, 1)[0], data.user_id()
+        ),
+        "create_song_points_for_user": lambda: crud.create_song_points_for_user(
+            db, _song_points(data, BATCH), data.user_id()
+        ),
+        "get_song_points_within_radius": lambda: crud.get_song_points_within_radius(
+            db, *data.location(), radius=RADIUS
+        ),
+        "get_song_points_in_bbox": lambda: crud.get_song_points_in_bbox(db, *_viewport(data)),
+        # TRACK
+        "create_track": lambda: crud.create_track(db, schemas.TrackCreate(name="bench"), data.user_id()),
+        "get_tracks_by_ids": lambda: crud.get_tracks_by_ids(db, [data.track_id() for _ in range(10)]),
+        "get_tracks_w_song_points_by_user": lambda: crud.get_tracks_w_song_points_by_user(db, data.user_id()),
+        "create_track_w_song_points_for_user": lambda: crud.create_track_w_song_points_for_user(
+            db, schemas.TrackCreate(name="bench"), _song_points(data, BATCH), data.user_id()
+        ),
+        # SONGPOINT + TRACK
+        "get_song_points_and_tracks_by_user": lambda: crud.get_song_points_and_tracks_by_user(db, data.user_id()),
+        "iter_song_points_and_tracks_by_user": lambda: sum(
+            1 for _ in crud.iter_song_points_and_tracks_by_user(db, data.user_id())
+        ),
+        "get_song_points_and_tracks_within_radius": lambda: crud.get_song_points_and_tracks_within_radius(
+            db, *data.location(), radius=RADIUS
+        ),
+        # TILE
+        "get_song_points_mvt": lambda: crud.get_song_points_mvt(db, *data.tile(TILE_ZOOM)),
+    }
+
+
+def run(db, call, iterations: int):
+    for _ in range(WARMUP):
+        db.expunge_all()
+        call()
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        db.expunge_all()
+        start = time.perf_counter()
+        try:
+            call()
+        except Exception:
+            db.rollback()
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    return latencies, time.perf_counter() - started, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the crud functions.")
+    parser.add_argument("manifest")
+    parser.add_argument("--output", default="crud.json")
+    parser.add_argument("--iterations", type=int, default=ITERATIONS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", help="run the cases whose name contains this")
+    args = parser.parse_args(argv)
+
+    started_at = datetime.utcnow()
+    data = Synthetic(load_manifest(args.manifest), args.seed)
+    suite_results = []
+    with session() as db:
+        for name, call in cases(db, data).items():
+            if args.only and args.only not in name:
+                continue
+            print(name, file=sys.stderr)
+            latencies, seconds, errors = run(db, call, args.iterations)
+            suite_results.append(results.summarize(name, latencies, seconds, errors))
+
+    results.print_table(suite_results)
+    results.write(args.output, "crud", dict(
+        manifest=args.manifest, points=data.manifest["points"], iterations=args.iterations, seed=args.seed
+    ), suite_results, started_at)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Throughput of bulk GPX and CSV imports (POST /users/me/imports/, python -m songmap.importer).
+
+    python -m benchmarks.bench_import [--sizes 100000 1000000] [--formats csv gpx]
+
+Every trace is one track of points in a city, the songs come with artist and title and are created by the
+first chunk. Reports imported points per second against TARGET.
+"""
+import argparse
+import random
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+
+from songmap import importer
+from benchmarks.common import session, create_bench_user, now
+
+SIZES = [100000, 1000000]
+SONGS = 1000
+TARGET = 100000
+
+_GPX_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<gpx version="1.1" creator="bench" xmlns="http://www.topografix.com/GPX/1/1"><trk><name>bench</name><trkseg>\n'
+)
+_GPX_POINT = (
+    '<trkpt lat="{latitude!r}" lon="{longitude!r}"><time>{time}Z</time><extensions>'
+    '<spotify_id>{spotify_id}</spotify_id><artist>Bench</artist><title>{title}</title></extensions></trkpt>\n'
+)
+
+
+def _points(n: int, spotify_ids):
+    started = now()
+    longitude, latitude = 17.1, 48.15
+    for i in range(n):
+        longitude += random.uniform(-1e-4, 1e-4)
+        latitude += random.uniform(-1e-4, 1e-4)
+        spotify_id = spotify_ids[i % len(spotify_ids)]
+        yield longitude, latitude, (started + timedelta(seconds=i)).isoformat(), spotify_id, spotify_id
+
+
+def write_trace(fileobj, format: str, n: int, spotify_ids):
+    if format == "csv":
+        fileobj.write(b"longitude,latitude,time_added,spotify_id,artist,title\n")
+        for longitude, latitude, time_added, spotify_id, title in _points(n, spotify_ids):
+            fileobj.write("{!r},{!r},{},{},Bench,{}\n".format(
+                longitude, latitude, time_added, spotify_id, title
+            ).encode())
+    else:
+        fileobj.write(_GPX_HEADER.encode())
+        for longitude, latitude, time_added, spotify_id, title in _points(n, spotify_ids):
+            fileobj.write(_GPX_POINT.format(
+                longitude=longitude, latitude=latitude, time=time_added, spotify_id=spotify_id, title=title
+            ).encode())
+        fileobj.write(b"</trkseg></trk></gpx>\n")
+    fileobj.seek(0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import throughput.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--formats", nargs="+", choices=importer.FORMATS, default=list(importer.FORMATS))
+    args = parser.parse_args(argv)
+
+    with session() as db:
+        db_user = create_bench_user(db)
+        print("{:>6} {:>8} {:>10} {:>10} {:>10}".format("format", "points", "imported", "time [s]", "points/s"))
+        for format in args.formats:
+            for n in args.sizes:
+                # new songs for every run, so each one pays for creating them
+                spotify_ids = ["bench-{}".format(uuid.uuid4().hex) for _ in range(SONGS)]
+                with tempfile.TemporaryFile() as fileobj:
+                    write_trace(fileobj, format, n, spotify_ids)
+                    start = time.perf_counter()
+                    record = importer.run_import(db, fileobj, db_user.id, format, filename="bench." + format)
+                    elapsed = time.perf_counter() - start
+                if record.status != "done":
+                    print("{:>6} {:>8} failed: {}".format(format, n, record.error))
+                    continue
+                rate = record.rows_imported / elapsed
+                print("{:>6} {:>8} {:>10} {:>10.2f} {:>10.0f}{}".format(
+                    format, n, record.rows_imported, elapsed, rate, "" if rate >= TARGET else "  below target"
+                ))
+
+
+if __name__ == "__main__":
+    main()
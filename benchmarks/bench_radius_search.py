@@ -0,0 +1,66 @@
+"""Radius search latency: ST_DistanceSphere full scan vs index-assisted ST_DWithin + KNN.
+
+    python -m benchmarks.bench_radius_search [points]
+"""
+import random
+import sys
+
+from sqlalchemy import func, text
+
+from songmap import crud, models
+from benchmarks.common import session, timed, create_bench_user, create_bench_song
+
+POINTS = 1000000
+QUERIES = 20
+RADII = [50, 500, 5000]
+
+# Bratislava-sized box
+MIN_LON, MAX_LON = 16.9, 17.3
+MIN_LAT, MAX_LAT = 48.0, 48.3
+
+
+def load_points(db, owner_id: int, song_id: int, n: int):
+    db.execute(text("""
+        INSERT INTO songpoints (song_id, owner_id, likes, time_added, longitude, latitude, geo)
+        SELECT :song_id, :owner_id, 0, now(), lon, lat, ST_SetSRID(ST_MakePoint(lon, lat), :srid)
+        FROM (
+            SELECT :min_lon + random() * (:max_lon - :min_lon) AS lon,
+                   :min_lat + random() * (:max_lat - :min_lat) AS lat
+            FROM generate_series(1, :n)
+        ) AS p
+    """), dict(
+        song_id=song_id, owner_id=owner_id, srid=models.SRID, n=n,
+        min_lon=MIN_LON, max_lon=MAX_LON, min_lat=MIN_LAT, max_lat=MAX_LAT
+    ))
+    db.commit()
+    db.execute(text("ANALYZE songpoints"))
+
+
+def distance_sphere_scan(db, longitude: float, latitude: float, radius: int):
+    # the query get_song_points_within_radius used to run
+    geo = 'SRID={};POINT({} {})'.format(models.SRID, longitude, latitude)
+    return db.query(models.SongPoint).filter(
+        func.ST_DistanceSphere(models.SongPoint.geo, func.ST_GeomFromEWKT(geo)) < radius
+    ).limit(100).all()
+
+
+def run(db, fn, radius: int, coordinates):
+    return sum(timed(fn, db, longitude, latitude, radius, repeat=1) for longitude, latitude in coordinates) / len(coordinates)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else POINTS
+    with session() as db:
+        load_points(db, create_bench_user(db).id, create_bench_song(db).id, n)
+        coordinates = [(random.uniform(MIN_LON, MAX_LON), random.uniform(MIN_LAT, MAX_LAT)) for _ in range(QUERIES)]
+
+        print("{} points, mean of {} queries".format(n, QUERIES))
+        print("{:>8} {:>14} {:>14}".format("radius", "before [ms]", "after [ms]"))
+        for radius in RADII:
+            before = run(db, distance_sphere_scan, radius, coordinates)
+            after = run(db, crud.get_song_points_within_radius, radius, coordinates)
+            print("{:>8} {:>14.2f} {:>14.2f}".format(radius, before * 1000, after * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Response bodies of the list endpoints: ORM objects through the orm_mode schemas vs rows encoded directly.
+
+    python -m benchmarks.bench_serialization
+
+For every size a user gets half of the points loose and half on one track. Each path reads the user's song
+points and tracks (/users/{owner_id}/sat/) and a radius page of the same size (/songpoints/), and the two
+bodies are compared byte for byte.
+"""
+from typing import List
+
+from sqlalchemy import text
+
+from songmap import crud, models, schemas, serialization, tracks
+from songmap.responses import json_body, json_bytes
+from benchmarks.bench_radius_search import MIN_LON, MAX_LON, MIN_LAT, MAX_LAT
+from benchmarks.common import session, timed, create_bench_user, create_bench_song
+
+SIZES = [100, 1000, 10000]
+# wide enough that a page holds every point of the user
+RADIUS = 50000
+LONGITUDE = (MIN_LON + MAX_LON) / 2
+LATITUDE = (MIN_LAT + MAX_LAT) / 2
+
+
+def load_points(db, owner_id: int, song_id: int, n: int, track_id=None):
+    db.execute(text("""
+        INSERT INTO songpoints (track_id, song_id, owner_id, likes, time_added, longitude, latitude, geo)
+        SELECT :track_id, :song_id, :owner_id, floor(random() * 100), now() - random() * interval '30 days',
+               lon, lat, ST_SetSRID(ST_MakePoint(lon, lat), :srid)
+        FROM (
+            SELECT :min_lon + random() * (:max_lon - :min_lon) AS lon,
+                   :min_lat + random() * (:max_lat - :min_lat) AS lat
+            FROM generate_series(1, :n)
+        ) AS p
+    """), dict(
+        track_id=track_id, song_id=song_id, owner_id=owner_id, srid=models.SRID, n=n,
+        min_lon=MIN_LON, max_lon=MAX_LON, min_lat=MIN_LAT, max_lat=MAX_LAT
+    ))
+
+
+def create_user_w_points(db, song_id: int, n: int) -> int:
+    owner_id = create_bench_user(db).id
+    db_track = models.Track(name="bench", owner_id=owner_id)
+    db.add(db_track)
+    db.flush()
+    load_points(db, owner_id, song_id, n - n // 2)
+    load_points(db, owner_id, song_id, n // 2, track_id=db_track.id)
+    tracks.refresh_geometry(db, db_track.id)
+    db.commit()
+    return owner_id
+
+
+def orm_by_user(db, owner_id: int) -> bytes:
+    return json_body(schemas.SongPointsAndTracksResp, crud.get_song_points_and_tracks_by_user(db, owner_id))
+
+
+def fast_by_user(db, owner_id: int) -> bytes:
+    return json_bytes(serialization.get_song_points_and_tracks_by_user(db, owner_id))
+
+
+def orm_radius(db, limit: int) -> bytes:
+    song_points, _ = crud.get_song_points_within_radius(db, LONGITUDE, LATITUDE, RADIUS, limit=limit)
+    return json_body(List[schemas.SongPointResp], song_points)
+
+
+def fast_radius(db, limit: int) -> bytes:
+    song_points, _ = serialization.get_song_points_within_radius(db, LONGITUDE, LATITUDE, RADIUS, limit=limit)
+    return json_bytes(song_points)
+
+
+def measure(db, orm, fast, arg):
+    # a fresh identity map for every run, as in a request
+    def run(fn):
+        db.expunge_all()
+        return fn(db, arg)
+
+    identical = run(orm) == run(fast)
+    return timed(run, orm), timed(run, fast), identical
+
+
+def main():
+    with session() as db:
+        song_id = create_bench_song(db).id
+        print("{:>8} {:>12} {:>12} {:>12} {:>10} {:>10}".format(
+            "points", "endpoint", "orm [ms]", "fast [ms]", "speedup", "identical"
+        ))
+        for n in SIZES:
+            owner_id = create_user_w_points(db, song_id, n)
+            db.execute(text("ANALYZE songpoints"))
+            for endpoint, orm, fast, arg in (
+                    ("sat", orm_by_user, fast_by_user, owner_id),
+                    ("songpoints", orm_radius, fast_radius, n),
+            ):
+                orm_seconds, fast_seconds, identical = measure(db, orm, fast, arg)
+                print("{:>8} {:>12} {:>12.2f} {:>12.2f} {:>9.1f}x {:>10}".format(
+                    n, endpoint, orm_seconds * 1000, fast_seconds * 1000, orm_seconds / fast_seconds, str(identical)
+                ))
+
+
+if __name__ == "__main__":
+    main()
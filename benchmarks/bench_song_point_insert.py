@@ -0,0 +1,42 @@
+"""Per-row vs bulk song point ingestion (POST /users/me/songpoints/).
+
+    python -m benchmarks.bench_song_point_insert
+"""
+import random
+
+from songmap import crud, schemas
+from benchmarks.common import session, timed, create_bench_user, create_bench_song, now
+
+SIZES = [10, 100, 10000]
+
+
+def make_song_points(song_id: int, n: int):
+    return [
+        schemas.SongPointCreate(
+            song_id=song_id,
+            longitude=random.uniform(17.0, 17.2),
+            latitude=random.uniform(48.1, 48.2),
+            time_added=now()
+        )
+        for _ in range(n)
+    ]
+
+
+def per_row(db, song_points, owner_id):
+    return [crud.create_song_point_for_user(db, song_point, owner_id) for song_point in song_points]
+
+
+def main():
+    with session() as db:
+        db_user = create_bench_user(db)
+        db_song = create_bench_song(db)
+        print("{:>8} {:>12} {:>12} {:>8}".format("points", "per-row [s]", "bulk [s]", "speedup"))
+        for n in SIZES:
+            song_points = make_song_points(db_song.id, n)
+            t_per_row = timed(per_row, db, song_points, db_user.id, repeat=1)
+            t_bulk = timed(crud.create_song_points_for_user, db, song_points, db_user.id, repeat=1)
+            print("{:>8} {:>12.4f} {:>12.4f} {:>7.1f}x".format(n, t_per_row, t_bulk, t_per_row / t_bulk))
+
+
+if __name__ == "__main__":
+    main()
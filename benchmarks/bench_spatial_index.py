@@ -0,0 +1,66 @@
+"""In-memory spatial index vs PostGIS: result equivalence, memory per point and QPS.
+
+    python -m benchmarks.bench_spatial_index [points]
+"""
+import random
+import sys
+import time
+
+from songmap import crud, spatial_index
+from benchmarks.common import session, create_bench_user, create_bench_song
+from benchmarks.bench_radius_search import load_points, MIN_LON, MAX_LON, MIN_LAT, MAX_LAT
+
+POINTS = 1000000
+QUERIES = 500
+RADII = [50, 500, 5000]
+LIMIT = 100
+
+
+def qps(fn, queries):
+    start = time.perf_counter()
+    for query in queries:
+        fn(*query)
+    return len(queries) / (time.perf_counter() - start)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else POINTS
+    with session() as db:
+        load_points(db, create_bench_user(db).id, create_bench_song(db).id, n)
+
+        index = spatial_index.SpatialIndex()
+        start = time.perf_counter()
+        index.load(db)
+        print("loaded {} points in {:.1f} s".format(len(index), time.perf_counter() - start))
+
+        bytes_per_point = index.memory_bytes() / max(len(index), 1)
+        print("memory: {:.1f} bytes per point, budget {}".format(bytes_per_point, spatial_index.BYTES_PER_POINT))
+        assert bytes_per_point <= spatial_index.BYTES_PER_POINT
+
+        queries = [
+            (random.uniform(MIN_LON, MAX_LON), random.uniform(MIN_LAT, MAX_LAT), random.choice(RADII), None, LIMIT)
+            for _ in range(QUERIES)
+        ]
+
+        def sql_page(*query):
+            return db.execute(crud._song_points_page(*query)).all()
+
+        def sql_sat_page(*query):
+            return db.execute(crud._song_points_and_tracks_page(*query)).all()
+
+        mismatches = 0
+        for query in queries:
+            for sql, memory in ((sql_page, index.song_points_page), (sql_sat_page, index.song_points_and_tracks_page)):
+                expected = [(row.id, row.track_id) for row in sql(*query)]
+                actual = [(row.id, row.track_id) for row in memory(*query)]
+                mismatches += expected != actual
+        print("equivalence: {} of {} pages differ".format(mismatches, 2 * len(queries)))
+        assert mismatches == 0
+
+        print("{:>12} {:>10}".format("path", "QPS"))
+        print("{:>12} {:>10.0f}".format("postgis", qps(sql_page, queries)))
+        print("{:>12} {:>10.0f}".format("in-memory", qps(index.song_points_page, queries)))
+
+
+if __name__ == "__main__":
+    main()
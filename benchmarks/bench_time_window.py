@@ -0,0 +1,84 @@
+"""Radius search over the last 7 days on the monthly partitioned songpoints, against the same search over all history.
+
+    python -m benchmarks.bench_time_window [points]
+
+Points are spread evenly over MONTHS months. The acceptance run is at 100M points:
+
+    python -m benchmarks.bench_time_window 100000000
+"""
+import random
+import sys
+from datetime import timedelta
+
+from sqlalchemy import text
+
+from songmap import crud, models, partitions
+from benchmarks.bench_radius_search import MIN_LON, MAX_LON, MIN_LAT, MAX_LAT
+from benchmarks.common import session, timed, create_bench_user, create_bench_song, now
+
+POINTS = 10000000
+# generate_series batch, one transaction each
+LOAD_CHUNK = 1000000
+MONTHS = 24
+QUERIES = 20
+RADIUS = 1000
+WINDOW = timedelta(days=7)
+
+
+def load_points(db, owner_id: int, song_id: int, n: int):
+    end = now()
+    partitions.ensure_partitions(db, start=end - timedelta(days=30 * MONTHS))
+    for start in range(0, n, LOAD_CHUNK):
+        db.execute(text("""
+            INSERT INTO songpoints (song_id, owner_id, likes, time_added, longitude, latitude, geo)
+            SELECT :song_id, :owner_id, 0, :end - random() * (:months * interval '30 days'),
+                   lon, lat, ST_SetSRID(ST_MakePoint(lon, lat), :srid)
+            FROM (
+                SELECT :min_lon + random() * (:max_lon - :min_lon) AS lon,
+                       :min_lat + random() * (:max_lat - :min_lat) AS lat
+                FROM generate_series(1, :n)
+            ) AS p
+        """), dict(
+            song_id=song_id, owner_id=owner_id, srid=models.SRID, n=min(LOAD_CHUNK, n - start), end=end, months=MONTHS,
+            min_lon=MIN_LON, max_lon=MAX_LON, min_lat=MIN_LAT, max_lat=MAX_LAT
+        ))
+        db.commit()
+        print("loaded {} / {}".format(min(start + LOAD_CHUNK, n), n), file=sys.stderr)
+    db.execute(text("ANALYZE songpoints"))
+
+
+def scanned_partitions(db, longitude: float, latitude: float, since):
+    # partitions left in the plan after pruning
+    stmt = crud._song_points_page(longitude, latitude, RADIUS, None, 100, since=since)
+    compiled = stmt.compile(dialect=db.bind.dialect)
+    plan = db.connection().exec_driver_sql("EXPLAIN " + str(compiled), compiled.params).scalars().all()
+    return len({
+        word for line in plan for word in line.split() if word.startswith("songpoints_") and not word.endswith("_idx")
+    })
+
+
+def run(db, coordinates, since):
+    return sum(
+        timed(crud.get_song_points_within_radius, db, longitude, latitude, RADIUS, repeat=1, since=since)
+        for longitude, latitude in coordinates
+    ) / len(coordinates)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else POINTS
+    with session() as db:
+        load_points(db, create_bench_user(db).id, create_bench_song(db).id, n)
+        coordinates = [(random.uniform(MIN_LON, MAX_LON), random.uniform(MIN_LAT, MAX_LAT)) for _ in range(QUERIES)]
+        longitude, latitude = coordinates[0]
+        since = now() - WINDOW
+
+        print("{} points over {} months, radius {} m, mean of {} queries".format(n, MONTHS, RADIUS, QUERIES))
+        print("{:>14} {:>12} {:>12}".format("window", "partitions", "mean [ms]"))
+        for label, window_since in (("all history", None), ("last 7 days", since)):
+            print("{:>14} {:>12} {:>12.2f}".format(
+                label, scanned_partitions(db, longitude, latitude, window_since), run(db, coordinates, window_since) * 1000
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from alembic import command
+from alembic.config import Config
+
+from songmap import models, partitions
+from songmap.database import SessionLocal
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic.ini")
+
+
+def migrate():
+    config = Config(ALEMBIC_INI)
+    config.set_main_option("script_location", os.path.join(os.path.dirname(ALEMBIC_INI), "migrations"))
+    command.upgrade(config, "head")
+
+
+@contextmanager
+def session():
+    migrate()
+    db = SessionLocal()
+    partitions.ensure_partitions(db)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def timed(fn, *args, repeat: int = 3, **kwargs):
+    # best of `repeat` runs, in seconds
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def create_bench_user(db):
+    db_user = models.User(username="bench-{}".format(uuid.uuid4().hex), email="bench@songmap", hashed_password="-")
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+    return db_user
+
+
+def create_bench_song(db):
+    db_song = models.Song(artist="Bench", title="Bench", spotify_id="bench-{}".format(uuid.uuid4().hex))
+    db.add(db_song)
+    db.commit()
+    db.refresh(db_song)
+    return db_song
+
+
+def now():
+    return datetime.utcnow()
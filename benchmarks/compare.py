@@ -0,0 +1,67 @@
+"""Flags p50, p99 and throughput regressions between two result files of the same suite.
+
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 0.1] [--p99-threshold 0.2]
+
+Exits with 1 when a result got slower than the threshold allows, so it can gate a CI job.
+"""
+import argparse
+import sys
+
+from benchmarks.results import load
+
+
+def _change(baseline: float, candidate: float):
+    return (candidate - baseline) / baseline if baseline else 0.0
+
+
+def compare(baseline: dict, candidate: dict, threshold: float, p99_threshold: float):
+    # rows of (name, metric, baseline, candidate, change, regressed)
+    candidates = {result["name"]: result for result in candidate["results"]}
+    rows = []
+    for old in baseline["results"]:
+        new = candidates.get(old["name"])
+        if new is None or not old["count"] or not new["count"]:
+            continue
+        for metric, allowed, higher_is_worse in (
+                ("p50_ms", threshold, True),
+                ("p99_ms", p99_threshold, True),
+                ("throughput", threshold, False),
+        ):
+            change = _change(old[metric], new[metric])
+            regressed = change > allowed if higher_is_worse else change < -allowed
+            rows.append((old["name"], metric, old[metric], new[metric], change, regressed))
+    missing = sorted(set(result["name"] for result in baseline["results"]) - set(candidates))
+    return rows, missing
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed p50 and throughput change")
+    parser.add_argument("--p99-threshold", type=float, default=0.2, help="allowed p99 change, tails are noisier")
+    args = parser.parse_args(argv)
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    if baseline["suite"] != candidate["suite"]:
+        parser.error("{} is a {} run, {} a {} run".format(
+            args.baseline, baseline["suite"], args.candidate, candidate["suite"]
+        ))
+    rows, missing = compare(baseline, candidate, args.threshold, args.p99_threshold)
+
+    print("{} {} -> {}".format(baseline["suite"], baseline.get("commit") or "?", candidate.get("commit") or "?"))
+    print("{:>42} {:>11} {:>10} {:>10} {:>8}".format("name", "metric", "baseline", "candidate", "change"))
+    for name, metric, old, new, change, regressed in rows:
+        print("{:>42} {:>11} {:>10.2f} {:>10.2f} {:>+7.1%}{}".format(
+            name, metric, old, new, change, "  REGRESSION" if regressed else ""
+        ))
+    for name in missing:
+        print("{:>42} missing from the candidate run".format(name))
+
+    regressions = sum(1 for row in rows if row[-1])
+    print("{} regression(s)".format(regressions))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""Synthetic data for the benchmark suite: users, songs, tracks and song points clustered around cities.
+
+    python -m benchmarks.generate --scale medium --manifest synthetic.json
+    python -m benchmarks.generate --points 250000 --seed 7 --manifest synthetic.json
+
+Song points are normally distributed around the CITIES, in proportion to their weights, and spread over MONTHS
+months. Song popularity and likes follow a power law, a few songs get most of the placements. TRACK_SHARE of
+the points lie on tracks, random walks of POINTS_PER_TRACK points starting near a city.
+
+The rows are generated by PostgreSQL in chunks of LOAD_CHUNK, seeded per chunk, so a seed gives the same data
+on every run. Likes are counts on the song points only, there are no likes rows. Users get PASSWORD, the
+manifest lists what was generated for bench_crud and load_mixed.
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import uuid
+from datetime import timedelta
+
+from sqlalchemy import text
+
+from songmap import auth, clusters, likes, models, partitions, tiles, tracks, trending
+from benchmarks.common import session, now
+
+# song points
+SCALES = {"small": 100000, "medium": 1000000, "large": 10000000, "xlarge": 100000000}
+POINTS_PER_USER = 1000
+POINTS_PER_SONG = 50
+MAX_SONGS = 2000000
+TRACK_SHARE = 0.3
+POINTS_PER_TRACK = 200
+MONTHS = 12
+# rows generated per statement, one transaction each
+LOAD_CHUNK = 1000000
+PASSWORD = "synthetic"
+
+# name, longitude, latitude, weight, spread in degrees
+CITIES = [
+    ("london", -0.1276, 51.5072, 9.0, 0.12),
+    ("paris", 2.3522, 48.8566, 7.0, 0.08),
+    ("berlin", 13.4050, 52.5200, 3.7, 0.09),
+    ("madrid", -3.7038, 40.4168, 3.3, 0.07),
+    ("rome", 12.4964, 41.9028, 2.8, 0.06),
+    ("vienna", 16.3738, 48.2082, 1.9, 0.05),
+    ("prague", 14.4378, 50.0755, 1.3, 0.05),
+    ("budapest", 19.0402, 47.4979, 1.7, 0.05),
+    ("warsaw", 21.0122, 52.2297, 1.8, 0.06),
+    ("bratislava", 17.1077, 48.1486, 0.5, 0.03),
+    ("kosice", 21.2611, 48.7164, 0.2, 0.02),
+    ("zilina", 18.7394, 49.2231, 0.1, 0.02),
+]
+# degrees of one step of a track, about 100 m
+TRACK_STEP = 0.001
+
+_insert_users = text("""
+    INSERT INTO users (username, email, hashed_password, disabled, token_version, approval_ratio, influence)
+    SELECT :prefix || i, :prefix || i || '@songmap', :hashed_password, false, 0, 0, 0
+    FROM generate_series(0, :n - 1) AS i
+    ORDER BY i
+    RETURNING id
+""")
+
+_insert_songs = text("""
+    INSERT INTO songs (artist, title, spotify_id)
+    SELECT 'Artist ' || (i % 5000), 'Song ' || i, :prefix || i
+    FROM generate_series(0, :n - 1) AS i
+    ORDER BY i
+    RETURNING id
+""")
+
+# rank k of a song or a like count has probability ~ 1/k, Box-Muller for the normal spread around a city
+_insert_loose_song_points = text("""
+    INSERT INTO songpoints (song_id, owner_id, likes, time_added, longitude, latitude, geo)
+    SELECT song_id, owner_id, likes, time_added, lon, lat, ST_SetSRID(ST_MakePoint(lon, lat), :srid)
+    FROM (
+        SELECT :first_song_id + least(floor(exp(random() * ln(:songs))), :songs) - 1 AS song_id,
+               :first_user_id + floor(random() * :users) AS owner_id,
+               floor(exp(random() * ln(1000))) - 1 AS likes,
+               :end - random() * (:months * interval '30 days') AS time_added,
+               :lon + :spread * sqrt(-2 * ln(1 - random())) * cos(2 * pi() * random()) / cos(radians(:lat)) AS lon,
+               :lat + :spread * sqrt(-2 * ln(1 - random())) * cos(2 * pi() * random()) AS lat
+        FROM generate_series(1, :n)
+    ) AS p
+""")
+
+# a track is placed near the city, its points walk from there a minute apart
+_insert_tracks = text("""
+    WITH new_tracks AS (
+        INSERT INTO tracks (owner_id, name, point_count)
+        SELECT :first_user_id + floor(random() * :users), 'synthetic ' || :city, 0
+        FROM generate_series(1, :n)
+        RETURNING id, owner_id
+    ), starts AS (
+        SELECT id, owner_id,
+               :lon + :spread * sqrt(-2 * ln(1 - random())) * cos(2 * pi() * random()) / cos(radians(:lat)) AS lon,
+               :lat + :spread * sqrt(-2 * ln(1 - random())) * cos(2 * pi() * random()) AS lat,
+               :end - random() * (:months * interval '30 days') AS started
+        FROM new_tracks
+    ), steps AS (
+        SELECT starts.*, i,
+               :first_song_id + least(floor(exp(random() * ln(:songs))), :songs) - 1 AS song_id,
+               floor(exp(random() * ln(1000))) - 1 AS likes,
+               (random() - 0.5) * :step AS dlon,
+               (random() - 0.5) * :step AS dlat
+        FROM starts, generate_series(1, :points_per_track) AS i
+    ), walked AS (
+        SELECT id, owner_id, song_id, likes, least(started + i * interval '1 minute', :end) AS time_added,
+               lon + sum(dlon) OVER w AS lon, lat + sum(dlat) OVER w AS lat
+        FROM steps
+        WINDOW w AS (PARTITION BY id ORDER BY i)
+    ), song_points AS (
+        INSERT INTO songpoints (track_id, song_id, owner_id, likes, time_added, longitude, latitude, geo)
+        SELECT id, song_id, owner_id, likes, time_added, lon, lat, ST_SetSRID(ST_MakePoint(lon, lat), :srid)
+        FROM walked
+    )
+    SELECT id FROM new_tracks
+""")
+
+
+def _seed(db, seed: int, chunk: int):
+    # setseed takes [-1, 1], random() is per connection, so every chunk reseeds its own transaction
+    db.execute(text("SELECT setseed(:seed)"), dict(seed=((seed * 1000003 + chunk) % 2000001) / 1000000 - 1))
+
+
+def _contiguous(ids, n: int):
+    # song points pick users and songs by offset from the first id
+    ids = sorted(ids)
+    if len(ids) != n or ids[-1] - ids[0] != n - 1:
+        raise RuntimeError("ids of the generated rows are not contiguous, run on an idle database")
+    return ids[0]
+
+
+def _split(n: int, weights):
+    # n split in proportion to weights, the rounding rest goes to the first
+    total = sum(weights)
+    counts = [int(n * weight / total) for weight in weights]
+    counts[0] += n - sum(counts)
+    return counts
+
+
+def plan(points: int):
+    users = max(10, points // POINTS_PER_USER)
+    songs = min(MAX_SONGS, max(100, points // POINTS_PER_SONG))
+    track_points = int(points * TRACK_SHARE) // POINTS_PER_TRACK * POINTS_PER_TRACK
+    return dict(
+        points=points, users=users, songs=songs,
+        tracks=track_points // POINTS_PER_TRACK, loose_points=points - track_points
+    )
+
+
+def generate(db, points: int, seed: int, derived: bool = True) -> dict:
+    counts = plan(points)
+    prefix = "synthetic-{}-".format(uuid.uuid4().hex[:8])
+    end = now()
+    partitions.ensure_partitions(db, start=end - timedelta(days=30 * MONTHS))
+    chunk = 0
+
+    def progress(what: str, done: int, total: int):
+        print("{:>12} {} / {}".format(what, done, total), file=sys.stderr)
+
+    first_user_id = _contiguous(db.execute(_insert_users, dict(
+        prefix=prefix + "user-", n=counts["users"], hashed_password=auth.get_password_hash(PASSWORD)
+    )).scalars().all(), counts["users"])
+    first_song_id = _contiguous(db.execute(_insert_songs, dict(
+        prefix=prefix + "song-", n=counts["songs"]
+    )).scalars().all(), counts["songs"])
+    db.commit()
+
+    common = dict(
+        srid=models.SRID, end=end, months=MONTHS, first_user_id=first_user_id, users=counts["users"],
+        first_song_id=first_song_id, songs=counts["songs"]
+    )
+    weights = [city[3] for city in CITIES]
+
+    loaded = 0
+    for (name, lon, lat, _, spread), n in zip(CITIES, _split(counts["loose_points"], weights)):
+        for start in range(0, n, LOAD_CHUNK):
+            _seed(db, seed, chunk)
+            chunk += 1
+            db.execute(_insert_loose_song_points, dict(
+                common, lon=lon, lat=lat, spread=spread, n=min(LOAD_CHUNK, n - start)
+            ))
+            db.commit()
+            loaded += min(LOAD_CHUNK, n - start)
+            progress("song points", loaded, counts["loose_points"])
+
+    track_ids = []
+    tracks_per_chunk = max(1, LOAD_CHUNK // POINTS_PER_TRACK)
+    for (name, lon, lat, _, spread), n in zip(CITIES, _split(counts["tracks"], weights)):
+        for start in range(0, n, tracks_per_chunk):
+            _seed(db, seed, chunk)
+            chunk += 1
+            track_ids.extend(db.execute(_insert_tracks, dict(
+                common, city=name, lon=lon, lat=lat, spread=spread, step=TRACK_STEP,
+                n=min(tracks_per_chunk, n - start), points_per_track=POINTS_PER_TRACK
+            )).scalars().all())
+            db.commit()
+            progress("tracks", len(track_ids), counts["tracks"])
+
+    for i, track_id in enumerate(track_ids, 1):
+        tracks.refresh_geometry(db, track_id)
+        if i % 1000 == 0 or i == len(track_ids):
+            db.commit()
+            progress("geometry", i, len(track_ids))
+    if derived:
+        # clusters, trending buckets and approval ratios over the whole table, including rows other runs left behind
+        clusters.rebuild(db)
+        trending.rebuild(db)
+        likes.recount(db)
+        db.commit()
+    db.execute(text("ANALYZE"))
+    db.commit()
+
+    return dict(
+        counts,
+        seed=seed,
+        generated_at=end.isoformat(timespec="seconds"),
+        prefix=prefix,
+        password=PASSWORD,
+        first_user_id=first_user_id,
+        first_song_id=first_song_id,
+        track_ids=[min(track_ids), max(track_ids)] if track_ids else [],
+        cities=[dict(name=name, longitude=lon, latitude=lat, weight=weight, spread=spread)
+                for name, lon, lat, weight, spread in CITIES],
+    )
+
+
+class Synthetic:
+    # random picks from a manifest, for the workloads
+    def __init__(self, manifest: dict, seed: int = 0):
+        self.manifest = manifest
+        self.random = random.Random(seed)
+        self._weights = [city["weight"] for city in manifest["cities"]]
+
+    def user_index(self) -> int:
+        return self.random.randrange(self.manifest["users"])
+
+    def user_id(self) -> int:
+        return self.manifest["first_user_id"] + self.user_index()
+
+    def username(self, index: int = None) -> str:
+        return "{}user-{}".format(self.manifest["prefix"], self.user_index() if index is None else index)
+
+    def song_id(self) -> int:
+        # same skew as the generated placements
+        rank = min(int(math.exp(self.random.random() * math.log(self.manifest["songs"]))), self.manifest["songs"])
+        return self.manifest["first_song_id"] + rank - 1
+
+    def spotify_id(self) -> str:
+        return "{}song-{}".format(self.manifest["prefix"], self.song_id() - self.manifest["first_song_id"])
+
+    def track_id(self) -> int:
+        # track ids of a run are not contiguous with other inserts running, misses are cheap reads too
+        first, last = self.manifest["track_ids"]
+        return self.random.randint(first, last)
+
+    def location(self):
+        city = self.random.choices(self.manifest["cities"], self._weights)[0]
+        return (
+            city["longitude"] + self.random.gauss(0, city["spread"]) / math.cos(math.radians(city["latitude"])),
+            city["latitude"] + self.random.gauss(0, city["spread"])
+        )
+
+    def tile(self, z: int):
+        x, y = tiles.lonlat_to_tile(*self.location(), z)
+        return z, int(x), int(y)
+
+
+def load_manifest(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic songmap data.")
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument("--scale", choices=sorted(SCALES, key=SCALES.get), default="small")
+    size.add_argument("--points", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--manifest", default="synthetic.json")
+    parser.add_argument(
+        "--no-derived", action="store_true", help="skip rebuilding clusters, trending and approval ratios"
+    )
+    args = parser.parse_args(argv)
+
+    points = args.points or SCALES[args.scale]
+    print("generating {}".format(plan(points)), file=sys.stderr)
+    with session() as db:
+        manifest = generate(db, points, args.seed, derived=not args.no_derived)
+    with open(args.manifest, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print("manifest written to {}".format(args.manifest), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""/songpoints/ latency while /token/ is hit by a burst of logins, against a running server.
+
+    uvicorn songmap.main:app --workers 1 &
+    python -m benchmarks.load_login_burst http://localhost:8000
+"""
+import asyncio
+import sys
+import time
+import uuid
+
+import httpx
+
+from benchmarks.results import percentile
+
+READERS = 20
+DURATION_SECONDS = 10
+LOGIN_CONCURRENCY = 50
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str):
+    resp = await client.post("/token/", data={"username": username, "password": password})
+    resp.raise_for_status()
+    return resp.json()["access_token"]
+
+
+async def read_song_points(client: httpx.AsyncClient, token: str, until: float, latencies: list):
+    headers = {"Authorization": "Bearer {}".format(token)}
+    params = {"longitude": 17.107, "latitude": 48.148, "radius": 500}
+    while time.monotonic() < until:
+        start = time.perf_counter()
+        resp = await client.get("/songpoints/", params=params, headers=headers)
+        resp.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+
+
+async def login_burst(client: httpx.AsyncClient, username: str, password: str, until: float):
+    async def worker():
+        while time.monotonic() < until:
+            await login(client, username, password)
+
+    await asyncio.gather(*(worker() for _ in range(LOGIN_CONCURRENCY)))
+
+
+async def measure(client: httpx.AsyncClient, token: str, burst_credentials=None):
+    latencies = []
+    until = time.monotonic() + DURATION_SECONDS
+    tasks = [read_song_points(client, token, until, latencies) for _ in range(READERS)]
+    if burst_credentials:
+        tasks.append(login_burst(client, *burst_credentials, until))
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+async def main(base_url: str):
+    username, password = "bench-{}".format(uuid.uuid4().hex), uuid.uuid4().hex
+    limits = httpx.Limits(max_connections=READERS + LOGIN_CONCURRENCY)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        (await client.post("/users/new/", json={
+            "username": username, "email": username + "@songmap", "password": password
+        })).raise_for_status()
+        token = await login(client, username, password)
+
+        print("{:>14} {:>10} {:>10} {:>10}".format("scenario", "requests", "p50 [ms]", "p99 [ms]"))
+        for scenario, credentials in (("idle", None), ("login burst", (username, password))):
+            latencies = await measure(client, token, credentials)
+            print("{:>14} {:>10} {:>10.1f} {:>10.1f}".format(
+                scenario, len(latencies), percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000
+            ))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8000"))
@@ -0,0 +1,151 @@
+"""Mixed read/write HTTP load on the main endpoints, over generated data.
+
+    uvicorn songmap.main:app --workers 4 &
+    python -m benchmarks.load_mixed synthetic.json --url http://localhost:8000 --output load.json
+
+    python -m benchmarks.load_mixed synthetic.json --in-process --read-ratio 0.8
+
+Every virtual user logs in as a generated user through /token/ and then loops over operations: a read with
+probability --read-ratio (/songpoints/, /sat/ and /users/{owner_id}/tracks/ in READS proportions), a write
+otherwise (/users/me/songpoints/ and /users/{owner_id}/tracks/ batches in WRITES proportions). Every
+RELOGIN_EVERY operations it logs in again. --in-process drives main.app through httpx's ASGI transport, client
+and server then share one event loop and the numbers are only comparable between in-process runs.
+"""
+import argparse
+import asyncio
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import httpx
+
+from benchmarks import results
+from benchmarks.common import now
+from benchmarks.generate import Synthetic, load_manifest
+
+CONCURRENCY = 50
+DURATION_SECONDS = 60
+READ_RATIO = 0.9
+RELOGIN_EVERY = 100
+RADIUS = 500
+READS = {"GET /songpoints/": 5, "GET /sat/": 3, "GET /users/{owner_id}/tracks/": 2}
+WRITES = {"POST /users/me/songpoints/": 4, "POST /users/{owner_id}/tracks/": 1}
+WRITE_BATCH = 20
+
+
+class Scenario:
+    def __init__(self, client: httpx.AsyncClient, data: Synthetic, read_ratio: float):
+        self.client = client
+        self.data = data
+        self.read_ratio = read_ratio
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def request(self, name: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = await self.client.request(method, url, **kwargs)
+            resp.raise_for_status()
+        except httpx.HTTPError:
+            self.errors[name] += 1
+            return None
+        self.latencies[name].append(time.perf_counter() - start)
+        return resp
+
+    async def login(self, user_index: int):
+        resp = await self.request("POST /token/", "POST", "/token/", data={
+            "username": self.data.username(user_index), "password": self.data.manifest["password"]
+        })
+        return {"Authorization": "Bearer {}".format(resp.json()["access_token"])} if resp is not None else None
+
+    def _song_points(self):
+        return [
+            dict(song_id=self.data.song_id(), longitude=longitude, latitude=latitude, time_added=now().isoformat())
+            for longitude, latitude in (self.data.location() for _ in range(WRITE_BATCH))
+        ]
+
+    async def operation(self, name: str, owner_id: int, headers: dict):
+        if name in ("GET /songpoints/", "GET /sat/"):
+            longitude, latitude = self.data.location()
+            params = {"longitude": longitude, "latitude": latitude, "radius": RADIUS}
+            await self.request(name, "GET", name.split()[1], params=params, headers=headers)
+        elif name == "GET /users/{owner_id}/tracks/":
+            await self.request(name, "GET", "/users/{}/tracks/".format(self.data.user_id()), headers=headers)
+        elif name == "POST /users/me/songpoints/":
+            await self.request(name, "POST", "/users/me/songpoints/", json=self._song_points(), headers=headers)
+        else:
+            await self.request(name, "POST", "/users/{}/tracks/".format(owner_id), json={
+                "track": {"name": "load"}, "song_points": self._song_points()
+            }, headers=headers)
+
+    async def virtual_user(self, until: float):
+        user_index = self.data.user_index()
+        owner_id = self.data.manifest["first_user_id"] + user_index
+        headers = await self.login(user_index)
+        operations = 0
+        while headers is not None and time.monotonic() < until:
+            mix = READS if self.data.random.random() < self.read_ratio else WRITES
+            name = self.data.random.choices(list(mix), list(mix.values()))[0]
+            await self.operation(name, owner_id, headers)
+            operations += 1
+            if operations % RELOGIN_EVERY == 0:
+                headers = await self.login(user_index)
+
+    async def run(self, concurrency: int, duration: float):
+        started = time.perf_counter()
+        until = time.monotonic() + duration
+        await asyncio.gather(*(self.virtual_user(until) for _ in range(concurrency)))
+        seconds = time.perf_counter() - started
+        names = sorted(set(self.latencies) | set(self.errors))
+        every = [latency for latencies in self.latencies.values() for latency in latencies]
+        return [
+            results.summarize(name, self.latencies[name], seconds, self.errors[name]) for name in names
+        ] + [results.summarize("all", every, seconds, sum(self.errors.values()))]
+
+
+async def main_async(args):
+    data = Synthetic(load_manifest(args.manifest), args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency)
+    if args.in_process:
+        from songmap.main import app
+
+        await app.router.startup()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://songmap", timeout=60)
+    else:
+        app = None
+        client = httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60)
+    try:
+        async with client:
+            return await Scenario(client, data, args.read_ratio).run(args.concurrency, args.duration)
+    finally:
+        if app is not None:
+            await app.router.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mixed read/write HTTP load.")
+    parser.add_argument("manifest")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", default="http://localhost:8000")
+    target.add_argument("--in-process", action="store_true")
+    parser.add_argument("--output", default="load.json")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--duration", type=float, default=DURATION_SECONDS)
+    parser.add_argument("--read-ratio", type=float, default=READ_RATIO)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    started_at = datetime.utcnow()
+    print("{} virtual users for {} s, {:.0%} reads".format(args.concurrency, args.duration, args.read_ratio),
+          file=sys.stderr)
+    suite_results = asyncio.run(main_async(args))
+    results.print_table(suite_results)
+    results.write(args.output, "load_mixed", dict(
+        manifest=args.manifest, target="in-process" if args.in_process else args.url,
+        concurrency=args.concurrency, duration=args.duration, read_ratio=args.read_ratio, seed=args.seed
+    ), suite_results, started_at)
+
+
+if __name__ == "__main__":
+    main()
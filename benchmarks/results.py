@@ -0,0 +1,78 @@
+"""The JSON every suite run writes and benchmarks.compare reads.
+
+    {
+        "suite": "crud",
+        "started_at": "2026-10-18T09:12:44",
+        "commit": "15707f4...",
+        "environment": {"python": "3.9.18", "host": "bench-1"},
+        "config": {"manifest": "synthetic.json", "iterations": 200},
+        "results": [
+            {"name": "get_song_points_within_radius", "count": 200, "errors": 0, "seconds": 1.92,
+             "throughput": 104.2, "mean_ms": 9.6, "p50_ms": 8.8, "p90_ms": 13.1, "p99_ms": 21.7}
+        ]
+    }
+
+Latencies are in milliseconds, throughput in operations per second.
+"""
+import json
+import platform
+import subprocess
+from datetime import datetime
+from typing import List
+
+
+def percentile(values, p: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summarize(name: str, latencies: List[float], seconds: float, errors: int = 0) -> dict:
+    # latencies of the successful operations in seconds, seconds the wall time of the whole run
+    if not latencies:
+        return dict(name=name, count=0, errors=errors, seconds=seconds, throughput=0.0)
+    return dict(
+        name=name,
+        count=len(latencies),
+        errors=errors,
+        seconds=seconds,
+        throughput=len(latencies) / seconds,
+        mean_ms=sum(latencies) / len(latencies) * 1000,
+        p50_ms=percentile(latencies, 0.5) * 1000,
+        p90_ms=percentile(latencies, 0.9) * 1000,
+        p99_ms=percentile(latencies, 0.99) * 1000,
+    )
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write(path: str, suite: str, config: dict, results: List[dict], started_at: datetime):
+    with open(path, "w") as f:
+        json.dump(dict(
+            suite=suite,
+            started_at=started_at.isoformat(timespec="seconds"),
+            commit=_commit(),
+            environment=dict(python=platform.python_version(), host=platform.node()),
+            config=config,
+            results=results,
+        ), f, indent=2)
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def print_table(results: List[dict]):
+    print("{:>42} {:>8} {:>7} {:>10} {:>10} {:>10}".format("name", "count", "errors", "p50 [ms]", "p99 [ms]", "ops/s"))
+    for result in results:
+        print("{:>42} {:>8} {:>7} {:>10.2f} {:>10.2f} {:>10.1f}".format(
+            result["name"], result["count"], result["errors"],
+            result.get("p50_ms", 0.0), result.get("p99_ms", 0.0), result["throughput"]
+        ))
@@ -0,0 +1,89 @@
+"""initial schema
+
+The schema create_all built on boot before migrations, column for column and index for index. Databases
+created that way are marked as migrated with
+
+    alembic stamp 0001
+
+and then upgraded like any other, every later revision starts from this schema.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+import geoalchemy2
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS postgis")
+
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("username", sa.String(), nullable=False),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("hashed_password", sa.String(), nullable=False),
+        sa.Column("disabled", sa.Boolean(), nullable=False),
+        sa.Column("approval_ratio", sa.Integer(), nullable=False),
+        sa.Column("influence", sa.Integer(), nullable=False),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_username", "users", ["username"], unique=True)
+    op.create_index("ix_users_email", "users", ["email"])
+    op.create_index("ix_users_hashed_password", "users", ["hashed_password"])
+    op.create_index("ix_users_disabled", "users", ["disabled"])
+    op.create_index("ix_users_approval_ratio", "users", ["approval_ratio"])
+    op.create_index("ix_users_influence", "users", ["influence"])
+
+    op.create_table(
+        "songs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("artist", sa.String(), nullable=False),
+        sa.Column("title", sa.String(), nullable=False),
+        sa.Column("spotify_id", sa.String(), nullable=True),
+    )
+    op.create_index("ix_songs_id", "songs", ["id"])
+    op.create_index("ix_songs_artist", "songs", ["artist"])
+    op.create_index("ix_songs_title", "songs", ["title"])
+    op.create_index("ix_songs_spotify_id", "songs", ["spotify_id"])
+
+    op.create_table(
+        "tracks",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("name", sa.String(), nullable=True),
+    )
+    op.create_index("ix_tracks_id", "tracks", ["id"])
+    op.create_index("ix_tracks_name", "tracks", ["name"])
+
+    # no SRID, set by 0003
+    op.create_table(
+        "songpoints",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("track_id", sa.Integer(), sa.ForeignKey("tracks.id"), nullable=True),
+        sa.Column("song_id", sa.Integer(), sa.ForeignKey("songs.id"), nullable=False),
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("likes", sa.Integer(), nullable=False),
+        sa.Column("time_added", sa.DateTime(), nullable=False),
+        sa.Column("longitude", sa.Float(), nullable=True),
+        sa.Column("latitude", sa.Float(), nullable=True),
+        sa.Column("geo", geoalchemy2.Geometry(geometry_type="POINT", spatial_index=False), nullable=True),
+    )
+    op.create_index("ix_songpoints_id", "songpoints", ["id"])
+    op.create_index("ix_songpoints_likes", "songpoints", ["likes"])
+    op.create_index("ix_songpoints_time_added", "songpoints", ["time_added"])
+    op.create_index("idx_songpoints_geo", "songpoints", ["geo"], postgresql_using="gist")
+
+
+def downgrade():
+    op.drop_table("songpoints")
+    op.drop_table("tracks")
+    op.drop_table("songs")
+    op.drop_table("users")
@@ -0,0 +1,38 @@
+"""unique spotify_id
+
+Songs are upserted on spotify_id, which needs it unique. Duplicate songs are merged into the one with the
+lowest id first, their song points are moved over.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        CREATE TEMPORARY TABLE song_duplicates AS
+        SELECT id, min(id) OVER (PARTITION BY spotify_id) AS keep_id FROM songs WHERE spotify_id IS NOT NULL
+    """)
+    op.execute("""
+        UPDATE songpoints SET song_id = song_duplicates.keep_id FROM song_duplicates
+        WHERE songpoints.song_id = song_duplicates.id AND song_duplicates.id <> song_duplicates.keep_id
+    """)
+    op.execute("""
+        DELETE FROM songs USING song_duplicates
+        WHERE songs.id = song_duplicates.id AND song_duplicates.id <> song_duplicates.keep_id
+    """)
+    op.execute("DROP TABLE song_duplicates")
+    op.drop_index("ix_songs_spotify_id", table_name="songs")
+    op.create_index("ix_songs_spotify_id", "songs", ["spotify_id"], unique=True)
+
+
+def downgrade():
+    op.drop_index("ix_songs_spotify_id", table_name="songs")
+    op.create_index("ix_songs_spotify_id", "songs", ["spotify_id"])
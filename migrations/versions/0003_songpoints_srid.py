@@ -0,0 +1,30 @@
+"""songpoints srid
+
+Song point geometries get SRID 4326 (WGS 84), radius queries run on geography(geo) through a GiST index of
+their own.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+SRID = 4326
+
+
+def upgrade():
+    op.execute("ALTER TABLE songpoints ALTER COLUMN geo TYPE geometry(POINT, {0}) USING ST_SetSRID(geo, {0})".format(
+        SRID
+    ))
+    op.create_index("idx_songpoints_geo_geography", "songpoints", [sa.text("geography(geo)")], postgresql_using="gist")
+
+
+def downgrade():
+    op.drop_index("idx_songpoints_geo_geography", table_name="songpoints")
+    op.execute("ALTER TABLE songpoints ALTER COLUMN geo TYPE geometry(POINT) USING ST_SetSRID(geo, 0)")
@@ -0,0 +1,25 @@
+"""token version
+
+users.token_version, bumped to revoke the access tokens issued to a user.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the server default fills existing rows, new ones get theirs from the model
+    op.add_column("users", sa.Column("token_version", sa.Integer(), nullable=False, server_default="0"))
+    op.alter_column("users", "token_version", server_default=None)
+
+
+def downgrade():
+    op.drop_column("users", "token_version")
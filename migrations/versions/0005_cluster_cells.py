@@ -0,0 +1,42 @@
+"""cluster cells
+
+Per tile cell aggregates of song points and their songs, see songmap/clusters.py. Fill them for the song
+points already stored with `python -m songmap.maintenance --backfill`.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "songpoint_cells",
+        sa.Column("zoom", sa.Integer(), primary_key=True),
+        sa.Column("x", sa.Integer(), primary_key=True),
+        sa.Column("y", sa.Integer(), primary_key=True),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("longitude_sum", sa.Float(), nullable=False),
+        sa.Column("latitude_sum", sa.Float(), nullable=False),
+        sa.Column("likes", sa.Integer(), nullable=False),
+    )
+    op.create_table(
+        "songpoint_cell_songs",
+        sa.Column("zoom", sa.Integer(), primary_key=True),
+        sa.Column("x", sa.Integer(), primary_key=True),
+        sa.Column("y", sa.Integer(), primary_key=True),
+        sa.Column("song_id", sa.Integer(), sa.ForeignKey("songs.id"), primary_key=True),
+        sa.Column("count", sa.Integer(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("songpoint_cell_songs")
+    op.drop_table("songpoint_cells")
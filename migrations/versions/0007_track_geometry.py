@@ -0,0 +1,47 @@
+"""track geometry
+
+Precomputed track lines, point counts and bounding boxes, and the coarsest resolution that keeps each song
+point, see songmap/tracks.py. Compute them for the tracks already stored with
+`python -m songmap.maintenance --backfill`, until then those serve every point at every resolution.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+import geoalchemy2
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+SRID = 4326
+FULL_DETAIL = 3
+
+
+def upgrade():
+    op.add_column("tracks", sa.Column(
+        "line", geoalchemy2.Geometry(geometry_type="LINESTRING", srid=SRID, spatial_index=False), nullable=True
+    ))
+    op.add_column("tracks", sa.Column("point_count", sa.Integer(), nullable=False, server_default="0"))
+    op.alter_column("tracks", "point_count", server_default=None)
+    for name in ("min_longitude", "min_latitude", "max_longitude", "max_latitude"):
+        op.add_column("tracks", sa.Column(name, sa.Float(), nullable=True))
+    op.create_index("idx_tracks_line", "tracks", ["line"], postgresql_using="gist")
+    op.create_index("idx_tracks_line_geography", "tracks", [sa.text("geography(line)")], postgresql_using="gist")
+
+    op.add_column("songpoints", sa.Column(
+        "detail_level", sa.Integer(), nullable=False, server_default=str(FULL_DETAIL)
+    ))
+    op.create_index("idx_songpoints_track_detail", "songpoints", ["track_id", "detail_level"])
+
+
+def downgrade():
+    op.drop_index("idx_songpoints_track_detail", table_name="songpoints")
+    op.drop_column("songpoints", "detail_level")
+    op.drop_index("idx_tracks_line_geography", table_name="tracks")
+    op.drop_index("idx_tracks_line", table_name="tracks")
+    for name in ("max_latitude", "max_longitude", "min_latitude", "min_longitude", "point_count", "line"):
+        op.drop_column("tracks", name)
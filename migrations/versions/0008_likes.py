@@ -0,0 +1,33 @@
+"""likes
+
+One row per user and liked song point, the key the like aggregator counts likes on, see songmap/likes.py.
+song_point_id references no table, songpoints gets partitioned by 0011 and is unique on (id, time_added) only.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "likes",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("song_point_id", sa.Integer(), primary_key=True),
+        sa.Column("time_added", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_likes_song_point_id", "likes", ["song_point_id"])
+    # owner approval ratios count per owner
+    op.create_index("ix_songpoints_owner_id", "songpoints", ["owner_id"])
+
+
+def downgrade():
+    op.drop_index("ix_songpoints_owner_id", table_name="songpoints")
+    op.drop_table("likes")
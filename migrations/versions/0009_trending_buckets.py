@@ -0,0 +1,34 @@
+"""trending buckets
+
+Placements and likes per tile cell, time bucket and song, see songmap/trending.py. Fill them for the song
+points and likes already stored with `python -m songmap.maintenance --backfill`.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "song_trending_buckets",
+        sa.Column("zoom", sa.Integer(), primary_key=True),
+        sa.Column("x", sa.Integer(), primary_key=True),
+        sa.Column("y", sa.Integer(), primary_key=True),
+        sa.Column("hours", sa.Integer(), primary_key=True),
+        sa.Column("bucket", sa.DateTime(), primary_key=True),
+        sa.Column("song_id", sa.Integer(), sa.ForeignKey("songs.id"), primary_key=True),
+        sa.Column("placements", sa.Integer(), nullable=False),
+        sa.Column("likes", sa.Integer(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("song_trending_buckets")
@@ -0,0 +1,46 @@
+"""tuned indexes
+
+Drops indexes no query uses, which every insert and like flush had to maintain: duplicates of primary keys and
+indexes on hashed_password, disabled, likes, approval_ratio and influence. Adds (owner_id, track_id) on
+songpoints for the per user reads and owner_id on tracks. The GiST indexes on songpoints.geo and the unique
+indexes on songs.spotify_id and users.username stay.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+# (index, table, columns) of the former index set that go away
+DROPPED = [
+    ("ix_users_id", "users", ["id"]),
+    ("ix_users_hashed_password", "users", ["hashed_password"]),
+    ("ix_users_disabled", "users", ["disabled"]),
+    ("ix_users_approval_ratio", "users", ["approval_ratio"]),
+    ("ix_users_influence", "users", ["influence"]),
+    ("ix_songs_id", "songs", ["id"]),
+    ("ix_tracks_id", "tracks", ["id"]),
+    ("ix_songpoints_id", "songpoints", ["id"]),
+    ("ix_songpoints_likes", "songpoints", ["likes"]),
+    ("ix_songpoints_owner_id", "songpoints", ["owner_id"]),
+    ("ix_imports_id", "imports", ["id"]),
+]
+
+
+def upgrade():
+    op.create_index("idx_songpoints_owner_track", "songpoints", ["owner_id", "track_id"])
+    op.create_index("ix_tracks_owner_id", "tracks", ["owner_id"])
+    for name, table, _ in DROPPED:
+        op.drop_index(name, table_name=table)
+
+
+def downgrade():
+    for name, table, columns in DROPPED:
+        op.create_index(name, table, columns)
+    op.drop_index("ix_tracks_owner_id", table_name="tracks")
+    op.drop_index("idx_songpoints_owner_track", table_name="songpoints")
@@ -0,0 +1,121 @@
+"""partition songpoints
+
+songpoints becomes range partitioned by month on time_added, with (id, time_added) as its primary key, see
+songmap/partitions.py. The rows are copied in this revision's transaction, which holds songpoints for the
+whole copy. For a large table run the copy month by month beforehand instead, this revision then finds
+songpoints partitioned and does nothing:
+
+    alembic upgrade 0010
+    python -m songmap.partitions migrate
+    alembic upgrade head
+
+The former table is kept as songpoints_legacy, drop it once the counts match.
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-18
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+import geoalchemy2
+
+revision = "0011"
+down_revision = "0010"
+branch_labels = None
+depends_on = None
+
+SRID = 4326
+FULL_DETAIL = 3
+# partitions ahead of the current month, as songmap.partitions.MONTHS_AHEAD
+MONTHS_AHEAD = 3
+
+
+def _add_months(month: datetime, months: int):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _rename_indexes(table: str, suffix: str):
+    # index and sequence names are schema wide, free them for the new table
+    bind = op.get_bind()
+    for name in bind.execute(
+            sa.text("SELECT indexname FROM pg_indexes WHERE tablename = :table"), dict(table=table)
+    ).scalars().all():
+        op.execute('ALTER INDEX "{0}" RENAME TO "{0}{1}"'.format(name, suffix))
+    op.execute("ALTER SEQUENCE IF EXISTS songpoints_id_seq RENAME TO songpoints_id_seq{}".format(suffix))
+
+
+def _columns():
+    return [
+        sa.Column("track_id", sa.Integer(), sa.ForeignKey("tracks.id"), nullable=True),
+        sa.Column("song_id", sa.Integer(), sa.ForeignKey("songs.id"), nullable=False),
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("likes", sa.Integer(), nullable=False),
+        sa.Column("time_added", sa.DateTime(), nullable=False),
+        sa.Column("longitude", sa.Float(), nullable=True),
+        sa.Column("latitude", sa.Float(), nullable=True),
+        sa.Column("geo", geoalchemy2.Geometry(geometry_type="POINT", srid=SRID, spatial_index=False), nullable=True),
+        sa.Column("detail_level", sa.Integer(), nullable=False, server_default=str(FULL_DETAIL)),
+    ]
+
+
+def _create_indexes():
+    op.create_index("ix_songpoints_time_added", "songpoints", ["time_added"])
+    op.create_index("idx_songpoints_geo", "songpoints", ["geo"], postgresql_using="gist")
+    op.create_index("idx_songpoints_geo_geography", "songpoints", [sa.text("geography(geo)")], postgresql_using="gist")
+    op.create_index("idx_songpoints_track_detail", "songpoints", ["track_id", "detail_level"])
+    op.create_index("idx_songpoints_owner_track", "songpoints", ["owner_id", "track_id"])
+
+
+def _copy(source: str):
+    columns = "id, track_id, song_id, owner_id, likes, time_added, longitude, latitude, geo, detail_level"
+    op.execute("INSERT INTO songpoints ({0}) SELECT {0} FROM {1}".format(columns, source))
+    op.execute("SELECT setval('songpoints_id_seq', (SELECT coalesce(max(id), 0) + 1 FROM songpoints), false)")
+
+
+def upgrade():
+    bind = op.get_bind()
+    relkind = bind.execute(sa.text("SELECT relkind FROM pg_class WHERE oid = to_regclass('songpoints')")).scalar()
+    if relkind == "p":
+        return
+
+    op.rename_table("songpoints", "songpoints_legacy")
+    _rename_indexes("songpoints_legacy", "_legacy")
+    op.create_table(
+        "songpoints",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        *_columns(),
+        sa.PrimaryKeyConstraint("id", "time_added"),
+        postgresql_partition_by="RANGE (time_added)",
+    )
+    _create_indexes()
+
+    # a partition for every month with rows, songpoints_default takes what lies past the last one
+    first = bind.execute(sa.text("SELECT min(time_added) FROM songpoints_legacy")).scalar() or datetime.utcnow()
+    now = datetime.utcnow()
+    month, last = datetime(first.year, first.month, 1), _add_months(datetime(now.year, now.month, 1), MONTHS_AHEAD)
+    while month <= last:
+        op.execute("CREATE TABLE songpoints_{:%Y_%m} PARTITION OF songpoints FOR VALUES FROM ('{:%Y-%m-%d}') TO ('{:%Y-%m-%d}')".format(
+            month, month, _add_months(month, 1)
+        ))
+        month = _add_months(month, 1)
+    op.execute("CREATE TABLE songpoints_default PARTITION OF songpoints DEFAULT")
+
+    _copy("songpoints_legacy")
+    op.execute("ANALYZE songpoints")
+
+
+def downgrade():
+    # back to one table, songpoints_legacy of the upgrade is left as it is
+    op.rename_table("songpoints", "songpoints_partitioned")
+    _rename_indexes("songpoints_partitioned", "_partitioned")
+    op.create_table(
+        "songpoints",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        *_columns(),
+    )
+    _create_indexes()
+    _copy("songpoints_partitioned")
+    op.drop_table("songpoints_partitioned")
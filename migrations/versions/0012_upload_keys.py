@@ -0,0 +1,46 @@
+"""upload keys
+
+Adds song_point_keys, the idempotency keys of stored song points, and uploads, the resumable uploads of
+offline clients with the count of their song points committed so far.
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0012"
+down_revision = "0011"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "song_point_keys",
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("key", sa.String(), primary_key=True),
+        sa.Column("song_point_id", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_song_point_keys_created_at", "song_point_keys", ["created_at"])
+    op.create_table(
+        "uploads",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("track_id", sa.Integer(), sa.ForeignKey("tracks.id"), nullable=True),
+        sa.Column("total", sa.Integer(), nullable=True),
+        sa.Column("committed", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("idx_uploads_owner_key", "uploads", ["owner_id", "key"], unique=True)
+
+
+def downgrade():
+    op.drop_index("idx_uploads_owner_key", table_name="uploads")
+    op.drop_table("uploads")
+    op.drop_index("ix_song_point_keys_created_at", table_name="song_point_keys")
+    op.drop_table("song_point_keys")
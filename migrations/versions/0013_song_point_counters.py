@@ -0,0 +1,41 @@
+"""song point counters
+
+Adds users.song_points_count and users.song_points_liked, which approval_ratio is kept from instead of counting
+the user's song points on every like flush, see songmap/likes.py. Both are counted from songpoints here.
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0013"
+down_revision = "0012"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the server default fills existing rows, new ones get theirs from the model
+    op.add_column("users", sa.Column("song_points_count", sa.Integer(), nullable=False, server_default="0"))
+    op.add_column("users", sa.Column("song_points_liked", sa.Integer(), nullable=False, server_default="0"))
+    op.alter_column("users", "song_points_count", server_default=None)
+    op.alter_column("users", "song_points_liked", server_default=None)
+    op.execute("""
+        UPDATE users SET
+            song_points_count = counted.count,
+            song_points_liked = counted.liked,
+            approval_ratio = 100 * counted.liked / greatest(counted.count, 1)
+        FROM (
+            SELECT owner_id, count(*) AS count, count(*) FILTER (WHERE likes > 0) AS liked
+            FROM songpoints
+            GROUP BY owner_id
+        ) AS counted
+        WHERE users.id = counted.owner_id
+    """)
+
+
+def downgrade():
+    op.drop_column("users", "song_points_liked")
+    op.drop_column("users", "song_points_count")
@@ -0,0 +1,26 @@
+"""upload refreshed
+
+Adds uploads.refreshed, the committed count the geometry of the upload's track was last refreshed at. Uploads so
+far were refreshed with every chunk.
+
+Revision ID: 0014
+Revises: 0013
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0014"
+down_revision = "0013"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("uploads", sa.Column("refreshed", sa.Integer(), nullable=False, server_default="0"))
+    op.alter_column("uploads", "refreshed", server_default=None)
+    op.execute("UPDATE uploads SET refreshed = committed")
+
+
+def downgrade():
+    op.drop_column("uploads", "refreshed")
@@ -0,0 +1,180 @@
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import async_crud, schemas, auth, tracks, instrumentation
+from .dependencies import get_async_db, check_if_authorized, decode_cursor, set_next_cursor, time_window, TimeWindow
+
+router = APIRouter(prefix="/async", route_class=instrumentation.route_class)
+
+
+# USER
+
+@router.get("/users/{user_id}/", response_model=schemas.User)
+async def read_user(
+        user_id: int,
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: AsyncSession = Depends(get_async_db)
+):
+    return await async_crud.get_user(db=db, user_id=user_id)
+
+
+# SONG
+
+@router.post("/songs/", response_model=List[schemas.Song])
+async def create_songs(
+        songs: List[schemas.SongCreate],
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: AsyncSession = Depends(get_async_db)
+):
+    return await async_crud.create_songs(db=db, songs=songs)
+
+
+@router.get("/songs/", response_model=schemas.Song)
+async def read_song(
+        song_id: int,
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: AsyncSession = Depends(get_async_db)
+):
+    db_song = await async_crud.get_song(db=db, song_id=song_id)
+    if db_song is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Song with given id does not exist.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return db_song
+
+
+@router.get("/songs/spotify/", response_model=schemas.Song)
+async def read_song_by_spotifyid(
+        spotify_id: str,
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: AsyncSession = Depends(get_async_db)
+):
+    db_song = await async_crud.get_song_by_spotifyid(db=db, spotify_id=spotify_id)
+    if db_song is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Song with given spotify_id does not exist.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return db_song
+
+
+# SONG POINT
+
+@router.post("/users/me/songpoints/", response_model=List[schemas.SongPointResp])
+async def create_song_points_for_user(
+        song_points: List[schemas.SongPointCreate],
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: AsyncSession = Depends(get_async_db)
+):
+    return await async_crud.create_song_points_for_user(db=db, song_points=song_points, owner_id=principal.id)
+
+
+@router.post("/users/{owner_id}/songpoints/", response_model=List[schemas.SongPointResp])
+async def create_song_points_for_owner(
+        owner_id: int,
+        song_points: List[schemas.SongPointCreate],
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: AsyncSession = Depends(get_async_db)
+):
+    check_if_authorized(owner_id, principal.id)
+    return await async_crud.create_song_points_for_user(db=db, song_points=song_points, owner_id=owner_id)
+
+
+# TRACK
+
+@router.post("/users/{owner_id}/tracks/", response_model=schemas.TrackResp)
+async def create_track_w_song_points_for_user(
+        owner_id: int,
+        track: schemas.TrackCreate,
+        song_points: List[schemas.SongPointCreate],
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: AsyncSession = Depends(get_async_db)
+):
+    check_if_authorized(owner_id, principal.id)
+    return await async_crud.create_track_w_song_points_for_user(
+        db=db,
+        track=track,
+        song_points=song_points,
+        owner_id=owner_id
+    )
+
+
+@router.get("/users/{owner_id}/tracks/", response_model=List[schemas.TrackResp])
+async def read_tracks_w_song_points_by_user(
+        owner_id: int,
+        resolution: schemas.Resolution = schemas.Resolution.full,
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: AsyncSession = Depends(get_async_db)
+):
+    return await async_crud.get_tracks_w_song_points_by_user(
+        owner_id=owner_id, db=db, detail_level=tracks.detail_level(resolution.value)
+    )
+
+
+@router.get("/songpoints/", response_model=List[schemas.SongPointResp])
+async def read_near_song_points(
+        response: Response,
+        longitude: float,
+        latitude: float,
+        radius: int = 50,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+        window: TimeWindow = Depends(time_window),
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: AsyncSession = Depends(get_async_db)
+):
+    db_song_points, next_key = await async_crud.get_song_points_within_radius(
+        db=db,
+        longitude=longitude,
+        latitude=latitude,
+        radius=radius,
+        after=decode_cursor(cursor),
+        limit=limit,
+        since=window.since,
+        until=window.until
+    )
+    set_next_cursor(response, next_key)
+    return db_song_points
+
+
+# SONGPOINT + TRACK
+
+@router.get("/users/{owner_id}/sat/", response_model=schemas.SongPointsAndTracksResp)
+async def read_song_points_and_tracks_by_user(
+        owner_id: int,
+        resolution: schemas.Resolution = schemas.Resolution.full,
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: AsyncSession = Depends(get_async_db)
+):
+    return await async_crud.get_song_points_and_tracks_by_user(
+        db=db, owner_id=owner_id, detail_level=tracks.detail_level(resolution.value)
+    )
+
+
+@router.get("/sat/", response_model=schemas.SongPointsAndTracksResp)
+async def read_song_points_and_tracks_within_radius(
+        response: Response,
+        longitude: float,
+        latitude: float,
+        radius: int = 50,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+        window: TimeWindow = Depends(time_window),
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: AsyncSession = Depends(get_async_db)
+):
+    song_points_and_tracks, next_key = await async_crud.get_song_points_and_tracks_within_radius(
+        db=db,
+        longitude=longitude,
+        latitude=latitude,
+        radius=radius,
+        after=decode_cursor(cursor),
+        limit=limit,
+        since=window.since,
+        until=window.until
+    )
+    set_next_cursor(response, next_key)
+    return song_points_and_tracks
@@ -0,0 +1,173 @@
+from datetime import datetime
+from typing import Optional, List
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from . import crud, models, schemas, spatial_index, tracks
+from .crud import (
+    in_order,
+    next_key,
+    _song_points_and_tracks_page,
+    _song_points_page,
+    _track_w_song_points_options,
+)
+from .pagination import PageKey
+
+# async versions of crud, every relationship a response needs is loaded eagerly
+
+
+# USER
+async def get_user(db: AsyncSession, user_id: int):
+    return (await db.execute(select(models.User).where(models.User.id == user_id))).scalars().first()
+
+
+# SONG
+
+async def get_song(db: AsyncSession, song_id: int):
+    return (await db.execute(select(models.Song).where(models.Song.id == song_id))).scalars().first()
+
+
+async def get_song_by_spotifyid(db: AsyncSession, spotify_id: str):
+    return (await db.execute(select(models.Song).where(models.Song.spotify_id == spotify_id))).scalars().first()
+
+
+async def get_songs_by_spotifyids(db: AsyncSession, spotify_ids: List[str]):
+    if not spotify_ids:
+        return []
+    return (await db.execute(
+        select(models.Song).where(models.Song.spotify_id.in_(set(spotify_ids)))
+    )).scalars().all()
+
+
+async def create_songs(db: AsyncSession, songs: List[schemas.SongCreate]):
+    # the sync upsert on the session behind db, rows stay loaded as the session does not expire on commit
+    return await db.run_sync(crud.create_songs, songs)
+
+
+# SONG POINT
+
+async def get_song_points_by_ids(db: AsyncSession, song_point_ids: List[int]):
+    if not song_point_ids:
+        return []
+    db_song_points = (await db.execute(
+        select(models.SongPoint).options(
+            joinedload(models.SongPoint.song)
+        ).where(models.SongPoint.id.in_(song_point_ids))
+    )).scalars().all()
+
+    return in_order(db_song_points, song_point_ids)
+
+
+async def insert_song_points(
+        db: AsyncSession, song_points: List[schemas.SongPointCreate], owner_id: int, track_id: Optional[int] = None
+):
+    # chunking, idempotency keys and rollups stay in crud
+    return await db.run_sync(crud.insert_song_points, song_points, owner_id, track_id)
+
+
+async def create_song_points_for_user(
+    db: AsyncSession, song_points: List[schemas.SongPointCreate], owner_id: int
+):
+    song_point_ids = await insert_song_points(db, song_points, owner_id)
+    await db.commit()
+    return await get_song_points_by_ids(db, song_point_ids)
+
+
+async def get_song_points_within_radius(
+        db: AsyncSession,
+        longitude: float,
+        latitude: float,
+        radius: int = 50,
+        after: Optional[PageKey] = None,
+        limit: int = 100,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+):
+    if spatial_index.index.ready and since is None and until is None:
+        rows = spatial_index.index.song_points_page(longitude, latitude, radius, after, limit)
+    else:
+        rows = (await db.execute(_song_points_page(longitude, latitude, radius, after, limit, since, until))).all()
+    return await get_song_points_by_ids(db, [row.id for row in rows]), next_key(rows, limit)
+
+
+# TRACK
+
+async def get_tracks_by_ids(db: AsyncSession, track_ids: List[int]):
+    if not track_ids:
+        return []
+    return (await db.execute(
+        select(models.Track).options(*_track_w_song_points_options()).where(models.Track.id.in_(track_ids))
+    )).scalars().all()
+
+
+async def get_tracks_w_song_points_by_user(db: AsyncSession, owner_id: int, detail_level: int = models.FULL_DETAIL):
+    return (await db.execute(
+        select(models.Track).options(*_track_w_song_points_options(detail_level)).where(
+            models.Track.owner_id == owner_id
+        ).order_by(models.Track.id)
+    )).scalars().all()
+
+
+async def create_track_w_song_points_for_user(
+        db: AsyncSession,
+        track: schemas.TrackCreate,
+        song_points: List[schemas.SongPointCreate],
+        owner_id: int
+):
+    db_track = models.Track(name=track.name, owner_id=owner_id)
+    db.add(db_track)
+    await db.flush()
+
+    await insert_song_points(db, song_points, owner_id, track_id=db_track.id)
+    await db.run_sync(tracks.refresh_geometry, db_track.id)
+    await db.commit()
+
+    db.expunge(db_track)
+    return (await get_tracks_by_ids(db, [db_track.id]))[0]
+
+
+# SONGPOINT + TRACK
+
+async def get_song_points_and_tracks_by_user(
+        db: AsyncSession, owner_id: int, detail_level: int = models.FULL_DETAIL
+):
+    db_tracks = await get_tracks_w_song_points_by_user(db=db, owner_id=owner_id, detail_level=detail_level)
+    db_song_points = (await db.execute(
+        select(models.SongPoint).options(joinedload(models.SongPoint.song)).where(
+            models.SongPoint.owner_id == owner_id, models.SongPoint.track_id == None
+        ).order_by(models.SongPoint.id)
+    )).scalars().all()
+
+    return {
+        "song_points": db_song_points,
+        "tracks": db_tracks
+    }
+
+
+async def get_song_points_and_tracks_within_radius(
+        db: AsyncSession,
+        longitude: float,
+        latitude: float,
+        radius: int = 50,
+        after: Optional[PageKey] = None,
+        limit: int = 100,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+):
+    if spatial_index.index.ready and since is None and until is None:
+        rows = spatial_index.index.song_points_and_tracks_page(longitude, latitude, radius, after, limit)
+    else:
+        rows = (await db.execute(
+            _song_points_and_tracks_page(longitude, latitude, radius, after, limit, since, until)
+        )).all()
+
+    db_song_points = await get_song_points_by_ids(db, [row.id for row in rows if row.track_id == None])
+
+    relevant_track_ids = [row.track_id for row in rows if row.track_id != None]
+    db_tracks = in_order(await get_tracks_by_ids(db, relevant_track_ids), relevant_track_ids)
+
+    return {
+        "song_points": db_song_points,
+        "tracks": db_tracks
+    }, next_key(rows, limit)
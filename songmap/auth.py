@@ -1,11 +1,16 @@
+import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
 
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from sqlalchemy.orm import Session
 
 # to get a string like this run:
@@ -13,11 +18,18 @@ from sqlalchemy.orm import Session
 from songmap.secrets import SECRET_KEY_HASH
 from songmap import models, secrets
 from songmap.schemas import UserInDB
+from songmap.hashing import HashingPool
 
 SECRET_KEY = SECRET_KEY_HASH
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# concurrent bcrypt computations, further requests queue up
+PASSWORD_HASHING_WORKERS = int(os.environ.get("SONGMAP_PASSWORD_HASHING_WORKERS", 4))
+
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL_SECONDS = 60
+
 
 class Token(BaseModel):
     access_token: str
@@ -28,23 +40,98 @@ class TokenData(BaseModel):
     username: Optional[str] = None
 
 
+# verified claims of an access token, trusted for the token's lifetime
+class Principal(BaseModel):
+    id: int
+    username: str
+    disabled: bool = False
+    token_version: int = 0
+
+
+class UserCache:
+    # in-process LRU of UserInDB records by user id, entries expire after ttl seconds
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[UserInDB]:
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires < time.monotonic():
+                del self._users[user_id]
+                return None
+            self._users.move_to_end(user_id)
+            return user
+
+    def set(self, user: UserInDB):
+        with self._lock:
+            self._users[user.id] = (user, time.monotonic() + self.ttl)
+            self._users.move_to_end(user.id)
+            while len(self._users) > self.maxsize:
+                self._users.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+user_cache = UserCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+password_hashing = HashingPool(max_workers=PASSWORD_HASHING_WORKERS)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_hashing.run(pwd_context.verify, plain_password, hashed_password)
 
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return password_hashing.run(pwd_context.hash, password)
+
+
+async def verify_password_async(plain_password, hashed_password):
+    return await password_hashing.run_async(pwd_context.verify, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password):
+    return await password_hashing.run_async(pwd_context.hash, password)
 
 
 def get_user(db: Session, username: str):
     db_user = db.query(models.User).filter(models.User.username == username).first()
+    if db_user is None:
+        return None
 
-    return UserInDB(**db_user.__dict__)
+    return UserInDB.from_orm(db_user)
+
+
+def get_user_by_id(db: Session, user_id: int):
+    user = user_cache.get(user_id)
+    if user is None:
+        db_user = db.query(models.User).filter(models.User.id == user_id).first()
+        if db_user is None:
+            return None
+        user = UserInDB.from_orm(db_user)
+        user_cache.set(user)
+    return user
+
+
+def invalidate_user(user_id: int):
+    # call whenever a user row changes
+    user_cache.invalidate(user_id)
 
 
 def authenticate_user(db: Session, username: str, password: str):
@@ -65,7 +152,8 @@ def get_user_access_token(user):
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "uid": user.id, "dis": user.disabled, "ver": user.token_version},
+        expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -81,30 +169,52 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-# TODO:
-#  depend token in requests: token: str = Depends(oauth2_scheme) ... and use async
-#  this will be only function
-def get_current_user(token: str, db: Session):
-    credentials_exception = HTTPException(
+def credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def get_current_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    # one signature check, no database
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    user = get_user(db, username=token_data.username)
-    if user is None:
-        raise credentials_exception
+        principal = Principal(
+            id=payload.get("uid"),
+            username=payload.get("sub"),
+            disabled=payload.get("dis", False),
+            token_version=payload.get("ver", 0)
+        )
+    except (JWTError, ValidationError):
+        raise credentials_exception()
+    if principal.disabled:
+        raise credentials_exception()
+    return principal
+
+
+def get_principal_user(principal: Principal, db: Session):
+    # full user record, for endpoints that need more than the token claims
+    user = get_user_by_id(db, principal.id)
+    if user is None or user.disabled or user.token_version != principal.token_version:
+        raise credentials_exception()
     return user
 
 
+def get_current_user(token: str, db: Session):
+    return get_principal_user(get_current_principal(token), db)
+
+
 def login_w_username_and_password(username: str, password: str, db: Session):
     user = authenticate_user(db, username, password)
     return get_user_access_token(user)
 
+
+async def login_w_username_and_password_async(username: str, password: str, db: Session):
+    # nothing blocking runs on the event loop
+    user = await run_in_threadpool(get_user, db, username)
+    if user and not await verify_password_async(password, user.hashed_password):
+        user = None
+    return get_user_access_token(user)
+
@@ -0,0 +1,238 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, List, NamedTuple, Optional
+
+from . import events, tiles
+
+# lru, redis or off
+RESPONSE_CACHE = os.environ.get("SONGMAP_RESPONSE_CACHE", "lru")
+RESPONSE_CACHE_BYTES = int(os.environ.get("SONGMAP_RESPONSE_CACHE_BYTES", 64 * 1024 * 1024))
+# bounds staleness across workers, invalidation only reaches the local process with the lru backend
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get("SONGMAP_RESPONSE_CACHE_TTL_SECONDS", 30))
+REDIS_URL = os.environ.get("SONGMAP_REDIS_URL", "redis://localhost:6379/0")
+
+# with the cache on, query coordinates are snapped to this grid, about 11 m
+COORDINATE_QUANTUM = 0.0001
+# spatial cells cache entries are tagged with for invalidation
+CELL_ZOOM = 14
+# queries covering more cells are tagged WIDE_TAG and dropped on every write
+MAX_CELLS = 64
+WIDE_TAG = "wide"
+
+METERS_PER_DEGREE = 111320.0
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    next_cursor: Optional[str] = None
+
+    def encode(self) -> bytes:
+        return (self.next_cursor or "").encode() + b"\n" + self.body
+
+    @classmethod
+    def decode(cls, value: bytes):
+        next_cursor, body = value.split(b"\n", 1)
+        return cls(body=body, next_cursor=next_cursor.decode() or None)
+
+
+class LRUBackend:
+    # in-process, evicts least recently used entries above max_bytes
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def _remove(self, key: str):
+        value, tags, expires = self._entries.pop(key)
+        self.size -= len(value)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value: bytes, tags: List[str]):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, tags, time.monotonic() + self.ttl)
+            self.size += len(value)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, tags: Iterable[str]) -> int:
+        removed = 0
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    removed += 1
+        return removed
+
+
+class RedisBackend:
+    # shared between workers, eviction is left to the redis maxmemory policy
+    def __init__(self, client, ttl: float, prefix: str = "songmap:cache:"):
+        self.client = client
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, tags: List[str]):
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + key, value, ex=self.ttl)
+        for tag in tags:
+            pipe.sadd(self.prefix + "tag:" + tag, key)
+            pipe.expire(self.prefix + "tag:" + tag, self.ttl)
+        pipe.execute()
+
+    def invalidate(self, tags: Iterable[str]) -> int:
+        removed = 0
+        for tag in tags:
+            tag_key = self.prefix + "tag:" + tag
+            keys = self.client.smembers(tag_key)
+            if keys:
+                removed += self.client.delete(*(self.prefix + key.decode() for key in keys))
+            self.client.delete(tag_key)
+        return removed
+
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return CachedResponse.decode(value)
+
+    def set(self, key: str, response: CachedResponse, tags: List[str]):
+        self.backend.set(key, response.encode(), tags)
+
+    def invalidate(self, tags: Iterable[str]):
+        self.invalidations += self.backend.invalidate(tags)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.backend.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+def quantize(longitude: float, latitude: float):
+    return (
+        round(round(longitude / COORDINATE_QUANTUM) * COORDINATE_QUANTUM, 6),
+        round(round(latitude / COORDINATE_QUANTUM) * COORDINATE_QUANTUM, 6),
+    )
+
+
+def radius_key(
+        endpoint: str,
+        longitude: float,
+        latitude: float,
+        radius: int,
+        cursor: Optional[str],
+        limit: int,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+):
+    return "{}:{}:{}:{}:{}:{}:{}:{}".format(
+        endpoint, longitude, latitude, radius, cursor or "", limit,
+        since.isoformat() if since else "", until.isoformat() if until else ""
+    )
+
+
+def _cell_tag(x: int, y: int):
+    return "{}/{}/{}".format(CELL_ZOOM, x, y)
+
+
+def radius_tags(longitude: float, latitude: float, radius: int) -> List[str]:
+    delta_latitude = radius / METERS_PER_DEGREE
+    delta_longitude = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(tiles.clamp_latitude(latitude))), 0.01))
+    if delta_longitude >= 180:
+        return [WIDE_TAG]
+    min_x, min_y, max_x, max_y = tiles.bbox_to_tile_range(
+        longitude - delta_longitude, latitude - delta_latitude,
+        longitude + delta_longitude, latitude + delta_latitude,
+        CELL_ZOOM
+    )
+    if min_x > max_x or (max_x - min_x + 1) * (max_y - min_y + 1) > MAX_CELLS:
+        return [WIDE_TAG]
+    return [_cell_tag(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+
+def song_point_tags(song_points: List[dict]):
+    tags = {WIDE_TAG}
+    for song_point in song_points:
+        tags.add(_cell_tag(*tiles.lonlat_to_tile(song_point["longitude"], song_point["latitude"], CELL_ZOOM)))
+    return tags
+
+
+def _create_backend():
+    if RESPONSE_CACHE == "redis":
+        import redis
+        return RedisBackend(redis.Redis.from_url(REDIS_URL), ttl=RESPONSE_CACHE_TTL_SECONDS)
+    return LRUBackend(max_bytes=RESPONSE_CACHE_BYTES, ttl=RESPONSE_CACHE_TTL_SECONDS)
+
+
+response_cache = ResponseCache(_create_backend()) if RESPONSE_CACHE != "off" else None
+
+
+def query_point(longitude: float, latitude: float):
+    # quantized while responses are cached, so nearby requests share an entry, exact otherwise
+    if response_cache is None:
+        return longitude, latitude
+    return quantize(longitude, latitude)
+
+
+def read_through(key: str, tags: List[str], compute) -> CachedResponse:
+    if response_cache is None:
+        return compute()
+    cached = response_cache.get(key)
+    if cached is None:
+        cached = compute()
+        response_cache.set(key, cached, tags)
+    return cached
+
+
+@events.on_song_points_inserted
+@events.on_song_point_likes_added
+def _invalidate_song_points(song_points: List[dict]):
+    if response_cache is not None:
+        response_cache.invalidate(song_point_tags(song_points))
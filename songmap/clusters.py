@@ -0,0 +1,177 @@
+from collections import defaultdict
+from typing import List
+
+from sqlalchemy import func, select, cast, literal, Float
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from . import models, tiles
+
+# zoom levels the aggregates are stored at, coarser grids are rolled up from these when read
+# every 4 levels, so a view reads at most (2^3 x 2^3) stored cells per cell it draws at any zoom
+CELL_ZOOMS = (0, 4, 8, 12, 16)
+# a map tile at zoom z is split into 2^CELL_ZOOM_OFFSET x 2^CELL_ZOOM_OFFSET cells
+CELL_ZOOM_OFFSET = 3
+TOP_SONGS = 3
+# rows per upsert statement
+UPSERT_CHUNK = 1000
+
+
+def upsert_counters(db: Session, model, rows: List[dict], keys, counters):
+    for start in range(0, len(rows), UPSERT_CHUNK):
+        stmt = pg_insert(model).values(rows[start:start + UPSERT_CHUNK])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_={counter: getattr(model, counter) + stmt.excluded[counter] for counter in counters}
+        ))
+
+
+def add_song_points(db: Session, song_points: List[dict]):
+    # column values of new song points, batched by rollups
+    cells = defaultdict(lambda: [0, 0.0, 0.0, 0])
+    cell_songs = defaultdict(int)
+    for song_point in song_points:
+        for zoom in CELL_ZOOMS:
+            x, y = tiles.lonlat_to_tile(song_point["longitude"], song_point["latitude"], zoom)
+            cell = cells[zoom, x, y]
+            cell[0] += 1
+            cell[1] += song_point["longitude"]
+            cell[2] += song_point["latitude"]
+            cell[3] += song_point.get("likes") or 0
+            cell_songs[zoom, x, y, song_point["song_id"]] += 1
+
+    # sorted, so concurrent writers lock the shared cells in the same order
+    upsert_counters(db, models.SongPointCell, [
+        dict(zoom=zoom, x=x, y=y, count=count, longitude_sum=longitude_sum, latitude_sum=latitude_sum, likes=likes)
+        for (zoom, x, y), (count, longitude_sum, latitude_sum, likes) in sorted(cells.items())
+    ], ["zoom", "x", "y"], ["count", "longitude_sum", "latitude_sum", "likes"])
+    upsert_counters(db, models.SongPointCellSong, [
+        dict(zoom=zoom, x=x, y=y, song_id=song_id, count=count)
+        for (zoom, x, y, song_id), count in sorted(cell_songs.items())
+    ], ["zoom", "x", "y", "song_id"], ["count"])
+
+
+def add_likes(db: Session, song_points: List[dict]):
+    # likes added to existing song points, dicts with longitude, latitude and likes
+    cells = defaultdict(int)
+    for song_point in song_points:
+        for zoom in CELL_ZOOMS:
+            x, y = tiles.lonlat_to_tile(song_point["longitude"], song_point["latitude"], zoom)
+            cells[zoom, x, y] += song_point["likes"]
+
+    upsert_counters(db, models.SongPointCell, [
+        dict(zoom=zoom, x=x, y=y, count=0, longitude_sum=0.0, latitude_sum=0.0, likes=likes)
+        for (zoom, x, y), likes in sorted(cells.items())
+    ], ["zoom", "x", "y"], ["likes"])
+
+
+def add_song_points_from(db: Session, source):
+    # set based add_song_points for bulk loads, source has longitude, latitude and song_id columns
+    for zoom in CELL_ZOOMS:
+        x, y = tiles.sql_tile_x(source.c.longitude, zoom), tiles.sql_tile_y(source.c.latitude, zoom)
+        stmt = pg_insert(models.SongPointCell).from_select(
+            ["zoom", "x", "y", "count", "longitude_sum", "latitude_sum", "likes"],
+            select(
+                literal(zoom), x, y, func.count(), func.sum(source.c.longitude), func.sum(source.c.latitude), literal(0)
+            ).group_by(x, y).order_by(x, y)
+        )
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["zoom", "x", "y"],
+            set_={
+                counter: getattr(models.SongPointCell, counter) + stmt.excluded[counter]
+                for counter in ("count", "longitude_sum", "latitude_sum")
+            }
+        ))
+        stmt = pg_insert(models.SongPointCellSong).from_select(
+            ["zoom", "x", "y", "song_id", "count"],
+            select(literal(zoom), x, y, source.c.song_id, func.count()).group_by(x, y, source.c.song_id).order_by(
+                x, y, source.c.song_id
+            )
+        )
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["zoom", "x", "y", "song_id"],
+            set_={"count": models.SongPointCellSong.count + stmt.excluded["count"]}
+        ))
+
+
+def rebuild(db: Session):
+    # recomputes every aggregate from songpoints, for backfills
+    db.query(models.SongPointCellSong).delete(synchronize_session=False)
+    db.query(models.SongPointCell).delete(synchronize_session=False)
+    sp = models.SongPoint
+    for zoom in CELL_ZOOMS:
+        x, y = tiles.sql_tile_x(sp.longitude, zoom), tiles.sql_tile_y(sp.latitude, zoom)
+        db.execute(models.SongPointCell.__table__.insert().from_select(
+            ["zoom", "x", "y", "count", "longitude_sum", "latitude_sum", "likes"],
+            select(literal(zoom), x, y, func.count(), func.sum(sp.longitude), func.sum(sp.latitude), func.sum(sp.likes)).group_by(x, y)
+        ))
+        db.execute(models.SongPointCellSong.__table__.insert().from_select(
+            ["zoom", "x", "y", "song_id", "count"],
+            select(literal(zoom), x, y, sp.song_id, func.count()).group_by(x, y, sp.song_id)
+        ))
+    db.commit()
+
+
+def get_clusters(
+        db: Session,
+        min_longitude: float,
+        min_latitude: float,
+        max_longitude: float,
+        max_latitude: float,
+        zoom: int
+):
+    cell_zoom = max(0, min(zoom + CELL_ZOOM_OFFSET, CELL_ZOOMS[-1]))
+    stored_zoom = next(z for z in CELL_ZOOMS if z >= cell_zoom)
+    shift = stored_zoom - cell_zoom
+    min_x, min_y, max_x, max_y = tiles.bbox_to_tile_range(min_longitude, min_latitude, max_longitude, max_latitude, stored_zoom)
+
+    cell = models.SongPointCell
+    x, y = cell.x.op(">>")(shift), cell.y.op(">>")(shift)
+    rows = db.execute(
+        select(
+            x.label("x"),
+            y.label("y"),
+            func.sum(cell.count).label("count"),
+            cast(func.sum(cell.longitude_sum), Float).label("longitude_sum"),
+            cast(func.sum(cell.latitude_sum), Float).label("latitude_sum"),
+            func.sum(cell.likes).label("likes")
+        ).where(
+            cell.zoom == stored_zoom, cell.x.between(min_x, max_x), cell.y.between(min_y, max_y)
+        ).group_by(x, y)
+    ).all()
+
+    cell_song = models.SongPointCellSong
+    x, y = cell_song.x.op(">>")(shift), cell_song.y.op(">>")(shift)
+    song_counts = select(
+        x.label("x"), y.label("y"), cell_song.song_id, func.sum(cell_song.count).label("count")
+    ).where(
+        cell_song.zoom == stored_zoom, cell_song.x.between(min_x, max_x), cell_song.y.between(min_y, max_y)
+    ).group_by(x, y, cell_song.song_id).subquery()
+    ranked = select(
+        song_counts,
+        func.row_number().over(
+            partition_by=(song_counts.c.x, song_counts.c.y),
+            order_by=(song_counts.c.count.desc(), song_counts.c.song_id)
+        ).label("rank")
+    ).subquery()
+    top_songs = defaultdict(list)
+    for row in db.execute(
+        select(models.Song, ranked.c.x, ranked.c.y, ranked.c.count).join(
+            ranked, models.Song.id == ranked.c.song_id
+        ).where(ranked.c.rank <= TOP_SONGS).order_by(ranked.c.x, ranked.c.y, ranked.c.rank)
+    ):
+        top_songs[row.x, row.y].append({"song": row.Song, "count": row.count})
+
+    return [
+        {
+            "zoom": cell_zoom,
+            "x": row.x,
+            "y": row.y,
+            "count": row.count,
+            "longitude": row.longitude_sum / row.count,
+            "latitude": row.latitude_sum / row.count,
+            "likes": row.likes,
+            "top_songs": top_songs[row.x, row.y]
+        }
+        for row in rows if row.count
+    ]
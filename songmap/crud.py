@@ -1,8 +1,12 @@
+import math
+from datetime import datetime
 from typing import Optional, List
 
-from sqlalchemy import func
-from sqlalchemy.orm import Session
-from . import models, schemas, auth
+from sqlalchemy import func, insert, select, union_all, tuple_, text, Float
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, joinedload, selectinload, raiseload
+from . import models, schemas, auth, events, likes, rollups, spatial_index, tracks
+from .pagination import PageKey
 
 
 # USER
@@ -31,6 +35,14 @@ def create_user(db: Session, user: schemas.UserCreate):
     return db_user
 
 
+def revoke_user_tokens(db: Session, user_id: int):
+    db.query(models.User).filter(models.User.id == user_id).update(
+        {models.User.token_version: models.User.token_version + 1}, synchronize_session=False
+    )
+    db.commit()
+    auth.invalidate_user(user_id)
+
+
 # SONG
 
 def create_song(db: Session, song: schemas.SongCreate):
@@ -41,12 +53,38 @@ def create_song(db: Session, song: schemas.SongCreate):
     return db_song
 
 
-def create_songs(db: Session, songs: List[schemas.SongCreate]):
-    db_songs = []
+def _insert_songs(db: Session, songs: List[schemas.SongCreate], db_songs: dict, commit: bool):
+    missing = {}
     for song in songs:
-        db_song = create_song(db, song)
-        db_songs.append(db_song)
-    return db_songs
+        if song.spotify_id not in db_songs:
+            missing.setdefault(song.spotify_id, song)
+
+    if missing:
+        db.execute(
+            pg_insert(models.Song).values([
+                dict(artist=song.artist, title=song.title, spotify_id=song.spotify_id) for song in missing.values()
+            ]).on_conflict_do_nothing(index_elements=[models.Song.spotify_id])
+        )
+        if commit:
+            db.commit()
+        # also picks up rows inserted concurrently by another sync
+        db_songs.update({db_song.spotify_id: db_song for db_song in get_songs_by_spotifyids(db, list(missing))})
+
+    return [db_songs[song.spotify_id] for song in songs]
+
+
+def create_songs(db: Session, songs: List[schemas.SongCreate]):
+    # upsert keyed on spotify_id, returns existing or new rows in request order
+    db_songs = {db_song.spotify_id: db_song for db_song in get_songs_by_spotifyids(db, [song.spotify_id for song in songs])}
+    return _insert_songs(db, songs, db_songs, commit=True)
+
+
+def upsert_songs(db: Session, songs: List[schemas.SongCreate], known: Optional[List[models.Song]] = None):
+    # create_songs inside the caller's transaction, does not commit; known are rows already looked up
+    db_songs = {db_song.spotify_id: db_song for db_song in (
+        known if known is not None else get_songs_by_spotifyids(db, [song.spotify_id for song in songs])
+    )}
+    return _insert_songs(db, songs, db_songs, commit=False)
 
 
 def get_song(db: Session, song_id: int):
@@ -57,40 +95,255 @@ def get_song_by_spotifyid(db: Session, spotify_id: str):
     return db.query(models.Song).filter(models.Song.spotify_id == spotify_id).first()
 
 
-# TODO: consider creating also song here
-def create_song_point_for_user(
-        db: Session, song_point: schemas.SongPointCreate, owner_id: int, track_id: Optional[int] = None
-):
-    geo = 'POINT({} {})'.format(song_point.longitude, song_point.latitude)
-    db_song_point = models.SongPoint(
+def get_songs_by_spotifyids(db: Session, spotify_ids: List[str]):
+    if not spotify_ids:
+        return []
+    return db.query(models.Song).filter(models.Song.spotify_id.in_(set(spotify_ids))).all()
+
+
+# SONG POINT
+
+# rows per multi-row INSERT statement
+SONG_POINTS_INSERT_CHUNK = 1000
+
+
+def _geo_point(longitude: float, latitude: float):
+    return 'SRID={};POINT({} {})'.format(models.SRID, longitude, latitude)
+
+
+def _geography_point(longitude: float, latitude: float):
+    return func.geography(func.ST_GeomFromEWKT(_geo_point(longitude, latitude)))
+
+
+def _within_radius(point, radius: int):
+    # index-assisted, measured on a sphere like the former ST_DistanceSphere filter
+    return func.ST_DWithin(func.geography(models.SongPoint.geo), point, radius, False)
+
+
+def _distance(point):
+    # KNN operator, lets the GiST index return rows in distance order
+    return func.geography(models.SongPoint.geo).op('<->', return_type=Float)(point)
+
+
+def _after(distance, song_point_id, after: Optional[PageKey]):
+    # keyset condition, (distance, id) is a total order over song points
+    return tuple_(distance, song_point_id) > tuple_(*after)
+
+
+def _in_window(since: Optional[datetime], until: Optional[datetime]):
+    # bounds on the partition key, the planner skips the months outside them
+    conditions = []
+    if since is not None:
+        conditions.append(models.SongPoint.time_added >= since)
+    if until is not None:
+        conditions.append(models.SongPoint.time_added < until)
+    return conditions
+
+
+def next_key(rows, limit: int):
+    if len(rows) < limit:
+        return None
+    return rows[-1].distance, rows[-1].id
+
+
+def in_order(db_rows, ids: List[int]):
+    by_id = {db_row.id: db_row for db_row in db_rows}
+    return [by_id[row_id] for row_id in ids]
+
+
+def _song_point_values(song_point: schemas.SongPointCreate, owner_id: int, track_id: Optional[int] = None):
+    return dict(
         longitude=song_point.longitude,
         latitude=song_point.latitude,
-        geo=geo,
+        geo=_geo_point(song_point.longitude, song_point.latitude),
         time_added=song_point.time_added,
         song_id=song_point.song_id,
         owner_id=owner_id,
         track_id=track_id
     )
 
+
+def _song_points_added(db: Session, values: List[dict], song_point_ids: List[int]):
+    # keeps derived data in step with new song points, runs in the inserting transaction
+    rollups.add_song_points(db, values)
+    events.song_points_inserted(db, [
+        dict(value, id=song_point_id, likes=0) for value, song_point_id in zip(values, song_point_ids)
+    ])
+
+
+# TODO: consider creating also song here
+def create_song_point_for_user(
+        db: Session, song_point: schemas.SongPointCreate, owner_id: int, track_id: Optional[int] = None
+):
+    if song_point.idempotency_key is not None:
+        song_point_ids = insert_song_points(db, [song_point], owner_id, track_id)
+        db.commit()
+        return get_song_points_by_ids(db, song_point_ids)[0]
+    values = _song_point_values(song_point, owner_id, track_id)
+    db_song_point = models.SongPoint(**values)
+
     db.add(db_song_point)
+    db.flush()
+    _song_points_added(db, [values], [db_song_point.id])
     db.commit()
     db.refresh(db_song_point)
     return db_song_point
 
 
+def get_song_points_by_ids(db: Session, song_point_ids: List[int]):
+    if not song_point_ids:
+        return []
+    db_song_points = db.query(models.SongPoint).options(
+        joinedload(models.SongPoint.song)
+    ).filter(models.SongPoint.id.in_(song_point_ids)).all()
+
+    return in_order(db_song_points, song_point_ids)
+
+
+# a key stored by a concurrent transaction blocks until that one ends, then it is either taken or free
+_claim_song_point_keys = text("""
+    INSERT INTO song_point_keys (owner_id, key, created_at)
+    SELECT :owner_id, key, :now FROM unnest(CAST(:keys AS varchar[])) AS key
+    ON CONFLICT DO NOTHING
+    RETURNING key
+""")
+
+_stored_song_point_keys = text("""
+    SELECT key, song_point_id FROM song_point_keys
+    WHERE owner_id = :owner_id AND key = ANY(CAST(:keys AS varchar[]))
+""")
+
+_set_song_point_keys = text("""
+    UPDATE song_point_keys SET song_point_id = stored.song_point_id
+    FROM unnest(CAST(:keys AS varchar[]), CAST(:ids AS integer[])) AS stored(key, song_point_id)
+    WHERE song_point_keys.owner_id = :owner_id AND song_point_keys.key = stored.key
+""")
+
+
+def idempotency_keys(song_points: List[schemas.SongPointCreate], batch_key: Optional[str] = None, offset: int = 0):
+    # a point's own key, else one derived from the batch key and its position in the batch
+    return [
+        song_point.idempotency_key if song_point.idempotency_key is not None or batch_key is None
+        else "{}:{}".format(batch_key, offset + i)
+        for i, song_point in enumerate(song_points)
+    ]
+
+
+def _insert_song_points_chunk(
+        db: Session, song_points: List[schemas.SongPointCreate], keys: List[Optional[str]], owner_id: int,
+        track_id: Optional[int]
+):
+    claimed, stored = set(), {}
+    unique_keys = list(dict.fromkeys(key for key in keys if key is not None))
+    if unique_keys:
+        claimed = set(db.execute(_claim_song_point_keys, dict(
+            owner_id=owner_id, keys=unique_keys, now=datetime.utcnow()
+        )).scalars().all())
+        if len(claimed) < len(unique_keys):
+            stored = dict(db.execute(_stored_song_point_keys, dict(
+                owner_id=owner_id, keys=[key for key in unique_keys if key not in claimed]
+            )).all())
+
+    # points without a key, and the first point of every newly claimed key
+    new = []
+    for i, key in enumerate(keys):
+        if key is None or key in claimed:
+            new.append(i)
+            claimed.discard(key)
+    if not new:
+        return [stored[key] for key in keys]
+
+    values = [_song_point_values(song_points[i], owner_id, track_id) for i in new]
+    new_ids = [row.id for row in db.execute(insert(models.SongPoint).values(values).returning(models.SongPoint.id))]
+    _song_points_added(db, values, new_ids)
+
+    inserted = dict(zip(new, new_ids))
+    keyed = {keys[i]: song_point_id for i, song_point_id in inserted.items() if keys[i] is not None}
+    if keyed:
+        db.execute(_set_song_point_keys, dict(owner_id=owner_id, keys=list(keyed), ids=list(keyed.values())))
+    stored.update(keyed)
+    return [inserted[i] if i in inserted else stored[keys[i]] for i in range(len(keys))]
+
+
+def insert_song_points(
+        db: Session,
+        song_points: List[schemas.SongPointCreate],
+        owner_id: int,
+        track_id: Optional[int] = None,
+        keys: Optional[List[Optional[str]]] = None
+):
+    # multi-row INSERT ... RETURNING id, does not commit
+    # a point whose idempotency key was stored before is not inserted again, the id it got then is returned
+    if keys is None:
+        keys = idempotency_keys(song_points)
+    song_point_ids = []
+    for start in range(0, len(song_points), SONG_POINTS_INSERT_CHUNK):
+        song_point_ids.extend(_insert_song_points_chunk(
+            db, song_points[start:start + SONG_POINTS_INSERT_CHUNK], keys[start:start + SONG_POINTS_INSERT_CHUNK],
+            owner_id, track_id
+        ))
+    return song_point_ids
+
+
 def create_song_points_for_user(
-    db: Session, song_points: List[schemas.SongPointCreate], owner_id: int
+    db: Session, song_points: List[schemas.SongPointCreate], owner_id: int, batch_key: Optional[str] = None
+):
+    # whole batch in one transaction, then one query to load the points with their songs
+    # a retried batch with the same batch_key returns the points stored by the first attempt
+    keys = idempotency_keys(song_points, None if batch_key is None else "batch:" + batch_key)
+    song_point_ids = insert_song_points(db, song_points, owner_id, keys=keys)
+    db.commit()
+    return get_song_points_by_ids(db, song_point_ids)
+
+
+def _song_points_page(
+        longitude: float,
+        latitude: float,
+        radius: int,
+        after: Optional[PageKey],
+        limit: int,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+):
+    point = _geography_point(longitude, latitude)
+    distance = _distance(point)
+
+    query = select(models.SongPoint.id, distance.label("distance")).where(
+        _within_radius(point, radius), *_in_window(since, until)
+    )
+    if after is not None:
+        query = query.where(_after(distance, models.SongPoint.id, after))
+    return query.order_by(distance, models.SongPoint.id).limit(limit)
+
+
+def song_points_page_rows(
+        db: Session,
+        longitude: float,
+        latitude: float,
+        radius: int,
+        after: Optional[PageKey],
+        limit: int,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
 ):
-    db_song_points = []
-    for song_point in song_points:
-        db_song_point = create_song_point_for_user(db, song_point, owner_id)
-        db_song_points.append(db_song_point)
-    return db_song_points
+    # (id, distance) of one page, the spatial index holds no times, time windows are answered by the partitioned table
+    if spatial_index.index.ready and since is None and until is None:
+        return spatial_index.index.song_points_page(longitude, latitude, radius, after, limit)
+    return db.execute(_song_points_page(longitude, latitude, radius, after, limit, since, until)).all()
 
 
-def get_song_points_within_radius(db: Session, longitude: float, latitude: float, radius: int = 50, skip: int = 0, limit: int = 100):
-    geo = 'POINT({} {})'.format(longitude, latitude)
-    return db.query(models.SongPoint).filter(func.ST_DistanceSphere(models.SongPoint.geo, geo) < radius).offset(skip).limit(limit).all()
+def get_song_points_within_radius(
+        db: Session,
+        longitude: float,
+        latitude: float,
+        radius: int = 50,
+        after: Optional[PageKey] = None,
+        limit: int = 100,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+):
+    rows = song_points_page_rows(db, longitude, latitude, radius, after, limit, since, until)
+    return get_song_points_by_ids(db, [row.id for row in rows]), next_key(rows, limit)
 
 
 def create_track(db: Session, track: schemas.TrackCreate, owner_id: int):
@@ -101,8 +354,27 @@ def create_track(db: Session, track: schemas.TrackCreate, owner_id: int):
     return db_track
 
 
-def get_tracks_w_song_points_by_user(db: Session, owner_id: int):
-    return db.query(models.Track).filter(models.Track.owner_id == owner_id).all()
+def _track_w_song_points_options(detail_level: int = models.FULL_DETAIL):
+    # everything TrackResp serializes, anything else raises instead of lazy loading
+    song_points = models.Track.song_points
+    if detail_level < models.FULL_DETAIL:
+        song_points = song_points.and_(models.SongPoint.detail_level <= detail_level)
+    return (
+        selectinload(song_points).selectinload(models.SongPoint.song),
+        raiseload("*")
+    )
+
+
+def get_tracks_by_ids(db: Session, track_ids: List[int]):
+    if not track_ids:
+        return []
+    return db.query(models.Track).options(*_track_w_song_points_options()).filter(models.Track.id.in_(track_ids)).all()
+
+
+def get_tracks_w_song_points_by_user(db: Session, owner_id: int, detail_level: int = models.FULL_DETAIL):
+    return db.query(models.Track).options(*_track_w_song_points_options(detail_level)).filter(
+        models.Track.owner_id == owner_id
+    ).order_by(models.Track.id).all()
 
 
 def create_track_w_song_points_for_user(
@@ -111,33 +383,23 @@ def create_track_w_song_points_for_user(
         song_points: List[schemas.SongPointCreate],
         owner_id: int
 ):
+    # the track and its song points commit together
     db_track = models.Track(name=track.name, owner_id=owner_id)
     db.add(db_track)
-    db.commit()
-    db.refresh(db_track)
-
-    for song_point in song_points:
-        geo = 'POINT({} {})'.format(song_point.longitude, song_point.latitude)
-        db_song_point = models.SongPoint(
-            longitude=song_point.longitude,
-            latitude=song_point.latitude,
-            geo=geo,
-            time_added=song_point.time_added,
-            song_id=song_point.song_id,
-            owner_id=owner_id,
-            track_id=db_track.id
-        )
-        db.add(db_song_point)
+    db.flush()
 
+    insert_song_points(db, song_points, owner_id, track_id=db_track.id)
+    tracks.refresh_geometry(db, db_track.id)
     db.commit()
-    db.refresh(db_track)
 
-    return db_track
+    return get_tracks_by_ids(db, [db_track.id])[0]
 
 
-def get_song_points_and_tracks_by_user(db: Session, owner_id: int):
-    db_tracks = get_tracks_w_song_points_by_user(db=db, owner_id=owner_id)
-    db_song_points = db.query(models.SongPoint).filter(models.SongPoint.owner_id == owner_id, models.SongPoint.track_id == None).all()
+def get_song_points_and_tracks_by_user(db: Session, owner_id: int, detail_level: int = models.FULL_DETAIL):
+    db_tracks = get_tracks_w_song_points_by_user(db=db, owner_id=owner_id, detail_level=detail_level)
+    db_song_points = db.query(models.SongPoint).options(joinedload(models.SongPoint.song)).filter(
+        models.SongPoint.owner_id == owner_id, models.SongPoint.track_id == None
+    ).order_by(models.SongPoint.id).all()
 
     return {
         "song_points": db_song_points,
@@ -145,32 +407,261 @@ def get_song_points_and_tracks_by_user(db: Session, owner_id: int):
     }
 
 
-def get_song_points_and_tracks_within_radius(
+# rows fetched per round trip of the server side cursor
+STREAM_CHUNK = 1000
+
+
+def iter_song_points_and_tracks_by_user(db: Session, owner_id: int):
+    # tracks, then every song point grouped by track with loose ones last, memory stays at one chunk
+    track_rows = db.execute(
+        select(models.Track.id, models.Track.name, models.Track.owner_id).where(
+            models.Track.owner_id == owner_id
+        ).order_by(models.Track.id).execution_options(stream_results=True)
+    ).yield_per(STREAM_CHUNK)
+    for row in track_rows:
+        yield {"type": "track", "name": row.name, "id": row.id, "owner_id": row.owner_id}
+
+    sp, song = models.SongPoint, models.Song
+    song_points = db.execute(
+        select(
+            sp.track_id, sp.song_id, sp.longitude, sp.latitude, sp.time_added, sp.owner_id, sp.likes,
+            song.artist, song.title, song.spotify_id
+        ).join(song, song.id == sp.song_id).where(
+            sp.owner_id == owner_id
+        ).order_by(sp.track_id.asc().nullslast(), sp.id).execution_options(stream_results=True)
+    ).yield_per(STREAM_CHUNK)
+    for row in song_points:
+        yield {
+            "type": "song_point",
+            "track_id": row.track_id,
+            "song_id": row.song_id,
+            "longitude": row.longitude,
+            "latitude": row.latitude,
+            "time_added": row.time_added,
+            "owner_id": row.owner_id,
+            "likes": row.likes,
+            "song": {"artist": row.artist, "title": row.title, "spotify_id": row.spotify_id, "id": row.song_id}
+        }
+
+
+def _song_points_and_tracks_page(
+        longitude: float,
+        latitude: float,
+        radius: int,
+        after: Optional[PageKey],
+        limit: int,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+):
+    point = _geography_point(longitude, latitude)
+    distance = _distance(point)
+    within_radius = _within_radius(point, radius)
+    in_window = _in_window(since, until)
+
+    # a page holds loose song points and tracks, a track is placed by its nearest song point
+    loose_song_points = select(
+        models.SongPoint.id, models.SongPoint.track_id, distance.label("distance")
+    ).where(within_radius, models.SongPoint.track_id == None, *in_window)
+    nearest_track_song_points = select(
+        models.SongPoint.id, models.SongPoint.track_id, distance.label("distance")
+    ).where(within_radius, models.SongPoint.track_id != None, *in_window).distinct(models.SongPoint.track_id).order_by(
+        models.SongPoint.track_id, distance, models.SongPoint.id
+    )
+    candidates = union_all(loose_song_points, nearest_track_song_points).subquery()
+
+    query = select(candidates.c.id, candidates.c.track_id, candidates.c.distance)
+    if after is not None:
+        query = query.where(_after(candidates.c.distance, candidates.c.id, after))
+    return query.order_by(candidates.c.distance, candidates.c.id).limit(limit)
+
+
+def song_points_and_tracks_page_rows(
         db: Session,
         longitude: float,
         latitude: float,
-        radius: int = 50,
-        skip: int = 0,
-        limit: int = 100
+        radius: int,
+        after: Optional[PageKey],
+        limit: int,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
 ):
-    geo = 'POINT({} {})'.format(longitude, latitude)
+    # (id, track_id, distance) of one page, track_id is set for the nearest song point of a track
+    if spatial_index.index.ready and since is None and until is None:
+        return spatial_index.index.song_points_and_tracks_page(longitude, latitude, radius, after, limit)
+    return db.execute(_song_points_and_tracks_page(longitude, latitude, radius, after, limit, since, until)).all()
 
-    # models.SongPoint.track_id == None,
-    db_song_points_all = db.query(models.SongPoint).filter(
-        func.ST_DistanceSphere(models.SongPoint.geo, geo) < radius
-    ).offset(skip).limit(limit).all()
 
-    db_song_points = [sp for sp in db_song_points_all if sp.track_id == None]
+def get_song_points_and_tracks_within_radius(
+        db: Session,
+        longitude: float,
+        latitude: float,
+        radius: int = 50,
+        after: Optional[PageKey] = None,
+        limit: int = 100,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+):
+    rows = song_points_and_tracks_page_rows(db, longitude, latitude, radius, after, limit, since, until)
 
-    db_song_points_from_tracks = [sp for sp in db_song_points_all if sp.track_id != None]
-    relevant_track_ids = set([sp.track_id for sp in db_song_points_from_tracks])
+    db_song_points = get_song_points_by_ids(db, [row.id for row in rows if row.track_id == None])
 
-    db_tracks = []
-    for track_id in relevant_track_ids:
-        db_track = db.query(models.Track).filter(models.Track.id == track_id).first()
-        db_tracks.append(db_track)
+    relevant_track_ids = [row.track_id for row in rows if row.track_id != None]
+    db_tracks = in_order(get_tracks_by_ids(db, relevant_track_ids), relevant_track_ids)
 
     return {
         "song_points": db_song_points,
         "tracks": db_tracks
-    }
+    }, next_key(rows, limit)
+
+
+# BBOX
+
+# song points a viewport answers with unless the client asks for fewer
+BBOX_BUDGET = 1000
+BBOX_MAX_BUDGET = 5000
+# a sampled viewport is cut into a grid of cells holding about this many picks each when it is evenly filled
+BBOX_PICKS_PER_CELL = 4
+# the picks of a cell are weighted from its first index hits, in no particular order: at least this many and
+# BBOX_CANDIDATES_PER_PICK times the cell's even share of the budget among the cells holding song points
+BBOX_CANDIDATES_PER_CELL = 64
+BBOX_CANDIDATES_PER_PICK = 4
+# a song point this many days old weighs half as much as a new one with the same likes
+BBOX_HALF_LIFE_DAYS = 30
+
+# the candidates of every cell are ranked by -ln(u)/weight, the lowest keys of a cell are a sample weighted by
+# likes and recency (Efraimidis-Spirakis), u is hashed from the id so the same song points stay picked while the
+# client pans. The budget goes to the first ranks of every cell, then the second ones and so on, so the share of
+# empty and sparse cells goes to the dense ones. A song point on a cell border can match both cells.
+_sample_song_points_in_bbox = text("""
+    WITH cells AS (
+        SELECT cx, cy, ST_MakeEnvelope(
+            :min_lon + cx * :cell_width, :min_lat + cy * :cell_height,
+            :min_lon + (cx + 1) * :cell_width, :min_lat + (cy + 1) * :cell_height, :srid
+        ) AS envelope
+        FROM generate_series(0, :grid - 1) AS cx, generate_series(0, :grid - 1) AS cy
+    ), occupied AS (
+        SELECT cells.* FROM cells
+        WHERE EXISTS (
+            SELECT 1 FROM songpoints
+            WHERE songpoints.geo && cells.envelope
+              AND (CAST(:since AS timestamp) IS NULL OR songpoints.time_added >= :since)
+              AND (CAST(:until AS timestamp) IS NULL OR songpoints.time_added < :until)
+        )
+    ), share AS (
+        SELECT greatest(:candidates, ceil(:candidates_per_pick * :budget / greatest(count(*), 1)))::int AS candidates
+        FROM occupied
+    ), ranked AS (
+        SELECT candidates.id, candidates.key,
+               row_number() OVER (PARTITION BY occupied.cx, occupied.cy ORDER BY candidates.key, candidates.id) AS rank
+        FROM occupied
+        CROSS JOIN share
+        CROSS JOIN LATERAL (
+            SELECT songpoints.id,
+                   ln(-ln((songpoints.id::bigint * 2654435761 % 4294967296 + 1) / 4294967297.0))
+                   - ln(1 + songpoints.likes)
+                   + extract(epoch FROM CAST(:now AS timestamp) - songpoints.time_added) / 86400 * ln(2) / :half_life
+                   AS key
+            FROM songpoints
+            WHERE songpoints.geo && occupied.envelope
+              AND (CAST(:since AS timestamp) IS NULL OR songpoints.time_added >= :since)
+              AND (CAST(:until AS timestamp) IS NULL OR songpoints.time_added < :until)
+            LIMIT share.candidates
+        ) AS candidates
+    )
+    SELECT id FROM (
+        SELECT DISTINCT ON (id) id, key, rank FROM ranked ORDER BY id, rank
+    ) AS picked
+    ORDER BY rank, key, id
+    LIMIT :budget
+""")
+
+
+def _bbox_page(min_longitude: float, min_latitude: float, max_longitude: float, max_latitude: float, limit: int,
+               since: Optional[datetime] = None, until: Optional[datetime] = None):
+    envelope = func.ST_MakeEnvelope(min_longitude, min_latitude, max_longitude, max_latitude, models.SRID)
+    # && on geo is answered by its GiST index, for points the bounding box test is exact
+    return select(models.SongPoint.id).where(
+        models.SongPoint.geo.op("&&")(envelope), *_in_window(since, until)
+    ).limit(limit)
+
+
+def song_points_in_bbox_ids(
+        db: Session,
+        min_longitude: float,
+        min_latitude: float,
+        max_longitude: float,
+        max_latitude: float,
+        budget: int = BBOX_BUDGET,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+):
+    # (ids, sampled), every song point of the viewport while they fit the budget, a spatially uniform sample otherwise
+    ids = db.execute(_bbox_page(
+        min_longitude, min_latitude, max_longitude, max_latitude, budget + 1, since, until
+    )).scalars().all()
+    if len(ids) <= budget:
+        return sorted(ids), False
+
+    grid = max(1, int(math.sqrt(budget / BBOX_PICKS_PER_CELL)))
+    ids = db.execute(_sample_song_points_in_bbox, dict(
+        min_lon=min_longitude, min_lat=min_latitude, grid=grid,
+        cell_width=(max_longitude - min_longitude) / grid, cell_height=(max_latitude - min_latitude) / grid,
+        budget=budget, candidates=BBOX_CANDIDATES_PER_CELL, candidates_per_pick=BBOX_CANDIDATES_PER_PICK,
+        half_life=BBOX_HALF_LIFE_DAYS, now=datetime.utcnow(), srid=models.SRID, since=since, until=until
+    )).scalars().all()
+    return sorted(ids), True
+
+
+def get_song_points_in_bbox(
+        db: Session,
+        min_longitude: float,
+        min_latitude: float,
+        max_longitude: float,
+        max_latitude: float,
+        budget: int = BBOX_BUDGET,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+):
+    ids, sampled = song_points_in_bbox_ids(
+        db, min_longitude, min_latitude, max_longitude, max_latitude, budget, since, until
+    )
+    return {"song_points": get_song_points_by_ids(db, ids), "sampled": sampled}
+
+
+# TILE
+
+MVT_EXTENT = 4096
+MVT_BUFFER = 64
+# most liked song points first when a tile holds more
+MVT_MAX_FEATURES = 10000
+
+# points in the buffer around the tile are drawn as well, so symbols on a tile edge are not cut off
+_song_points_mvt = text("""
+    WITH bounds AS (
+        SELECT ST_TileEnvelope(:z, :x, :y) AS geom,
+               ST_TileEnvelope(:z, :x, :y, margin => CAST(:buffer AS float) / :extent) AS buffered
+    ), features AS (
+        SELECT ST_AsMVTGeom(ST_Transform(songpoints.geo, 3857), bounds.geom, :extent, :buffer) AS geom,
+               songpoints.id, songs.id AS song_id, songs.artist, songs.title, songpoints.likes
+        FROM songpoints
+        JOIN songs ON songs.id = songpoints.song_id
+        CROSS JOIN bounds
+        WHERE songpoints.geo && ST_Transform(bounds.buffered, :srid)
+          AND (CAST(:since AS timestamp) IS NULL OR songpoints.time_added >= :since)
+          AND (CAST(:until AS timestamp) IS NULL OR songpoints.time_added < :until)
+        ORDER BY songpoints.likes DESC, songpoints.id
+        LIMIT :max_features
+    )
+    SELECT ST_AsMVT(features, 'songpoints', :extent, 'geom', 'id') FROM features
+""")
+
+
+def get_song_points_mvt(
+        db: Session, z: int, x: int, y: int, since: Optional[datetime] = None, until: Optional[datetime] = None
+) -> bytes:
+    # the window parameters are sent as literals, so the planner folds the null checks and prunes partitions
+    tile = db.execute(_song_points_mvt, dict(
+        z=z, x=x, y=y, srid=models.SRID, extent=MVT_EXTENT, buffer=MVT_BUFFER, max_features=MVT_MAX_FEATURES,
+        since=since, until=until
+    )).scalar()
+    return bytes(tile or b"")
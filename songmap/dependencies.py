@@ -0,0 +1,86 @@
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+
+from fastapi import HTTPException, Response, status
+
+from . import pagination
+from .database import SessionLocal, AsyncSessionLocal
+
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def check_if_authorized(owner_id, current_id):
+    if owner_id != current_id:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Trying to access unauthorized content",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+def decode_cursor(cursor: Optional[str]):
+    if cursor is None:
+        return None
+    try:
+        return pagination.decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor.",
+        )
+
+
+def set_next_cursor(response: Response, next_key):
+    # pages are ordered by (distance, id), the token for the next page goes to a header
+    if next_key is not None:
+        response.headers["X-Next-Cursor"] = pagination.encode_cursor(next_key)
+
+
+class TimeWindow(NamedTuple):
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+
+
+def _naive_utc(time: Optional[datetime]):
+    # time_added is naive UTC, comparing it with an aware value would keep the planner from pruning partitions
+    if time is not None and time.tzinfo is not None:
+        return time.astimezone(timezone.utc).replace(tzinfo=None)
+    return time
+
+
+def time_window(since: Optional[datetime] = None, until: Optional[datetime] = None):
+    since, until = _naive_utc(since), _naive_utc(until)
+    if since is not None and until is not None and since >= until:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="since must be before until.",
+        )
+    return TimeWindow(since, until)
+
+
+class BBox(NamedTuple):
+    min_longitude: float
+    min_latitude: float
+    max_longitude: float
+    max_latitude: float
+
+
+def bbox(min_longitude: float, min_latitude: float, max_longitude: float, max_latitude: float):
+    # viewports crossing the antimeridian are sent as two boxes
+    if not (-180 <= min_longitude < max_longitude <= 180 and -90 <= min_latitude < max_latitude <= 90):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid bounding box.",
+        )
+    return BBox(min_longitude, min_latitude, max_longitude, max_latitude)
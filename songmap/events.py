@@ -0,0 +1,58 @@
+import logging
+from typing import Callable, List
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger("app")
+
+# called with the column values (id included) of song points once their transaction commits
+song_points_inserted_listeners: List[Callable[[List[dict]], None]] = []
+# called with id, owner_id, longitude, latitude and the likes added of song points once their transaction commits
+song_point_likes_added_listeners: List[Callable[[List[dict]], None]] = []
+
+_PENDING_KEY = "inserted_song_points"
+_PENDING_LIKES_KEY = "liked_song_points"
+
+
+def on_song_points_inserted(listener: Callable[[List[dict]], None]):
+    song_points_inserted_listeners.append(listener)
+    return listener
+
+
+def song_points_inserted(db: Session, song_points: List[dict]):
+    db.info.setdefault(_PENDING_KEY, []).extend(song_points)
+
+
+def on_song_point_likes_added(listener: Callable[[List[dict]], None]):
+    song_point_likes_added_listeners.append(listener)
+    return listener
+
+
+def song_point_likes_added(db: Session, song_points: List[dict]):
+    db.info.setdefault(_PENDING_LIKES_KEY, []).extend(song_points)
+
+
+def _dispatch(listeners, song_points: List[dict]):
+    for listener in listeners:
+        try:
+            listener(song_points)
+        except Exception:
+            # the rows are committed, a failing listener must not fail the request
+            logger.exception("song points listener %r failed", listener)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(db: Session):
+    song_points = db.info.pop(_PENDING_KEY, None)
+    if song_points:
+        _dispatch(song_points_inserted_listeners, song_points)
+    liked_song_points = db.info.pop(_PENDING_LIKES_KEY, None)
+    if liked_song_points:
+        _dispatch(song_point_likes_added_listeners, liked_song_points)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(db: Session):
+    db.info.pop(_PENDING_KEY, None)
+    db.info.pop(_PENDING_LIKES_KEY, None)
@@ -0,0 +1,69 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+
+
+class HashingPool:
+    # bounded pool for deliberately slow password hashing, bcrypt releases the GIL so threads run it in parallel
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password-hashing")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _run(self, submitted: float, fn, args):
+        waited = time.monotonic() - submitted
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    def submit(self, fn, *args) -> Future:
+        with self._lock:
+            self.queued += 1
+        return self._executor.submit(self._run, time.monotonic(), fn, args)
+
+    def run(self, fn, *args):
+        return self.submit(fn, *args).result()
+
+    async def run_async(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+            }
+
+    def prometheus_metrics(self) -> str:
+        stats = self.stats()
+        lines = []
+        for name, kind, description, value in (
+                ("songmap_password_hashing_queued", "gauge", "Hashes waiting for a worker.", stats["queued"]),
+                ("songmap_password_hashing_running", "gauge", "Hashes being computed.", stats["running"]),
+                ("songmap_password_hashing_wait_seconds_total", "counter", "Time hashes waited for a worker.",
+                 stats["wait_seconds_total"]),
+                ("songmap_password_hashing_wait_seconds_max", "gauge", "Longest wait of a hash for a worker.",
+                 stats["wait_seconds_max"]),
+        ):
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} {}".format(name, kind))
+            lines.append("{} {}".format(name, value))
+        return "\n".join(lines) + "\n"
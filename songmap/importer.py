@@ -0,0 +1,288 @@
+"""Bulk import of GPS traces (GPX or CSV) as a track of song points.
+
+    python -m songmap.importer history.gpx --owner-id 1
+
+CSV files need longitude, latitude, time_added and spotify_id columns, artist and title are optional.
+GPX track points carry the song as spotify_id, artist and title elements inside <extensions>.
+Songs unknown by spotify_id are created when artist and title are given, otherwise the point is rejected.
+"""
+import argparse
+import csv
+import io
+import os
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime, timezone
+from itertools import islice
+from typing import IO, Iterator, List, Optional
+
+from sqlalchemy import insert, select, literal, func, table, column, text, Float, DateTime, Integer
+from sqlalchemy.orm import Session
+
+from . import models, schemas, auth, crud, clusters, events, likes, tracks, trending
+
+try:
+    import numpy as np
+except ImportError:  # optional, only needed for imports
+    np = None
+
+IMPORT_CHUNK = 50000
+FORMATS = ("csv", "gpx")
+
+_create_staging = text("""
+    CREATE TEMPORARY TABLE IF NOT EXISTS songpoints_import (
+        longitude float8, latitude float8, time_added timestamp, song_id integer
+    ) ON COMMIT DELETE ROWS
+""")
+_staging = table(
+    "songpoints_import",
+    column("longitude", Float),
+    column("latitude", Float),
+    column("time_added", DateTime),
+    column("song_id", Integer)
+)
+
+
+def detect_format(filename: str):
+    extension = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    if extension not in FORMATS:
+        raise ValueError("Unsupported file format, expected one of: {}".format(", ".join(FORMATS)))
+    return extension
+
+
+# readers yield (longitude, latitude, time, spotify_id, artist, title) as strings
+
+def read_csv(fileobj: IO[bytes]) -> Iterator[tuple]:
+    reader = csv.DictReader(io.TextIOWrapper(fileobj, encoding="utf-8", newline=""))
+    missing = {"longitude", "latitude", "time_added", "spotify_id"} - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError("CSV is missing columns: {}".format(", ".join(sorted(missing))))
+    for row in reader:
+        yield row["longitude"], row["latitude"], row["time_added"], row["spotify_id"], row.get("artist"), row.get("title")
+
+
+def _local_name(tag: str):
+    return tag.rsplit("}", 1)[-1]
+
+
+def read_gpx(fileobj: IO[bytes], track_names: List[str]) -> Iterator[tuple]:
+    # streamed, every parsed trkpt is dropped from the tree
+    elements = []
+    for event, element in ElementTree.iterparse(fileobj, events=("start", "end")):
+        if event == "start":
+            elements.append(element)
+            continue
+        elements.pop()
+        name = _local_name(element.tag)
+        if name == "name" and elements and _local_name(elements[-1].tag) == "trk" and not track_names:
+            track_names.append((element.text or "").strip())
+        elif name == "trkpt":
+            fields = {"time": None, "spotify_id": None, "artist": None, "title": None}
+            for child in element.iter():
+                child_name = _local_name(child.tag)
+                if child_name in fields:
+                    fields[child_name] = (child.text or "").strip()
+            yield (
+                element.get("lon"), element.get("lat"), fields["time"],
+                fields["spotify_id"], fields["artist"], fields["title"]
+            )
+            if elements:
+                elements[-1].remove(element)
+
+
+def _floats(values: List[Optional[str]]):
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        result = np.full(len(values), np.nan)
+        for i, value in enumerate(values):
+            try:
+                result[i] = float(value)
+            except (TypeError, ValueError):
+                pass
+        return result
+
+
+def _parse_time(value: Optional[str]):
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _times(values: List[Optional[str]]):
+    # naive UTC, like SongPoint.time_added
+    try:
+        return np.array([value[:-1] if value.endswith("Z") else value for value in values], dtype="datetime64[us]")
+    except (AttributeError, TypeError, ValueError):
+        return np.array([_parse_time(value) or "NaT" for value in values], dtype="datetime64[us]")
+
+
+def _resolve_songs(db: Session, chunk: List[tuple], spotify_ids, song_ids: dict):
+    # one IN lookup per chunk, creates the songs that come with artist and title in the chunk's transaction
+    unknown = {spotify_id for spotify_id in spotify_ids if spotify_id and spotify_id not in song_ids}
+    if not unknown:
+        return
+    known = crud.get_songs_by_spotifyids(db, list(unknown))
+    for db_song in known:
+        song_ids[db_song.spotify_id] = db_song.id
+
+    creatable = {}
+    for _, _, _, spotify_id, artist, title in chunk:
+        if spotify_id in unknown and spotify_id not in song_ids and artist and title:
+            creatable.setdefault(spotify_id, schemas.SongCreate(artist=artist, title=title, spotify_id=spotify_id))
+    if creatable:
+        for db_song in crud.upsert_songs(db, list(creatable.values()), known):
+            song_ids[db_song.spotify_id] = db_song.id
+
+
+def _import_chunk(db: Session, chunk: List[tuple], owner_id: int, track_id: int, song_ids: dict):
+    columns = list(zip(*chunk))
+    longitudes, latitudes, times = _floats(list(columns[0])), _floats(list(columns[1])), _times(list(columns[2]))
+    spotify_ids = list(columns[3])
+
+    _resolve_songs(db, chunk, spotify_ids, song_ids)
+    song_id_array = np.fromiter((song_ids.get(spotify_id, -1) for spotify_id in spotify_ids), np.int64, len(chunk))
+
+    valid = (
+        np.isfinite(longitudes) & np.isfinite(latitudes)
+        & (np.abs(longitudes) <= 180) & (np.abs(latitudes) <= 90)
+        & ~np.isnat(times) & (song_id_array >= 0)
+    )
+    rows = np.flatnonzero(valid)
+    if not len(rows):
+        return 0
+
+    buffer = io.StringIO()
+    buffer.writelines(
+        "{!r},{!r},{},{}\n".format(longitude, latitude, time_added, song_id)
+        for longitude, latitude, time_added, song_id in zip(
+            longitudes[rows].tolist(),
+            latitudes[rows].tolist(),
+            np.datetime_as_string(times[rows], unit="us").tolist(),
+            song_id_array[rows].tolist()
+        )
+    )
+    buffer.seek(0)
+
+    db.execute(_create_staging)
+    with db.connection().connection.cursor() as cursor:
+        cursor.copy_expert(
+            "COPY songpoints_import (longitude, latitude, time_added, song_id) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+
+    inserted = db.execute(insert(models.SongPoint).from_select(
+        ["longitude", "latitude", "geo", "time_added", "song_id", "owner_id", "track_id", "likes"],
+        select(
+            _staging.c.longitude,
+            _staging.c.latitude,
+            func.ST_SetSRID(func.ST_MakePoint(_staging.c.longitude, _staging.c.latitude), models.SRID),
+            _staging.c.time_added,
+            _staging.c.song_id,
+            literal(owner_id),
+            literal(track_id),
+            literal(0)
+        )
+    ).returning(
+        models.SongPoint.id, models.SongPoint.longitude, models.SongPoint.latitude, models.SongPoint.song_id
+    )).all()
+
+    song_points = [
+        dict(
+            id=row.id, longitude=row.longitude, latitude=row.latitude, song_id=row.song_id,
+            owner_id=owner_id, track_id=track_id, likes=0
+        )
+        for row in inserted
+    ]
+    clusters.add_song_points_from(db, _staging)
+    trending.add_song_points_from(db, _staging)
+    # one owner row per chunk, invalidated once the import is done
+    likes.add_song_points(db, song_points)
+    events.song_points_inserted(db, song_points)
+    return len(inserted)
+
+
+def run_import(
+        db: Session,
+        fileobj: IO[bytes],
+        owner_id: int,
+        format: str,
+        filename: Optional[str] = None,
+        track_name: Optional[str] = None
+) -> models.Import:
+    if np is None:
+        raise RuntimeError("Imports need numpy installed")
+
+    db_track = models.Track(name=track_name or filename, owner_id=owner_id)
+    db.add(db_track)
+    db.flush()
+    record = models.Import(
+        owner_id=owner_id, track_id=db_track.id, filename=filename, format=format,
+        status="running", started_at=datetime.utcnow()
+    )
+    db.add(record)
+    db.commit()
+
+    track_names = []
+    records = read_gpx(fileobj, track_names) if format == "gpx" else read_csv(fileobj)
+    song_ids = {}
+    try:
+        while True:
+            chunk = list(islice(records, IMPORT_CHUNK))
+            if not chunk:
+                break
+            imported = _import_chunk(db, chunk, owner_id, db_track.id, song_ids)
+            # progress is committed together with the chunk
+            record.rows_read += len(chunk)
+            record.rows_imported += imported
+            record.rows_rejected += len(chunk) - imported
+            db.commit()
+        if track_names and not track_name:
+            db_track.name = track_names[0]
+        tracks.refresh_geometry(db, db_track.id)
+        record.status = "done"
+    except Exception as e:
+        db.rollback()
+        record.status = "failed"
+        record.error = str(e)
+    record.finished_at = datetime.utcnow()
+    db.commit()
+    auth.invalidate_user(owner_id)
+    db.refresh(record)
+    return record
+
+
+def get_import(db: Session, import_id: int):
+    return db.query(models.Import).filter(models.Import.id == import_id).first()
+
+
+def main(argv=None):
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Import a GPX or CSV trace as a track of song points.")
+    parser.add_argument("path")
+    parser.add_argument("--owner-id", type=int, required=True)
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument("--track-name")
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        with open(args.path, "rb") as fileobj:
+            record = run_import(
+                db, fileobj, args.owner_id, args.format or detect_format(args.path),
+                filename=os.path.basename(args.path), track_name=args.track_name
+            )
+        elapsed = (record.finished_at - record.started_at).total_seconds()
+        print("import {} {}: {} read, {} imported, {} rejected in {:.1f} s{}".format(
+            record.id, record.status, record.rows_read, record.rows_imported, record.rows_rejected, elapsed,
+            ", error: {}".format(record.error) if record.error else ""
+        ))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""Where the time of a request goes: SQL, ORM lazy loads and response serialization.
+
+Statements are timed by cursor events on the engines, lazy loads are counted by a do_orm_execute hook on every
+Session and serialization is the time between the endpoint returning and FastAPI handing back the response,
+plus json_body for the cached endpoints. All of it lands on the RequestStats of the current request, which the
+middleware adds up per route and sends back as a Server-Timing header:
+
+    Server-Timing: db;dur=41.2;desc="7 queries", slowest;dur=30.5, lazy;desc="5 loads", serialize;dur=12.8, total;dur=61.0
+
+GET /metrics serves the per route totals in the Prometheus text format, counted per worker process.
+Statements run after the middleware returned, by a streaming body or a background task, are not counted.
+
+With SONGMAP_SLOW_QUERY_MS set, statements slower than that are logged with their plan, taken by EXPLAIN on
+the same connection, so temporary tables and the transaction snapshot are those the statement saw.
+"""
+import asyncio
+import functools
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger("app")
+
+INSTRUMENTATION = os.environ.get("SONGMAP_INSTRUMENTATION", "1") == "1"
+# milliseconds, 0 disables the slow query log
+SLOW_QUERY_MS = float(os.environ.get("SONGMAP_SLOW_QUERY_MS", 0))
+SLOW_QUERY_EXPLAIN = os.environ.get("SONGMAP_SLOW_QUERY_EXPLAIN", "1") == "1"
+# statements worth an EXPLAIN, DDL, COPY and the like are only logged
+EXPLAINABLE = ("select", "insert", "update", "delete", "with")
+# upper bounds of the request duration histogram, seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED_ROUTE = "unmatched"
+
+
+class RequestStats:
+    def __init__(self):
+        self.route = UNMATCHED_ROUTE
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+        self.lazy_loads = 0
+        self.serialize_seconds = 0.0
+        self.endpoint_finished = None
+
+    def add_query(self, statement: str, seconds: float):
+        self.queries += 1
+        self.db_seconds += seconds
+        if seconds > self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement
+
+    def server_timing(self, total_seconds: float) -> str:
+        return ", ".join((
+            'db;dur={:.1f};desc="{} queries"'.format(self.db_seconds * 1000, self.queries),
+            "slowest;dur={:.1f}".format(self.slowest_seconds * 1000),
+            'lazy;desc="{} loads"'.format(self.lazy_loads),
+            "serialize;dur={:.1f}".format(self.serialize_seconds * 1000),
+            "total;dur={:.1f}".format(total_seconds * 1000),
+        ))
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+@contextmanager
+def serializing():
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _current.get()
+        if stats is not None:
+            stats.serialize_seconds += time.perf_counter() - started
+
+
+class RouteStats:
+    def __init__(self):
+        self.requests = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(DURATION_BUCKETS) + 1)
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.lazy_loads = 0
+        self.serialize_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+
+    def add(self, stats: RequestStats, seconds: float):
+        self.requests += 1
+        self.seconds += seconds
+        self.buckets[bisect_left(DURATION_BUCKETS, seconds)] += 1
+        self.queries += stats.queries
+        self.db_seconds += stats.db_seconds
+        self.lazy_loads += stats.lazy_loads
+        self.serialize_seconds += stats.serialize_seconds
+        if stats.slowest_seconds > self.slowest_seconds:
+            self.slowest_seconds = stats.slowest_seconds
+            self.slowest_statement = stats.slowest_statement
+
+
+# (method, route) -> RouteStats, only touched from the event loop
+routes: Dict[tuple, RouteStats] = {}
+
+
+def record(method: str, stats: RequestStats, seconds: float):
+    route_stats = routes.get((method, stats.route))
+    if route_stats is None:
+        route_stats = routes[method, stats.route] = RouteStats()
+    route_stats.add(stats, seconds)
+
+
+def route_stats():
+    return [
+        {
+            "method": method,
+            "route": route,
+            "requests": stats.requests,
+            "mean_ms": stats.seconds * 1000 / stats.requests,
+            "mean_queries": stats.queries / stats.requests,
+            "mean_db_ms": stats.db_seconds * 1000 / stats.requests,
+            "mean_lazy_loads": stats.lazy_loads / stats.requests,
+            "mean_serialize_ms": stats.serialize_seconds * 1000 / stats.requests,
+            "slowest_query_ms": stats.slowest_seconds * 1000,
+            "slowest_query": stats.slowest_statement,
+        }
+        for (method, route), stats in sorted(routes.items(), key=lambda item: (item[0][1], item[0][0]))
+    ]
+
+
+def _labels(method: str, route: str, **extra) -> str:
+    labels = dict(method=method, route=route, **extra)
+    return ",".join(
+        '{}="{}"'.format(name, value.replace("\\", "\\\\").replace('"', '\\"')) for name, value in labels.items()
+    )
+
+
+_METRICS = (
+    ("songmap_requests_total", "counter", "Requests served.", lambda stats: stats.requests),
+    ("songmap_db_queries_total", "counter", "SQL statements executed.", lambda stats: stats.queries),
+    ("songmap_db_seconds_total", "counter", "Time spent executing SQL statements.", lambda stats: stats.db_seconds),
+    ("songmap_orm_lazy_loads_total", "counter", "Relationships loaded lazily.", lambda stats: stats.lazy_loads),
+    ("songmap_serialize_seconds_total", "counter", "Time spent serializing responses.",
+     lambda stats: stats.serialize_seconds),
+    ("songmap_db_slowest_query_seconds", "gauge", "Slowest SQL statement executed.",
+     lambda stats: stats.slowest_seconds),
+)
+
+
+def prometheus_metrics() -> str:
+    lines = []
+    for name, kind, description, value in _METRICS:
+        lines.append("# HELP {} {}".format(name, description))
+        lines.append("# TYPE {} {}".format(name, kind))
+        for (method, route), stats in routes.items():
+            lines.append("{}{{{}}} {}".format(name, _labels(method, route), value(stats)))
+
+    name = "songmap_request_duration_seconds"
+    lines.append("# HELP {} Request duration.".format(name))
+    lines.append("# TYPE {} histogram".format(name))
+    for (method, route), stats in routes.items():
+        cumulative = 0
+        for bound, count in zip(DURATION_BUCKETS + ("+Inf",), stats.buckets):
+            cumulative += count
+            lines.append("{}_bucket{{{}}} {}".format(name, _labels(method, route, le=str(bound)), cumulative))
+        lines.append("{}_sum{{{}}} {}".format(name, _labels(method, route), stats.seconds))
+        lines.append("{}_count{{{}}} {}".format(name, _labels(method, route), stats.requests))
+    return "\n".join(lines) + "\n"
+
+
+def _explain(conn, statement: str, parameters) -> Optional[str]:
+    if not statement.lstrip().lower().startswith(EXPLAINABLE):
+        return None
+    conn.info["explaining"] = True
+    try:
+        return "\n".join(conn.exec_driver_sql("EXPLAIN " + statement, parameters).scalars().all())
+    except Exception as e:
+        return "EXPLAIN failed: {}".format(e)
+    finally:
+        conn.info["explaining"] = False
+
+
+def _log_slow_query(conn, statement: str, parameters, executemany: bool, seconds: float):
+    stats = _current.get()
+    plan = _explain(conn, statement, parameters) if SLOW_QUERY_EXPLAIN and not executemany else None
+    logger.warning(
+        "slow query %.1f ms on %s\n%s\nparameters: %r%s",
+        seconds * 1000, stats.route if stats is not None else "no request", statement, parameters,
+        "\nplan:\n" + plan if plan else ""
+    )
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # keyed by the execution context, statements run while one is timed (EXPLAIN) get their own entry
+    conn.info.setdefault("query_started", {})[context] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_started"].pop(context)
+    if conn.info.get("explaining"):
+        return
+    stats = _current.get()
+    if stats is not None:
+        stats.add_query(statement, seconds)
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        _log_slow_query(conn, statement, parameters, executemany, seconds)
+
+
+def _handle_error(exception_context):
+    # a statement that raised gets no after_cursor_execute, its start time is dropped here
+    if exception_context.connection is not None:
+        exception_context.connection.info.get("query_started", {}).pop(exception_context.execution_context, None)
+
+
+def _count_lazy_loads(orm_execute_state):
+    if orm_execute_state.lazy_loaded_from is not None:
+        stats = _current.get()
+        if stats is not None:
+            stats.lazy_loads += 1
+
+
+def install(engine: Engine):
+    # an AsyncEngine is instrumented through its sync_engine
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    if not event.contains(Session, "do_orm_execute", _count_lazy_loads):
+        event.listen(Session, "do_orm_execute", _count_lazy_loads)
+
+
+def _finish_endpoint():
+    stats = _current.get()
+    if stats is not None:
+        stats.endpoint_finished = time.perf_counter()
+
+
+def _timed_endpoint(call):
+    # marks when the endpoint returned, what FastAPI does afterwards is serialization
+    if asyncio.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def endpoint(*args, **kwargs):
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                _finish_endpoint()
+    else:
+        @functools.wraps(call)
+        def endpoint(*args, **kwargs):
+            try:
+                return call(*args, **kwargs)
+            finally:
+                _finish_endpoint()
+    return endpoint
+
+
+class InstrumentedRoute(APIRoute):
+    def get_route_handler(self):
+        self.dependant.call = _timed_endpoint(self.dependant.call)
+        handler = super().get_route_handler()
+
+        async def instrumented_handler(request):
+            stats = _current.get()
+            if stats is not None:
+                stats.route = self.path
+            response = await handler(request)
+            if stats is not None and stats.endpoint_finished is not None:
+                stats.serialize_seconds += time.perf_counter() - stats.endpoint_finished
+            return response
+
+        return instrumented_handler
+
+
+route_class = InstrumentedRoute if INSTRUMENTATION else APIRoute
+
+
+async def middleware(request, call_next):
+    stats = RequestStats()
+    token = _current.set(stats)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _current.reset(token)
+    seconds = time.perf_counter() - started
+    record(request.method, stats, seconds)
+    response.headers["Server-Timing"] = stats.server_timing(seconds)
+    return response
@@ -0,0 +1,344 @@
+"""Like counting off the request path.
+
+POST /songpoints/{id}/likes/ only appends a LikeEvent to a queue. A LikeAggregator drains the queue every
+FLUSH_SECONDS and applies the coalesced increments in one transaction, so a song point liked a thousand times
+between flushes takes one row lock instead of a thousand.
+
+The likes table is the idempotency key: a user likes a song point at most once, so events replayed after a
+failed flush or sent twice by a client are dropped by ON CONFLICT DO NOTHING.
+
+User.influence counts the likes received, User.approval_ratio is the percentage of the user's song points
+liked at least once. It is kept from the counters User.song_points_count, raised by add_song_points from the
+batched rollups of new song points (see rollups.py), and User.song_points_liked, raised here when a song point
+gets its first like.
+
+Run the aggregator on its own with the redis queue, and SONGMAP_LIKE_AGGREGATOR=0 on the API workers:
+
+    python -m songmap.likes
+"""
+import logging
+import os
+import threading
+from collections import Counter, deque
+from datetime import datetime
+from typing import List, NamedTuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import auth, clusters, events, trending
+
+logger = logging.getLogger("app")
+
+# memory or redis, redis shares one queue between workers
+LIKE_QUEUE = os.environ.get("SONGMAP_LIKE_QUEUE", "memory")
+# drain the queue from a thread of this process
+LIKE_AGGREGATOR = os.environ.get("SONGMAP_LIKE_AGGREGATOR", "1") == "1"
+FLUSH_SECONDS = float(os.environ.get("SONGMAP_LIKE_FLUSH_SECONDS", 1))
+REDIS_URL = os.environ.get("SONGMAP_REDIS_URL", "redis://localhost:6379/0")
+# events applied per transaction
+FLUSH_BATCH = 10000
+# events the memory queue holds before likes are refused
+MAX_PENDING = 1000000
+
+
+class LikeEvent(NamedTuple):
+    user_id: int
+    song_point_id: int
+    time_added: datetime
+
+    def encode(self) -> bytes:
+        return "{}:{}:{}".format(self.user_id, self.song_point_id, self.time_added.isoformat()).encode()
+
+    @classmethod
+    def decode(cls, value: bytes):
+        user_id, song_point_id, time_added = value.decode().split(":", 2)
+        return cls(int(user_id), int(song_point_id), datetime.fromisoformat(time_added))
+
+
+class MemoryQueue:
+    # in-process, events are lost with the process
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        self._events = deque()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._events)
+
+    def put(self, like: LikeEvent) -> bool:
+        with self._lock:
+            if len(self._events) >= self.max_pending:
+                return False
+            self._events.append(like)
+            return True
+
+    def take(self, count: int) -> List[LikeEvent]:
+        with self._lock:
+            return [self._events.popleft() for _ in range(min(count, len(self._events)))]
+
+    def put_back(self, likes: List[LikeEvent]):
+        with self._lock:
+            self._events.extendleft(reversed(likes))
+
+
+class RedisQueue:
+    # shared between workers, take is a MULTI/EXEC so two aggregators never get the same events
+    def __init__(self, client, key: str = "songmap:likes"):
+        self.client = client
+        self.key = key
+
+    def __len__(self):
+        return self.client.llen(self.key)
+
+    def put(self, like: LikeEvent) -> bool:
+        self.client.rpush(self.key, like.encode())
+        return True
+
+    def take(self, count: int) -> List[LikeEvent]:
+        pipe = self.client.pipeline()
+        pipe.lrange(self.key, 0, count - 1)
+        pipe.ltrim(self.key, count, -1)
+        values, _ = pipe.execute()
+        return [LikeEvent.decode(value) for value in values]
+
+    def put_back(self, likes: List[LikeEvent]):
+        if likes:
+            self.client.lpush(self.key, *(like.encode() for like in reversed(likes)))
+
+
+# likes of missing song points are dropped by the join, already stored likes by the primary key
+_insert_likes = text("""
+    INSERT INTO likes (user_id, song_point_id, time_added)
+    SELECT new.user_id, new.song_point_id, new.time_added
+    FROM unnest(
+        CAST(:user_ids AS integer[]), CAST(:song_point_ids AS integer[]), CAST(:times AS timestamp[])
+    ) AS new(user_id, song_point_id, time_added)
+    JOIN songpoints ON songpoints.id = new.song_point_id
+    ON CONFLICT DO NOTHING
+    RETURNING song_point_id
+""")
+
+# rows are locked in id order, concurrent flushes cannot deadlock
+_add_song_point_likes = text("""
+    WITH locked AS (
+        SELECT id FROM songpoints WHERE id = ANY(CAST(:ids AS integer[])) ORDER BY id FOR UPDATE
+    )
+    UPDATE songpoints SET likes = songpoints.likes + added.likes
+    FROM unnest(CAST(:ids AS integer[]), CAST(:likes AS integer[])) AS added(id, likes)
+    WHERE songpoints.id = added.id AND songpoints.id IN (SELECT id FROM locked)
+    RETURNING songpoints.id, songpoints.owner_id, songpoints.song_id, songpoints.longitude, songpoints.latitude,
+        songpoints.likes = added.likes AS first_liked
+""")
+
+_add_owner_likes = text("""
+    WITH locked AS (
+        SELECT id FROM users WHERE id = ANY(CAST(:ids AS integer[])) ORDER BY id FOR UPDATE
+    )
+    UPDATE users SET
+        influence = users.influence + added.likes,
+        song_points_liked = users.song_points_liked + added.liked,
+        approval_ratio = 100 * (users.song_points_liked + added.liked) / greatest(users.song_points_count, 1)
+    FROM unnest(
+        CAST(:ids AS integer[]), CAST(:likes AS integer[]), CAST(:liked AS integer[])
+    ) AS added(id, likes, liked)
+    WHERE users.id = added.id AND users.id IN (SELECT id FROM locked)
+""")
+
+_add_owner_song_points = text("""
+    WITH locked AS (
+        SELECT id FROM users WHERE id = ANY(CAST(:ids AS integer[])) ORDER BY id FOR UPDATE
+    )
+    UPDATE users SET
+        song_points_count = users.song_points_count + added.count,
+        approval_ratio = 100 * users.song_points_liked / greatest(users.song_points_count + added.count, 1)
+    FROM unnest(CAST(:ids AS integer[]), CAST(:counts AS integer[])) AS added(id, count)
+    WHERE users.id = added.id AND users.id IN (SELECT id FROM locked)
+""")
+
+# song points of a partition leaving songpoints, see partitions.detach_partitions
+_remove_owner_song_points = """
+    UPDATE users SET
+        song_points_count = users.song_points_count - removed.count,
+        song_points_liked = users.song_points_liked - removed.liked,
+        approval_ratio = 100 * (users.song_points_liked - removed.liked)
+            / greatest(users.song_points_count - removed.count, 1)
+    FROM (
+        SELECT owner_id, count(*) AS count, count(*) FILTER (WHERE likes > 0) AS liked
+        FROM {table}
+        GROUP BY owner_id
+    ) AS removed
+    WHERE users.id = removed.owner_id
+"""
+
+_recount = text("""
+    UPDATE users SET
+        song_points_count = coalesce(counted.count, 0),
+        song_points_liked = coalesce(counted.liked, 0),
+        approval_ratio = 100 * coalesce(counted.liked, 0) / greatest(coalesce(counted.count, 0), 1)
+    FROM users AS listed
+    LEFT JOIN (
+        SELECT owner_id, count(*) AS count, count(*) FILTER (WHERE likes > 0) AS liked
+        FROM songpoints
+        GROUP BY owner_id
+    ) AS counted ON counted.owner_id = listed.id
+    WHERE users.id = listed.id
+""")
+
+
+def add_song_points(db: Session, song_points: List[dict]) -> List[int]:
+    # column values of new song points, returns the owners to invalidate once the transaction commits
+    counts = Counter(song_point["owner_id"] for song_point in song_points)
+    owner_ids = sorted(counts)
+    if owner_ids:
+        db.execute(_add_owner_song_points, dict(ids=owner_ids, counts=[counts[owner_id] for owner_id in owner_ids]))
+    return owner_ids
+
+
+def remove_song_points_in(db: Session, table: str):
+    # before the song points of table leave songpoints, does not commit
+    db.execute(text(_remove_owner_song_points.format(table=table)))
+
+
+def recount(db: Session):
+    # the counters and approval ratios of every user from songpoints
+    db.execute(_recount)
+    db.commit()
+
+
+def apply_likes(db: Session, likes: List[LikeEvent]) -> int:
+    # one transaction for the whole batch, returns the number of likes that were new
+    unique = {}
+    for like in likes:
+        unique.setdefault((like.user_id, like.song_point_id), like)
+    new_likes = list(unique.values())
+
+    inserted = db.execute(_insert_likes, dict(
+        user_ids=[like.user_id for like in new_likes],
+        song_point_ids=[like.song_point_id for like in new_likes],
+        times=[like.time_added for like in new_likes]
+    )).all()
+    added = Counter(row.song_point_id for row in inserted)
+    if not added:
+        db.commit()
+        return 0
+
+    song_point_ids = sorted(added)
+    song_points = db.execute(_add_song_point_likes, dict(
+        ids=song_point_ids, likes=[added[song_point_id] for song_point_id in song_point_ids]
+    )).all()
+
+    owner_likes, owner_liked = Counter(), Counter()
+    for song_point in song_points:
+        owner_likes[song_point.owner_id] += added[song_point.id]
+        owner_liked[song_point.owner_id] += song_point.first_liked
+    owner_ids = sorted(owner_likes)
+    db.execute(_add_owner_likes, dict(
+        ids=owner_ids, likes=[owner_likes[owner_id] for owner_id in owner_ids],
+        liked=[owner_liked[owner_id] for owner_id in owner_ids]
+    ))
+
+    liked = [
+        dict(
+            id=song_point.id, owner_id=song_point.owner_id, song_id=song_point.song_id,
+            longitude=song_point.longitude, latitude=song_point.latitude, likes=added[song_point.id]
+        )
+        for song_point in song_points
+    ]
+    clusters.add_likes(db, liked)
+    trending.add_likes(db, liked)
+    events.song_point_likes_added(db, liked)
+    db.commit()
+
+    for owner_id in owner_ids:
+        auth.invalidate_user(owner_id)
+    return sum(added.values())
+
+
+class LikeAggregator:
+    def __init__(self, queue):
+        self.queue = queue
+        self.received = 0
+        self.refused = 0
+        self.applied = 0
+        self.failed_flushes = 0
+
+    def add(self, user_id: int, song_point_id: int) -> bool:
+        accepted = self.queue.put(LikeEvent(user_id, song_point_id, datetime.utcnow()))
+        if accepted:
+            self.received += 1
+        else:
+            self.refused += 1
+        return accepted
+
+    def flush(self, db: Session) -> int:
+        # applies up to FLUSH_BATCH events, returns how many were taken from the queue
+        likes = self.queue.take(FLUSH_BATCH)
+        if not likes:
+            return 0
+        try:
+            self.applied += apply_likes(db, likes)
+        except Exception:
+            # safe to replay, the likes table drops what was already stored
+            db.rollback()
+            self.queue.put_back(likes)
+            self.failed_flushes += 1
+            raise
+        return len(likes)
+
+    def drain(self, session_factory):
+        db = session_factory()
+        try:
+            while self.flush(db) == FLUSH_BATCH:
+                pass
+        finally:
+            db.close()
+
+    def stats(self):
+        return {
+            "pending": len(self.queue),
+            "received": self.received,
+            "refused": self.refused,
+            "applied": self.applied,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+def _create_queue():
+    if LIKE_QUEUE == "redis":
+        import redis
+        return RedisQueue(redis.Redis.from_url(REDIS_URL))
+    return MemoryQueue(max_pending=MAX_PENDING)
+
+
+aggregator = LikeAggregator(_create_queue())
+
+
+def start(session_factory):
+    stop = threading.Event()
+
+    def flush_forever():
+        while not stop.wait(FLUSH_SECONDS):
+            try:
+                aggregator.drain(session_factory)
+            except Exception:
+                logger.exception("like flush failed")
+
+    threading.Thread(target=flush_forever, name="like-aggregator", daemon=True).start()
+    return stop
+
+
+def main():
+    from .database import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    stop = start(SessionLocal)
+    try:
+        stop.wait()
+    except KeyboardInterrupt:
+        stop.set()
+        aggregator.drain(SessionLocal)
+
+
+if __name__ == "__main__":
+    main()
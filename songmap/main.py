@@ -1,47 +1,90 @@
-from typing import List
-from fastapi import FastAPI, Depends, HTTPException, status
+import hashlib
+from datetime import datetime
+from typing import List, Optional
+from fastapi import FastAPI, Depends, File, Form, Header, HTTPException, Request, Response, UploadFile, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from fastapi.responses import HTMLResponse
-from . import crud, models, schemas, auth
-from .database import SessionLocal, engine
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
+from . import crud, models, schemas, auth, clusters, tiles, cache, pagination, spatial_index, importer, tracks, likes, trending, \
+    instrumentation, rollups, serialization, singleflight, uploads
+from .database import SessionLocal, ASYNC_DB, engine, async_engine
+from .dependencies import get_db, check_if_authorized, decode_cursor, time_window, TimeWindow, bbox, BBox
+from .responses import json_body, json_bytes, json_response, ndjson_lines
 import logging
 
-models.Base.metadata.create_all(bind=engine)
-
 app = FastAPI(debug=True)
+app.router.route_class = instrumentation.route_class
 logger = logging.getLogger("app")
 
+if instrumentation.INSTRUMENTATION:
+    instrumentation.install(engine)
+    if async_engine is not None:
+        instrumentation.install(async_engine.sync_engine)
+    app.middleware("http")(instrumentation.middleware)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+if ASYNC_DB:
+    # same endpoints on the async engine under /async/, for A/B runs against the sync ones
+    from . import async_api
+    app.include_router(async_api.router)
 
 
-def check_if_authorized(owner_id, current_id):
-    if owner_id != current_id:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Trying to access unauthorized content",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+@app.on_event("startup")
+def load_spatial_index():
+    if spatial_index.SPATIAL_INDEX:
+        spatial_index.start(SessionLocal)
+
+
+like_aggregator_stop = None
+
 
+@app.on_event("startup")
+def start_like_aggregator():
+    global like_aggregator_stop
+    if likes.LIKE_AGGREGATOR:
+        like_aggregator_stop = likes.start(SessionLocal)
 
-# TODO:
-#  increment user's approval_ratio when someone likes his song point - AS A BACKGROUND TASK
+
+rollup_aggregator_stop = None
+
+
+@app.on_event("startup")
+def start_rollup_aggregator():
+    global rollup_aggregator_stop
+    if rollups.ROLLUP_AGGREGATOR:
+        rollup_aggregator_stop = rollups.start(SessionLocal)
+
+
+@app.on_event("shutdown")
+def stop_rollup_aggregator():
+    if rollup_aggregator_stop is not None:
+        rollup_aggregator_stop.set()
+        rollups.aggregator.drain(SessionLocal)
+
+
+@app.on_event("shutdown")
+def stop_like_aggregator():
+    # applies what is still buffered, the memory queue dies with the process
+    if like_aggregator_stop is not None:
+        like_aggregator_stop.set()
+        likes.aggregator.drain(SessionLocal)
 
 
 @app.post("/token/", response_model=schemas.Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    return auth.login_w_username_and_password(form_data.username, form_data.password, db)
+    return await auth.login_w_username_and_password_async(form_data.username, form_data.password, db)
 
 
 @app.get("/users/me/", response_model=schemas.User)
-async def read_users_me(token: str = Depends(auth.oauth2_scheme), db: Session = Depends(get_db)):
-    return auth.get_current_user(token, db)
+def read_users_me(principal: auth.Principal = Depends(auth.get_current_principal), db: Session = Depends(get_db)):
+    return auth.get_principal_user(principal, db)
+
+
+@app.post("/users/me/logout/", status_code=status.HTTP_204_NO_CONTENT)
+def logout_everywhere(principal: auth.Principal = Depends(auth.get_current_principal), db: Session = Depends(get_db)):
+    # every token issued so far stops working where the user record is checked
+    auth.get_principal_user(principal, db)
+    crud.revoke_user_tokens(db=db, user_id=principal.id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 # USER
@@ -52,8 +95,7 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
 
 
 @app.get("/users/{user_id}/", response_model=schemas.User)
-def read_user(user_id: int, token: str = Depends(auth.oauth2_scheme), db: Session = Depends(get_db)):
-    auth.get_current_user(token, db)  # sometimes only checking if logged in
+def read_user(user_id: int, principal: auth.Principal = Depends(auth.get_current_principal), db: Session = Depends(get_db)):
     return crud.get_user(db=db, user_id=user_id)
 
 
@@ -72,16 +114,14 @@ def read_user(user_id: int, token: str = Depends(auth.oauth2_scheme), db: Sessio
 @app.post("/songs/", response_model=List[schemas.Song])
 def create_songs(
         songs: List[schemas.SongCreate],
-        token: str = Depends(auth.oauth2_scheme),
+        principal: auth.Principal = Depends(auth.get_current_principal),
         db: Session = Depends(get_db)
 ):
-    auth.get_current_user(token, db)
     return crud.create_songs(db=db, songs=songs)
 
 
 @app.get("/songs/", response_model=schemas.Song)
-def read_song(song_id: int, token: str = Depends(auth.oauth2_scheme), db: Session = Depends(get_db)):
-    auth.get_current_user(token, db)
+def read_song(song_id: int, principal: auth.Principal = Depends(auth.get_current_principal), db: Session = Depends(get_db)):
     db_song = crud.get_song(db=db, song_id=song_id)
     if db_song is None:
         raise HTTPException(
@@ -93,8 +133,7 @@ def read_song(song_id: int, token: str = Depends(auth.oauth2_scheme), db: Sessio
 
 
 @app.get("/songs/spotify/", response_model=schemas.Song)
-def read_song_by_spotifyid(spotify_id: str, token: str = Depends(auth.oauth2_scheme), db: Session = Depends(get_db)):
-    auth.get_current_user(token, db)
+def read_song_by_spotifyid(spotify_id: str, principal: auth.Principal = Depends(auth.get_current_principal), db: Session = Depends(get_db)):
     db_song = crud.get_song_by_spotifyid(db=db, spotify_id=spotify_id)
     if db_song is None:
         raise HTTPException(
@@ -105,6 +144,45 @@ def read_song_by_spotifyid(spotify_id: str, token: str = Depends(auth.oauth2_sch
     return db_song
 
 
+@app.get("/songs/trending/", response_model=List[schemas.TrendingSong])
+def read_trending_songs(
+        longitude: float,
+        latitude: float,
+        radius: int = 5000,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        order: schemas.TrendingOrder = schemas.TrendingOrder.placements,
+        limit: int = 10,
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: Session = Depends(get_db)
+):
+    # served from rollups, see trending.py for the staleness bound
+    longitude, latitude = cache.query_point(longitude, latitude)
+    since, until = trending.window(since, until)
+
+    def compute():
+        min_longitude, min_latitude, max_longitude, max_latitude = trending.radius_bbox(longitude, latitude, radius)
+        trending_songs = trending.get_trending(
+            db=db,
+            min_longitude=min_longitude,
+            min_latitude=min_latitude,
+            max_longitude=max_longitude,
+            max_latitude=max_latitude,
+            since=since,
+            until=until,
+            order=order.value,
+            limit=limit
+        )
+        return cache.CachedResponse(json_body(List[schemas.TrendingSong], trending_songs))
+
+    # no tags, entries only expire with the cache ttl
+    return json_response(cache.read_through(
+        "trending:{}:{}:{}:{}:{}:{}:{}".format(longitude, latitude, radius, since, until, order.value, limit),
+        [],
+        compute
+    ))
+
+
 # SONG POINT
 
 # @app.post("/users/{owner_id}/songpoints/", response_model=schemas.SongPointResp)
@@ -121,22 +199,27 @@ def read_song_by_spotifyid(spotify_id: str, token: str = Depends(auth.oauth2_sch
 @app.post("/users/me/songpoints/", response_model=List[schemas.SongPointResp])
 def create_song_points_for_user(
         song_points: List[schemas.SongPointCreate],
-        token: str = Depends(auth.oauth2_scheme),
+        idempotency_key: Optional[str] = Header(None),
+        principal: auth.Principal = Depends(auth.get_current_principal),
         db: Session = Depends(get_db)
 ):
-    user_in_db = auth.get_current_user(token, db)
-    return crud.create_song_points_for_user(db=db, song_points=song_points, owner_id=user_in_db.id)
+    return crud.create_song_points_for_user(
+        db=db, song_points=song_points, owner_id=principal.id, batch_key=idempotency_key
+    )
 
 
 @app.post("/users/{owner_id}/songpoints/", response_model=List[schemas.SongPointResp])
 def create_song_points_for_user(
         owner_id: int,
         song_points: List[schemas.SongPointCreate],
-        token: str = Depends(auth.oauth2_scheme),
+        idempotency_key: Optional[str] = Header(None),
+        principal: auth.Principal = Depends(auth.get_current_principal),
         db: Session = Depends(get_db)
 ):
-    check_if_authorized(owner_id, auth.get_current_user(token, db).id)
-    return crud.create_song_points_for_user(db=db, song_points=song_points, owner_id=owner_id)
+    check_if_authorized(owner_id, principal.id)
+    return crud.create_song_points_for_user(
+        db=db, song_points=song_points, owner_id=owner_id, batch_key=idempotency_key
+    )
 
 
 # TRACK
@@ -146,10 +229,15 @@ def create_track_w_song_points_for_user(
         owner_id: int,
         track: schemas.TrackCreate,
         song_points: List[schemas.SongPointCreate],
-        token: str = Depends(auth.oauth2_scheme),
+        idempotency_key: Optional[str] = Header(None),
+        principal: auth.Principal = Depends(auth.get_current_principal),
         db: Session = Depends(get_db)
 ):
-    check_if_authorized(owner_id, auth.get_current_user(token, db).id)
+    check_if_authorized(owner_id, principal.id)
+    if idempotency_key is not None:
+        return uploads.create_track_w_song_points(
+            db=db, owner_id=owner_id, key=idempotency_key, track=track, song_points=song_points
+        )
     return crud.create_track_w_song_points_for_user(
         db=db,
         track=track,
@@ -161,11 +249,116 @@ def create_track_w_song_points_for_user(
 @app.get("/users/{owner_id}/tracks/", response_model=List[schemas.TrackResp])
 def read_tracks_w_song_points_by_user(
         owner_id: int,
-        token: str = Depends(auth.oauth2_scheme),
+        resolution: schemas.Resolution = schemas.Resolution.full,
+        principal: auth.Principal = Depends(auth.get_current_principal),
         db: Session = Depends(get_db)
 ):
-    auth.get_current_user(token, db)
-    return crud.get_tracks_w_song_points_by_user(owner_id=owner_id, db=db)
+    if serialization.FAST_SERIALIZATION:
+        return Response(json_bytes(serialization.get_tracks_w_song_points_by_user(
+            owner_id=owner_id, db=db, detail_level=tracks.detail_level(resolution.value)
+        )), media_type="application/json")
+    return crud.get_tracks_w_song_points_by_user(
+        owner_id=owner_id, db=db, detail_level=tracks.detail_level(resolution.value)
+    )
+
+
+# UPLOAD
+
+def _upload_or_404(db: Session, owner_id: int, key: str, lock: bool = False):
+    db_upload = uploads.get_upload(db=db, owner_id=owner_id, key=key, lock=lock)
+    if db_upload is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload does not exist.",
+        )
+    return db_upload
+
+
+@app.post("/users/{owner_id}/uploads/", response_model=schemas.Upload)
+def create_upload(
+        owner_id: int,
+        upload: schemas.UploadCreate,
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: Session = Depends(get_db)
+):
+    # creating it again returns the existing upload, resume from its committed offset
+    check_if_authorized(owner_id, principal.id)
+    return uploads.create_upload(db=db, owner_id=owner_id, upload=upload)
+
+
+@app.get("/users/{owner_id}/uploads/{key}/", response_model=schemas.Upload)
+def read_upload(
+        owner_id: int,
+        key: str,
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: Session = Depends(get_db)
+):
+    check_if_authorized(owner_id, principal.id)
+    return _upload_or_404(db, owner_id, key)
+
+
+@app.post("/users/{owner_id}/uploads/{key}/song_points/", response_model=schemas.Upload)
+def append_upload_song_points(
+        owner_id: int,
+        key: str,
+        offset: int,
+        song_points: List[schemas.SongPointCreate],
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: Session = Depends(get_db)
+):
+    # song points from offset on, the part already committed is skipped
+    check_if_authorized(owner_id, principal.id)
+    db_upload = _upload_or_404(db, owner_id, key, lock=True)
+    if offset > db_upload.committed:
+        committed = db_upload.committed
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Upload has {} song points committed, send the chunk from that offset.".format(committed),
+        )
+    try:
+        return uploads.append_song_points(db=db, upload=db_upload, offset=offset, song_points=song_points)
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+# IMPORT
+
+@app.post("/users/{owner_id}/imports/", response_model=schemas.Import)
+def import_trace_for_user(
+        owner_id: int,
+        file: UploadFile = File(...),
+        track_name: Optional[str] = Form(None),
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: Session = Depends(get_db)
+):
+    # progress is committed per chunk, GET the import from another request to follow it
+    check_if_authorized(owner_id, principal.id)
+    try:
+        format = importer.detect_format(file.filename)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return importer.run_import(
+        db=db, fileobj=file.file, owner_id=owner_id, format=format, filename=file.filename, track_name=track_name
+    )
+
+
+@app.get("/users/{owner_id}/imports/{import_id}/", response_model=schemas.Import)
+def read_import(
+        owner_id: int,
+        import_id: int,
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: Session = Depends(get_db)
+):
+    check_if_authorized(owner_id, principal.id)
+    db_import = importer.get_import(db=db, import_id=import_id)
+    if db_import is None or db_import.owner_id != owner_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Import does not exist.",
+        )
+    return db_import
 
 
 @app.get("/songpoints/", response_model=List[schemas.SongPointResp])
@@ -173,20 +366,78 @@ def read_near_song_points(
         longitude: float,
         latitude: float,
         radius: int = 50,
-        skip: int = 0,
+        cursor: Optional[str] = None,
         limit: int = 100,
-        token: str = Depends(auth.oauth2_scheme),
+        window: TimeWindow = Depends(time_window),
+        principal: auth.Principal = Depends(auth.get_current_principal),
         db: Session = Depends(get_db)
 ):
-    auth.get_current_user(token, db)
-    return crud.get_song_points_within_radius(
-        db=db,
-        longitude=longitude,
-        latitude=latitude,
-        radius=radius,
-        skip=skip,
-        limit=limit
-    )
+    after = decode_cursor(cursor)
+    longitude, latitude = cache.query_point(longitude, latitude)
+
+    def compute():
+        fast = serialization.FAST_SERIALIZATION
+        get_song_points = serialization.get_song_points_within_radius if fast else crud.get_song_points_within_radius
+        db_song_points, next_key = get_song_points(
+            db=db,
+            longitude=longitude,
+            latitude=latitude,
+            radius=radius,
+            after=after,
+            limit=limit,
+            since=window.since,
+            until=window.until
+        )
+        body = json_bytes(db_song_points) if fast else json_body(List[schemas.SongPointResp], db_song_points)
+        return cache.CachedResponse(body, pagination.encode_cursor(next_key))
+
+    # concurrent misses of one key share a single computation
+    key = cache.radius_key("songpoints", longitude, latitude, radius, cursor, limit, *window)
+    return json_response(cache.read_through(
+        key, cache.radius_tags(longitude, latitude, radius), lambda: singleflight.group.do("songpoints", key, compute)
+    ))
+
+
+@app.get("/songpoints/bbox/", response_model=schemas.SongPointsInBBoxResp)
+def read_song_points_in_bbox(
+        budget: int = crud.BBOX_BUDGET,
+        box: BBox = Depends(bbox),
+        window: TimeWindow = Depends(time_window),
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: Session = Depends(get_db)
+):
+    # at most budget song points, "sampled" tells the client there are more to see by zooming in
+    if not 1 <= budget <= crud.BBOX_MAX_BUDGET:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="budget must be between 1 and {}.".format(crud.BBOX_MAX_BUDGET),
+        )
+    if serialization.FAST_SERIALIZATION:
+        return Response(json_bytes(serialization.get_song_points_in_bbox(
+            db, *box, budget=budget, since=window.since, until=window.until
+        )), media_type="application/json")
+    return crud.get_song_points_in_bbox(db, *box, budget=budget, since=window.since, until=window.until)
+
+
+@app.post("/songpoints/{song_point_id}/likes/", status_code=status.HTTP_202_ACCEPTED)
+def like_song_point(song_point_id: int, principal: auth.Principal = Depends(auth.get_current_principal)):
+    # buffered, counters are updated by the like aggregator within a few seconds
+    if not likes.aggregator.add(principal.id, song_point_id):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many pending likes, try again later.",
+        )
+    return {"accepted": True}
+
+
+@app.get("/likes/stats/")
+def read_like_stats(principal: auth.Principal = Depends(auth.get_current_principal)):
+    return likes.aggregator.stats()
+
+
+@app.get("/rollups/stats/")
+def read_rollup_stats(principal: auth.Principal = Depends(auth.get_current_principal)):
+    return rollups.aggregator.stats()
 
 
 # SONGPOINT + TRACK
@@ -194,11 +445,42 @@ def read_near_song_points(
 @app.get("/users/{owner_id}/sat/", response_model=schemas.SongPointsAndTracksResp)
 def read_song_points_and_tracks_by_user(
         owner_id: int,
-        token: str = Depends(auth.oauth2_scheme),
+        resolution: schemas.Resolution = schemas.Resolution.full,
+        principal: auth.Principal = Depends(auth.get_current_principal),
         db: Session = Depends(get_db)
 ):
-    auth.get_current_user(token, db)
-    return crud.get_song_points_and_tracks_by_user(db=db, owner_id=owner_id)
+    detail_level = tracks.detail_level(resolution.value)
+
+    def compute():
+        if serialization.FAST_SERIALIZATION:
+            return json_bytes(serialization.get_song_points_and_tracks_by_user(
+                db=db, owner_id=owner_id, detail_level=detail_level
+            ))
+        return json_body(schemas.SongPointsAndTracksResp, crud.get_song_points_and_tracks_by_user(
+            db=db, owner_id=owner_id, detail_level=detail_level
+        ))
+
+    return Response(
+        singleflight.group.do("user_sat", (owner_id, detail_level), compute, singleflight.USER_TIMEOUT_SECONDS),
+        media_type="application/json"
+    )
+
+
+@app.get("/users/{owner_id}/sat/stream/", response_class=StreamingResponse)
+def stream_song_points_and_tracks_by_user(
+        owner_id: int,
+        principal: auth.Principal = Depends(auth.get_current_principal)
+):
+    # NDJSON of every track and song point of the user, read through a server side cursor
+    def rows():
+        # own session, the stream outlives the request's dependencies
+        db = SessionLocal()
+        try:
+            yield from crud.iter_song_points_and_tracks_by_user(db=db, owner_id=owner_id)
+        finally:
+            db.close()
+
+    return StreamingResponse(ndjson_lines(rows(), crud.STREAM_CHUNK), media_type="application/x-ndjson")
 
 
 @app.get("/sat/", response_model=schemas.SongPointsAndTracksResp)
@@ -206,22 +488,127 @@ def read_song_points_and_tracks_within_radius(
         longitude: float,
         latitude: float,
         radius: int = 50,
-        skip: int = 0,
+        cursor: Optional[str] = None,
         limit: int = 100,
-        token: str = Depends(auth.oauth2_scheme),
+        window: TimeWindow = Depends(time_window),
+        principal: auth.Principal = Depends(auth.get_current_principal),
         db: Session = Depends(get_db)
 ):
-    auth.get_current_user(token, db)
-    return crud.get_song_points_and_tracks_within_radius(
+    after = decode_cursor(cursor)
+    longitude, latitude = cache.query_point(longitude, latitude)
+
+    def compute():
+        fast = serialization.FAST_SERIALIZATION
+        get_song_points_and_tracks = (
+            serialization.get_song_points_and_tracks_within_radius if fast
+            else crud.get_song_points_and_tracks_within_radius
+        )
+        song_points_and_tracks, next_key = get_song_points_and_tracks(
+            db=db,
+            longitude=longitude,
+            latitude=latitude,
+            radius=radius,
+            after=after,
+            limit=limit,
+            since=window.since,
+            until=window.until
+        )
+        body = (
+            json_bytes(song_points_and_tracks) if fast
+            else json_body(schemas.SongPointsAndTracksResp, song_points_and_tracks)
+        )
+        return cache.CachedResponse(body, pagination.encode_cursor(next_key))
+
+    # concurrent misses of one key share a single computation
+    key = cache.radius_key("sat", longitude, latitude, radius, cursor, limit, *window)
+    return json_response(cache.read_through(
+        key, cache.radius_tags(longitude, latitude, radius), lambda: singleflight.group.do("sat", key, compute)
+    ))
+
+
+@app.get("/cache/stats/")
+def read_cache_stats(principal: auth.Principal = Depends(auth.get_current_principal)):
+    return cache.response_cache.stats() if cache.response_cache is not None else {}
+
+
+@app.get("/singleflight/stats/")
+def read_single_flight_stats(principal: auth.Principal = Depends(auth.get_current_principal)):
+    return singleflight.group.stats()
+
+
+@app.get("/auth/hashing/stats/")
+def read_password_hashing_stats(principal: auth.Principal = Depends(auth.get_current_principal)):
+    return auth.password_hashing.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    # Prometheus text format, per worker process
+    return (
+        instrumentation.prometheus_metrics() + singleflight.group.prometheus_metrics()
+        + auth.password_hashing.prometheus_metrics()
+    )
+
+
+@app.get("/requests/stats/")
+def read_request_stats(principal: auth.Principal = Depends(auth.get_current_principal)):
+    return instrumentation.route_stats()
+
+
+# CLUSTER
+
+@app.get("/clusters/", response_model=List[schemas.Cluster])
+def read_clusters(
+        min_longitude: float,
+        min_latitude: float,
+        max_longitude: float,
+        max_latitude: float,
+        zoom: int,
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: Session = Depends(get_db)
+):
+    return clusters.get_clusters(
         db=db,
-        longitude=longitude,
-        latitude=latitude,
-        radius=radius,
-        skip=skip,
-        limit=limit
+        min_longitude=min_longitude,
+        min_latitude=min_latitude,
+        max_longitude=max_longitude,
+        max_latitude=max_latitude,
+        zoom=zoom
     )
 
 
+# TILE
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+TILE_MAX_AGE_SECONDS = 60
+
+
+@app.get("/tiles/{z}/{x}/{y}.mvt", response_class=Response)
+def read_song_points_tile(
+        z: int,
+        x: int,
+        y: int,
+        request: Request,
+        window: TimeWindow = Depends(time_window),
+        principal: auth.Principal = Depends(auth.get_current_principal),
+        db: Session = Depends(get_db)
+):
+    if not 0 <= z <= tiles.MAX_ZOOM or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Tile does not exist.",
+        )
+    tile = crud.get_song_points_mvt(db=db, z=z, x=x, y=y, since=window.since, until=window.until)
+
+    headers = {
+        "ETag": '"{}"'.format(hashlib.md5(tile).hexdigest()),
+        "Cache-Control": "private, max-age={}".format(TILE_MAX_AGE_SECONDS),
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=tile, media_type=MVT_MEDIA_TYPE, headers=headers)
+
+
 @app.get("/spotify_auth_callback/", response_class=HTMLResponse)
 def spotify_auth_callback():
     return """
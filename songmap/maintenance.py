@@ -0,0 +1,63 @@
+"""Periodic database jobs, run from cron on one host and never from the API workers, which run no DDL.
+
+    python -m songmap.maintenance              # hourly: partitions, trending compaction, uploads
+    python -m songmap.maintenance --backfill   # once after upgrading a database that predates the aggregates
+
+Every job commits on its own, a failing one is logged and the others still run, the exit status is 1 then.
+The partitions are created MONTHS_AHEAD months ahead, missing a few runs does no harm.
+"""
+import argparse
+import logging
+import sys
+
+from sqlalchemy.orm import Session
+
+from . import clusters, likes, partitions, tracks, trending, uploads
+
+logger = logging.getLogger("app")
+
+JOBS = {
+    "partitions": partitions.maintain,
+    "trending compaction": trending.compact,
+    "upload key purge": uploads.purge,
+    "upload track geometry": uploads.refresh_tracks,
+}
+
+# derived data the write path keeps up to date, recomputed from songpoints and likes
+BACKFILLS = {
+    "track geometry": tracks.rebuild,
+    "clusters": clusters.rebuild,
+    "trending": trending.rebuild,
+    "approval ratios": likes.recount,
+}
+
+
+def run(session_factory, jobs: dict) -> int:
+    failed = 0
+    for name, job in jobs.items():
+        db: Session = session_factory()
+        try:
+            job(db)
+            logger.info("%s done", name)
+        except Exception:
+            db.rollback()
+            logger.exception("%s failed", name)
+            failed += 1
+        finally:
+            db.close()
+    return failed
+
+
+def main(argv=None):
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Run the periodic database jobs once.")
+    parser.add_argument("--backfill", action="store_true", help="recompute the derived data instead")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    return 1 if run(SessionLocal, BACKFILLS if args.backfill else JOBS) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
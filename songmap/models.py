@@ -1,21 +1,31 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, Float, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, Float, Boolean, Index, func
+from sqlalchemy.orm import relationship, deferred
 from geoalchemy2 import Geometry
 
 from .database import Base
 
+# WGS 84, longitude/latitude in degrees
+SRID = 4326
+# SongPoint.detail_level of points kept only at full resolution, see tracks.py
+FULL_DETAIL = 3
+
 
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     username = Column(String, unique=True, nullable=False, index=True)
     email = Column(String, nullable=False, index=True)
-    hashed_password = Column(String, nullable=False, index=True)
-    disabled = Column(Boolean, nullable=False, default=False, index=True)
+    hashed_password = Column(String, nullable=False)
+    disabled = Column(Boolean, nullable=False, default=False)
+    # bump to revoke issued access tokens
+    token_version = Column(Integer, nullable=False, default=0)
 
-    approval_ratio = Column(Integer, nullable=False, default=0, index=True)
-    influence = Column(Integer, nullable=False, default=0, index=True)
+    approval_ratio = Column(Integer, nullable=False, default=0)
+    influence = Column(Integer, nullable=False, default=0)
+    # song points of the user and those liked at least once, approval_ratio is kept from them, see likes.py
+    song_points_count = Column(Integer, nullable=False, default=0)
+    song_points_liked = Column(Integer, nullable=False, default=0)
 
     song_points = relationship("SongPoint", back_populates="owner")
     tracks = relationship("Track", back_populates="owner")
@@ -24,10 +34,10 @@ class User(Base):
 class Song(Base):
     __tablename__ = "songs"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     artist = Column(String, nullable=False, index=True)
     title = Column(String, nullable=False, index=True)
-    spotify_id = Column(String, nullable=True, index=True)
+    spotify_id = Column(String, nullable=True, unique=True, index=True)
 
     song_points = relationship("SongPoint", back_populates="song")
 
@@ -35,27 +45,156 @@ class Song(Base):
 class Track(Base):
     __tablename__ = "tracks"
 
-    id = Column(Integer, primary_key=True, index=True)
-    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     name = Column(String, nullable=True, index=True)
+    # derived from the song points in time order by tracks.refresh_geometry, null below two points
+    line = deferred(Column(Geometry(geometry_type="LINESTRING", srid=SRID, spatial_index=True), nullable=True))
+    point_count = Column(Integer, nullable=False, default=0)
+    min_longitude = Column(Float, nullable=True)
+    min_latitude = Column(Float, nullable=True)
+    max_longitude = Column(Float, nullable=True)
+    max_latitude = Column(Float, nullable=True)
+
+    __table_args__ = (
+        Index("idx_tracks_line_geography", func.geography(line), postgresql_using="gist"),
+    )
 
     owner = relationship("User", back_populates="tracks")
-    song_points = relationship("SongPoint", back_populates="track")
+    # ordered, so a track serializes the same on every read
+    song_points = relationship("SongPoint", back_populates="track", order_by="SongPoint.id")
 
+    @property
+    def bbox(self):
+        if self.min_longitude is None:
+            return None
+        return [self.min_longitude, self.min_latitude, self.max_longitude, self.max_latitude]
 
+
+# range partitioned by month on time_added, which is why it is part of the primary key, see partitions.py
+# indexes are managed by migrations/, keep them in step with the latest revision
 class SongPoint(Base):
     __tablename__ = "songpoints"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     track_id = Column(Integer, ForeignKey("tracks.id"), nullable=True)
     song_id = Column(Integer, ForeignKey("songs.id"), nullable=False)
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    likes = Column(Integer, nullable=False, default=0, index=True)
-    time_added = Column(DateTime, nullable=False, index=True)
+    likes = Column(Integer, nullable=False, default=0)
+    time_added = Column(DateTime, primary_key=True, nullable=False, index=True)
     longitude = Column(Float)
     latitude = Column(Float)
-    geo = Column(Geometry(geometry_type="POINT"))
+    geo = Column(Geometry(geometry_type="POINT", srid=SRID, spatial_index=True))
+    # coarsest track resolution that keeps this point
+    detail_level = Column(Integer, nullable=False, default=FULL_DETAIL, server_default=str(FULL_DETAIL))
+
+    # radius queries run ST_DWithin and <-> on geography(geo)
+    __table_args__ = (
+        Index("idx_songpoints_geo_geography", func.geography(geo), postgresql_using="gist"),
+        Index("idx_songpoints_track_detail", track_id, detail_level),
+        Index("idx_songpoints_owner_track", owner_id, track_id),
+        {"postgresql_partition_by": "RANGE (time_added)"},
+    )
 
     track = relationship("Track", back_populates="song_points")
     song = relationship("Song", back_populates="song_points")
     owner = relationship("User", back_populates="song_points")
+
+
+# one row per user and liked song point, the key that makes replayed like events idempotent
+class Like(Base):
+    __tablename__ = "likes"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    # no foreign key, songpoints is partitioned and unique on (id, time_added) only
+    song_point_id = Column(Integer, primary_key=True, index=True)
+    time_added = Column(DateTime, nullable=False)
+
+
+# per tile aggregates of song points, maintained on insert, see clusters.py
+class SongPointCell(Base):
+    __tablename__ = "songpoint_cells"
+
+    zoom = Column(Integer, primary_key=True)
+    x = Column(Integer, primary_key=True)
+    y = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    longitude_sum = Column(Float, nullable=False, default=0)
+    latitude_sum = Column(Float, nullable=False, default=0)
+    likes = Column(Integer, nullable=False, default=0)
+
+
+class SongPointCellSong(Base):
+    __tablename__ = "songpoint_cell_songs"
+
+    zoom = Column(Integer, primary_key=True)
+    x = Column(Integer, primary_key=True)
+    y = Column(Integer, primary_key=True)
+    song_id = Column(Integer, ForeignKey("songs.id"), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    song = relationship("Song")
+
+
+# placements and likes per cell, time bucket and song, see trending.py
+class SongTrendingBucket(Base):
+    __tablename__ = "song_trending_buckets"
+
+    zoom = Column(Integer, primary_key=True)
+    x = Column(Integer, primary_key=True)
+    y = Column(Integer, primary_key=True)
+    # bucket width, 1 or 24 hours
+    hours = Column(Integer, primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    song_id = Column(Integer, ForeignKey("songs.id"), primary_key=True)
+    placements = Column(Integer, nullable=False, default=0)
+    likes = Column(Integer, nullable=False, default=0)
+
+
+# one record per GPS trace import, updated as chunks are committed
+class Import(Base):
+    __tablename__ = "imports"
+
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    track_id = Column(Integer, ForeignKey("tracks.id"), nullable=True)
+    filename = Column(String, nullable=True)
+    format = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="running")
+    rows_read = Column(Integer, nullable=False, default=0)
+    rows_imported = Column(Integer, nullable=False, default=0)
+    rows_rejected = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+
+# idempotency keys of stored song points, a retried point finds its key and is not inserted again, see uploads.py
+class SongPointKey(Base):
+    __tablename__ = "song_point_keys"
+
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    key = Column(String, primary_key=True)
+    # no foreign key, songpoints is partitioned and unique on (id, time_added) only
+    song_point_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, nullable=False, index=True)
+
+
+# one record per resumable upload, committed is the count of its song points stored so far
+class Upload(Base):
+    __tablename__ = "uploads"
+
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    key = Column(String, nullable=False)
+    track_id = Column(Integer, ForeignKey("tracks.id"), nullable=True)
+    total = Column(Integer, nullable=True)
+    committed = Column(Integer, nullable=False, default=0)
+    # committed when the geometry of the track was last refreshed, see uploads.refresh_tracks
+    refreshed = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("idx_uploads_owner_key", owner_id, key, unique=True),
+    )
@@ -0,0 +1,21 @@
+import base64
+import json
+from typing import Optional, Tuple
+
+# keyset of the last row on a page: (distance in meters, song point id)
+PageKey = Tuple[float, int]
+
+
+def encode_cursor(key: Optional[PageKey]) -> Optional[str]:
+    if key is None:
+        return None
+    distance, song_point_id = key
+    return base64.urlsafe_b64encode(json.dumps([distance, song_point_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> PageKey:
+    try:
+        distance, song_point_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(distance), int(song_point_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
@@ -0,0 +1,182 @@
+"""Monthly range partitions of songpoints on time_added.
+
+maintain() creates the partitions of the current month and MONTHS_AHEAD months ahead, songmap.maintenance runs
+it from cron. Rows outside every partition land in songpoints_default. With SONGMAP_RETENTION_MONTHS set, partitions of months older than that
+are detached and moved to the ARCHIVE_SCHEMA schema, where they can be dumped and dropped. Archived song points
+drop out of every query, cluster and trending aggregates keep counting them until their rebuild().
+
+    python -m songmap.partitions maintain
+    python -m songmap.partitions migrate
+
+migrate is the one-off move from the former unpartitioned songpoints table, for tables too large for the
+single transaction of migration 0011. It renames that table to songpoints_legacy, creates the partitioned one
+and copies the rows month by month, one transaction per month. Drop songpoints_legacy once the counts match.
+"""
+import argparse
+import logging
+import os
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import likes, models
+
+logger = logging.getLogger("app")
+
+MONTHS_AHEAD = 3
+# 0 keeps every partition attached
+RETENTION_MONTHS = int(os.environ.get("SONGMAP_RETENTION_MONTHS", 0))
+ARCHIVE_SCHEMA = "archive"
+
+TABLE = models.SongPoint.__tablename__
+DEFAULT_PARTITION = TABLE + "_default"
+LEGACY_TABLE = TABLE + "_legacy"
+
+
+def _month(time: datetime):
+    return datetime(time.year, time.month, 1)
+
+
+def _add_months(month: datetime, months: int):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: datetime):
+    return "{}_{:%Y_%m}".format(TABLE, month)
+
+
+def _partition_month(name: str):
+    try:
+        return datetime.strptime(name[len(TABLE) + 1:], "%Y_%m")
+    except ValueError:
+        return None
+
+
+def attached_partitions(db: Session) -> List[str]:
+    return db.execute(text("""
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = CAST(:table AS regclass)
+        ORDER BY child.relname
+    """), dict(table=TABLE)).scalars().all()
+
+
+def create_partition(db: Session, month: datetime):
+    # fails while songpoints_default holds rows of the month, maintain() creates partitions before they are needed
+    db.execute(text("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM ('{:%Y-%m-%d}') TO ('{:%Y-%m-%d}')".format(
+        partition_name(month), TABLE, month, _add_months(month, 1)
+    )))
+
+
+def ensure_partitions(db: Session, start: Optional[datetime] = None, now: Optional[datetime] = None):
+    # months from start (the current one by default) to MONTHS_AHEAD ahead
+    now = now or datetime.utcnow()
+    db.execute(text("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} DEFAULT".format(DEFAULT_PARTITION, TABLE)))
+    month, last = _month(start or now), _add_months(_month(now), MONTHS_AHEAD)
+    while month <= last:
+        create_partition(db, month)
+        month = _add_months(month, 1)
+    db.commit()
+
+
+def detach_partitions(db: Session, before: datetime) -> List[str]:
+    # partitions of months ending on or before `before`, the tables are kept in ARCHIVE_SCHEMA
+    detached = []
+    db.execute(text("CREATE SCHEMA IF NOT EXISTS {}".format(ARCHIVE_SCHEMA)))
+    for name in attached_partitions(db):
+        month = _partition_month(name)
+        if month is None or _add_months(month, 1) > before:
+            continue
+        likes.remove_song_points_in(db, name)
+        db.execute(text("ALTER TABLE {} DETACH PARTITION {}".format(TABLE, name)))
+        db.execute(text("ALTER TABLE {} SET SCHEMA {}".format(name, ARCHIVE_SCHEMA)))
+        detached.append(name)
+    db.commit()
+    return detached
+
+
+def maintain(db: Session, now: Optional[datetime] = None):
+    now = now or datetime.utcnow()
+    ensure_partitions(db, now=now)
+    if RETENTION_MONTHS:
+        detached = detach_partitions(db, _add_months(_month(now), -RETENTION_MONTHS))
+        if detached:
+            logger.info("archived song point partitions %s", ", ".join(detached))
+
+
+def migrate(db: Session):
+    relkind = db.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), dict(table=TABLE)).scalar()
+    if relkind == "p":
+        logger.info("%s is already partitioned", TABLE)
+        return
+
+    if relkind is not None:
+        db.execute(text("ALTER TABLE {} RENAME TO {}".format(TABLE, LEGACY_TABLE)))
+        # index, constraint and sequence names are schema wide, free them for the partitioned table
+        for index_name in db.execute(
+                text("SELECT indexname FROM pg_indexes WHERE tablename = :table"), dict(table=LEGACY_TABLE)
+        ).scalars().all():
+            db.execute(text('ALTER INDEX "{0}" RENAME TO "{0}_legacy"'.format(index_name)))
+        db.execute(text("ALTER SEQUENCE IF EXISTS {0}_id_seq RENAME TO {0}_id_seq_legacy".format(TABLE)))
+        # likes can no longer reference songpoints.id alone
+        db.execute(text("ALTER TABLE IF EXISTS likes DROP CONSTRAINT IF EXISTS likes_song_point_id_fkey"))
+
+    models.SongPoint.__table__.create(bind=db.connection())
+    if relkind is None:
+        db.commit()
+        ensure_partitions(db)
+        return
+
+    first, last_id = db.execute(text("SELECT min(time_added), max(id) FROM {}".format(LEGACY_TABLE))).one()
+    db.execute(text("SELECT setval('{}_id_seq', :next_id, false)".format(TABLE)), dict(next_id=(last_id or 0) + 1))
+    db.commit()
+    ensure_partitions(db, start=first)
+
+    # only the columns both tables have, the legacy table may predate some of them
+    legacy_columns = set(db.execute(
+        text("SELECT column_name FROM information_schema.columns WHERE table_name = :table"), dict(table=LEGACY_TABLE)
+    ).scalars().all())
+    columns = ", ".join(column.name for column in models.SongPoint.__table__.columns if column.name in legacy_columns)
+
+    month, last = _month(first or datetime.utcnow()), _month(datetime.utcnow())
+    while month <= last:
+        copied = db.execute(text(
+            "INSERT INTO {0} ({2}) SELECT {2} FROM {1} WHERE time_added >= :start AND time_added < :end".format(
+                TABLE, LEGACY_TABLE, columns
+            )
+        ), dict(start=month, end=_add_months(month, 1))).rowcount
+        db.commit()
+        logger.info("copied %d song points of %s", copied, "{:%Y-%m}".format(month))
+        month = _add_months(month, 1)
+    # rows dated after the current month, routed to their partition or songpoints_default
+    db.execute(text(
+        "INSERT INTO {0} ({2}) SELECT {2} FROM {1} WHERE time_added >= :start".format(TABLE, LEGACY_TABLE, columns)
+    ), dict(start=_add_months(last, 1)))
+    db.commit()
+    db.execute(text("ANALYZE {}".format(TABLE)))
+    logger.info("%s is partitioned, drop %s once verified", TABLE, LEGACY_TABLE)
+
+
+def main(argv=None):
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Maintain the monthly partitions of songpoints.")
+    parser.add_argument("command", choices=("maintain", "migrate"))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    db = SessionLocal()
+    try:
+        if args.command == "migrate":
+            migrate(db)
+        else:
+            maintain(db)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
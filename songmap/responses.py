@@ -0,0 +1,48 @@
+import json
+from itertools import islice
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import parse_obj_as
+
+from . import instrumentation
+from .cache import CachedResponse
+
+
+def _default(value):
+    # datetimes as pydantic/jsonable_encoder write them
+    return value.isoformat()
+
+
+def json_body(response_model, content) -> bytes:
+    # the bytes FastAPI sends for content returned under response_model
+    with instrumentation.serializing():
+        return JSONResponse(content=jsonable_encoder(parse_obj_as(response_model, content))).body
+
+
+def json_bytes(content) -> bytes:
+    # plain dicts and lists encoded as JSONResponse encodes what jsonable_encoder returns, datetimes included
+    with instrumentation.serializing():
+        return json.dumps(
+            content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"), default=_default
+        ).encode("utf-8")
+
+
+def json_response(cached: CachedResponse) -> Response:
+    response = Response(content=cached.body, media_type="application/json")
+    if cached.next_cursor is not None:
+        response.headers["X-Next-Cursor"] = cached.next_cursor
+    return response
+
+
+def ndjson_lines(rows, chunk_size: int = 1000):
+    # one JSON document per line, written out chunk_size rows at a time
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield "".join(
+            json.dumps(row, ensure_ascii=False, separators=(",", ":"), default=_default) + "\n" for row in chunk
+        ).encode()
@@ -0,0 +1,129 @@
+"""Cluster, trending and owner counter rollups of new song points, applied off the request path.
+
+The transaction inserting song points only stages their column values with add_song_points. Once it commits
+they go to a buffer of this process, which a thread applies every FLUSH_SECONDS in one transaction, coalesced
+per cell, bucket and owner. Concurrent inserts into one area no longer queue on the lock of the same cell and
+bucket rows inside their request, nor the uploads of one owner on the owner's users row. Likes are rolled up by
+the like flush, which is batched already, bulk imports by one set based statement per chunk.
+
+The buffer dies with the process, what it held is recomputed by
+
+    python -m songmap.maintenance --backfill
+
+With SONGMAP_ROLLUP_AGGREGATOR=0 the rollups are applied in the inserting transaction.
+"""
+import logging
+import os
+import threading
+from typing import List
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import auth, clusters, likes, trending
+
+logger = logging.getLogger("app")
+
+ROLLUP_AGGREGATOR = os.environ.get("SONGMAP_ROLLUP_AGGREGATOR", "1") == "1"
+FLUSH_SECONDS = float(os.environ.get("SONGMAP_ROLLUP_FLUSH_SECONDS", 1))
+# song points applied per transaction
+FLUSH_BATCH = 10000
+
+_PENDING_KEY = "rollup_song_points"
+_CHANGED_USERS_KEY = "rollup_changed_users"
+
+
+def apply(db: Session, song_points: List[dict]) -> List[int]:
+    # returns the users whose counters changed, to invalidate once the transaction commits
+    clusters.add_song_points(db, song_points)
+    trending.add_song_points(db, song_points)
+    return likes.add_song_points(db, song_points)
+
+
+def _invalidate(user_ids: List[int]):
+    for user_id in user_ids:
+        auth.invalidate_user(user_id)
+
+
+class RollupAggregator:
+    def __init__(self):
+        self._song_points = []
+        self._lock = threading.Lock()
+        self.applied = 0
+        self.failed_flushes = 0
+
+    def __len__(self):
+        return len(self._song_points)
+
+    def add(self, song_points: List[dict]):
+        with self._lock:
+            self._song_points.extend(song_points)
+
+    def flush(self, db: Session) -> int:
+        # applies up to FLUSH_BATCH song points, returns how many were taken from the buffer
+        with self._lock:
+            song_points, self._song_points = self._song_points[:FLUSH_BATCH], self._song_points[FLUSH_BATCH:]
+        if not song_points:
+            return 0
+        try:
+            user_ids = apply(db, song_points)
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                self._song_points[:0] = song_points
+            self.failed_flushes += 1
+            raise
+        _invalidate(user_ids)
+        self.applied += len(song_points)
+        return len(song_points)
+
+    def drain(self, session_factory):
+        db = session_factory()
+        try:
+            while self.flush(db) == FLUSH_BATCH:
+                pass
+        finally:
+            db.close()
+
+    def stats(self):
+        return {"pending": len(self), "applied": self.applied, "failed_flushes": self.failed_flushes}
+
+
+aggregator = RollupAggregator()
+
+
+def add_song_points(db: Session, song_points: List[dict]):
+    # column values of new song points, runs in the transaction that inserts them
+    if not ROLLUP_AGGREGATOR:
+        db.info.setdefault(_CHANGED_USERS_KEY, []).extend(apply(db, song_points))
+        return
+    db.info.setdefault(_PENDING_KEY, []).extend(song_points)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(db: Session):
+    song_points = db.info.pop(_PENDING_KEY, None)
+    if song_points:
+        aggregator.add(song_points)
+    _invalidate(db.info.pop(_CHANGED_USERS_KEY, ()))
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(db: Session):
+    db.info.pop(_PENDING_KEY, None)
+    db.info.pop(_CHANGED_USERS_KEY, None)
+
+
+def start(session_factory):
+    stop = threading.Event()
+
+    def flush_forever():
+        while not stop.wait(FLUSH_SECONDS):
+            try:
+                aggregator.drain(session_factory)
+            except Exception:
+                logger.exception("rollup flush failed")
+
+    threading.Thread(target=flush_forever, name="rollup-aggregator", daemon=True).start()
+    return stop
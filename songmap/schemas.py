@@ -1,3 +1,4 @@
+from enum import Enum
 from typing import Optional, List
 
 from pydantic import BaseModel
@@ -26,6 +27,7 @@ class User(UserBase):
 class UserInDB(User):
     disabled: Optional[bool] = None
     hashed_password: str
+    token_version: int = 0
 
 
 class SongBase(BaseModel):
@@ -53,7 +55,8 @@ class SongPointBase(BaseModel):
 
 
 class SongPointCreate(SongPointBase):
-    pass
+    # client chosen, unique per owner, a point sent again with the same key is stored once
+    idempotency_key: Optional[str] = None
 
 
 class SongPointResp(SongPointBase):
@@ -83,9 +86,20 @@ class TrackCreate(TrackBase):
     pass
 
 
+# see tracks.RESOLUTIONS
+class Resolution(str, Enum):
+    low = "low"
+    medium = "medium"
+    high = "high"
+    full = "full"
+
+
 class TrackResp(TrackBase):
     id: int
     owner_id: int
+    point_count: int = 0
+    # min longitude, min latitude, max longitude, max latitude
+    bbox: Optional[List[float]] = None
     song_points: List[SongPointResp] = []
 
     class Config:
@@ -106,6 +120,79 @@ class SongPointsAndTracksResp(BaseModel):
     tracks: List[TrackResp]
 
 
+class SongPointsInBBoxResp(BaseModel):
+    song_points: List[SongPointResp]
+    # more song points in the box than the budget, these are a sample, zoom in for the rest
+    sampled: bool
+
+
+class Import(BaseModel):
+    id: int
+    owner_id: int
+    track_id: Optional[int] = None
+    filename: Optional[str] = None
+    format: str
+    status: str
+    rows_read: int
+    rows_imported: int
+    rows_rejected: int
+    error: Optional[str] = None
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+
+class UploadCreate(BaseModel):
+    key: str
+    # song points the client will send, the upload finishes when all are committed
+    total: Optional[int] = None
+    # song points of the upload go to a new track
+    track: Optional[TrackCreate] = None
+
+
+class Upload(BaseModel):
+    id: int
+    key: str
+    owner_id: int
+    track_id: Optional[int] = None
+    total: Optional[int] = None
+    # song points stored so far, the offset of the next chunk
+    committed: int
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+
+class TrendingOrder(str, Enum):
+    placements = "placements"
+    likes = "likes"
+
+
+class TrendingSong(BaseModel):
+    song: Song
+    placements: int
+    likes: int
+
+
+class ClusterSong(BaseModel):
+    song: Song
+    count: int
+
+
+class Cluster(BaseModel):
+    zoom: int
+    x: int
+    y: int
+    count: int
+    longitude: float
+    latitude: float
+    likes: int
+    top_songs: List[ClusterSong] = []
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -0,0 +1,154 @@
+"""Song points and tracks read as plain rows and encoded without Pydantic.
+
+The ORM path loads SongPoint, Song and Track objects and validates them attribute by attribute through the
+orm_mode schemas before encoding, which on large pages costs more than the queries. Here only the columns the
+response schemas serialize are selected, dicts are built in the field order of those schemas and
+responses.json_bytes encodes them like FastAPI's JSONResponse, so the bodies are byte for byte the same.
+
+Opt in with SONGMAP_FAST_SERIALIZATION=1, it serves /songpoints/, /songpoints/bbox/, /sat/,
+/users/{owner_id}/sat/ and /users/{owner_id}/tracks/.
+"""
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import crud, models
+from .pagination import PageKey
+
+FAST_SERIALIZATION = os.environ.get("SONGMAP_FAST_SERIALIZATION", "0") == "1"
+
+_sp, _song, _track = models.SongPoint, models.Song, models.Track
+
+# schemas.SongPointResp and its nested schemas.Song
+_song_point_columns = (
+    _sp.id, _sp.track_id, _sp.song_id, _sp.longitude, _sp.latitude, _sp.time_added, _sp.owner_id, _sp.likes,
+    _song.artist, _song.title, _song.spotify_id
+)
+
+# schemas.TrackResp without its song points
+_track_columns = (
+    _track.id, _track.name, _track.owner_id, _track.point_count,
+    _track.min_longitude, _track.min_latitude, _track.max_longitude, _track.max_latitude
+)
+
+
+def _song_point(row) -> dict:
+    return {
+        "song_id": row.song_id,
+        "longitude": row.longitude,
+        "latitude": row.latitude,
+        "time_added": row.time_added,
+        "owner_id": row.owner_id,
+        "likes": row.likes,
+        "song": {"artist": row.artist, "title": row.title, "spotify_id": row.spotify_id, "id": row.song_id},
+    }
+
+
+def _track(row, song_points: List[dict]) -> dict:
+    return {
+        "name": row.name,
+        "id": row.id,
+        "owner_id": row.owner_id,
+        "point_count": row.point_count,
+        "bbox": None if row.min_longitude is None else [
+            row.min_longitude, row.min_latitude, row.max_longitude, row.max_latitude
+        ],
+        "song_points": song_points,
+    }
+
+
+def _song_point_rows(*conditions):
+    return select(*_song_point_columns).join(_song, _song.id == _sp.song_id).where(*conditions)
+
+
+def get_song_points_by_ids(db: Session, song_point_ids: List[int]) -> List[dict]:
+    if not song_point_ids:
+        return []
+    rows = db.execute(_song_point_rows(_sp.id.in_(song_point_ids))).all()
+    return [_song_point(row) for row in crud.in_order(rows, song_point_ids)]
+
+
+def _tracks(db: Session, track_query, detail_level: int) -> List[dict]:
+    track_rows = db.execute(track_query).all()
+    if not track_rows:
+        return []
+    conditions = [_sp.track_id.in_([row.id for row in track_rows])]
+    if detail_level < models.FULL_DETAIL:
+        conditions.append(_sp.detail_level <= detail_level)
+    song_points = defaultdict(list)
+    for row in db.execute(_song_point_rows(*conditions).order_by(_sp.track_id, _sp.id)):
+        song_points[row.track_id].append(_song_point(row))
+    return [_track(row, song_points[row.id]) for row in track_rows]
+
+
+def get_tracks_by_ids(db: Session, track_ids: List[int], detail_level: int = models.FULL_DETAIL) -> List[dict]:
+    if not track_ids:
+        return []
+    tracks = _tracks(db, select(*_track_columns).where(_track.id.in_(track_ids)), detail_level)
+    by_id = {track["id"]: track for track in tracks}
+    return [by_id[track_id] for track_id in track_ids]
+
+
+def get_tracks_w_song_points_by_user(db: Session, owner_id: int, detail_level: int = models.FULL_DETAIL) -> List[dict]:
+    return _tracks(db, select(*_track_columns).where(_track.owner_id == owner_id).order_by(_track.id), detail_level)
+
+
+def get_song_points_and_tracks_by_user(db: Session, owner_id: int, detail_level: int = models.FULL_DETAIL):
+    song_points = db.execute(
+        _song_point_rows(_sp.owner_id == owner_id, _sp.track_id == None).order_by(_sp.id)
+    ).all()
+    return {
+        "song_points": [_song_point(row) for row in song_points],
+        "tracks": get_tracks_w_song_points_by_user(db, owner_id, detail_level),
+    }
+
+
+def get_song_points_within_radius(
+        db: Session,
+        longitude: float,
+        latitude: float,
+        radius: int = 50,
+        after: Optional[PageKey] = None,
+        limit: int = 100,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+):
+    rows = crud.song_points_page_rows(db, longitude, latitude, radius, after, limit, since, until)
+    return get_song_points_by_ids(db, [row.id for row in rows]), crud.next_key(rows, limit)
+
+
+def get_song_points_and_tracks_within_radius(
+        db: Session,
+        longitude: float,
+        latitude: float,
+        radius: int = 50,
+        after: Optional[PageKey] = None,
+        limit: int = 100,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+):
+    rows = crud.song_points_and_tracks_page_rows(db, longitude, latitude, radius, after, limit, since, until)
+    return {
+        "song_points": get_song_points_by_ids(db, [row.id for row in rows if row.track_id == None]),
+        "tracks": get_tracks_by_ids(db, [row.track_id for row in rows if row.track_id != None]),
+    }, crud.next_key(rows, limit)
+
+
+def get_song_points_in_bbox(
+        db: Session,
+        min_longitude: float,
+        min_latitude: float,
+        max_longitude: float,
+        max_latitude: float,
+        budget: int = crud.BBOX_BUDGET,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+):
+    ids, sampled = crud.song_points_in_bbox_ids(
+        db, min_longitude, min_latitude, max_longitude, max_latitude, budget, since, until
+    )
+    return {"song_points": get_song_points_by_ids(db, ids), "sampled": sampled}
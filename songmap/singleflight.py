@@ -0,0 +1,108 @@
+"""Coalesces identical reads that run at the same time.
+
+When an event ends thousands of clients at the same place ask for the same page at once. The first request for
+a key computes the response body, requests for the same key arriving while it runs wait for that body instead
+of running their own queries. Radius reads are keyed by their response cache key. While the cache is on its
+coordinates are snapped to cache.COORDINATE_QUANTUM, so near identical requests share one computation as well.
+
+Only finished response bodies are shared, ORM objects belong to the session of the request that loaded them.
+A waiting request gives up after the timeout of its key and computes the body itself. An error of the
+computation is raised in every request that waited for it. In process only, every worker coalesces its own
+requests, the sync endpoints only.
+"""
+import os
+import threading
+from collections import Counter
+from typing import Dict, Hashable
+
+SINGLE_FLIGHT = os.environ.get("SONGMAP_SINGLE_FLIGHT", "1") == "1"
+# seconds a request waits for the computation of another one before running its own
+TIMEOUT_SECONDS = float(os.environ.get("SONGMAP_SINGLE_FLIGHT_TIMEOUT_SECONDS", 5))
+# reads of all song points of a user take longer than one page
+USER_TIMEOUT_SECONDS = float(os.environ.get("SONGMAP_SINGLE_FLIGHT_USER_TIMEOUT_SECONDS", 30))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        # per kind of read
+        self.computed = Counter()
+        self.coalesced = Counter()
+        self.timeouts = Counter()
+        self.failed = Counter()
+
+    def do(self, kind: str, key: Hashable, compute, timeout: float = TIMEOUT_SECONDS):
+        if not SINGLE_FLIGHT:
+            return compute()
+        with self._lock:
+            call = self._calls.get((kind, key))
+            leader = call is None
+            if leader:
+                call = self._calls[kind, key] = _Call()
+                self.computed[kind] += 1
+
+        if leader:
+            try:
+                call.result = compute()
+            except Exception as e:
+                call.error = e
+                self._count(self.failed, kind)
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[kind, key]
+                call.done.set()
+            return call.result
+
+        if not call.done.wait(timeout):
+            self._count(self.timeouts, kind)
+            return compute()
+        self._count(self.coalesced, kind)
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _count(self, counter: Counter, kind: str):
+        with self._lock:
+            counter[kind] += 1
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "kinds": {
+                kind: {
+                    "computed": self.computed[kind],
+                    "coalesced": self.coalesced[kind],
+                    "timeouts": self.timeouts[kind],
+                    "failed": self.failed[kind],
+                }
+                for kind in sorted(self.computed)
+            },
+        }
+
+    def prometheus_metrics(self) -> str:
+        lines = []
+        for name, description, counter in (
+                ("songmap_single_flight_computed_total", "Reads computed for a key.", self.computed),
+                ("songmap_single_flight_coalesced_total", "Reads answered by the computation of another request.",
+                 self.coalesced),
+                ("songmap_single_flight_timeouts_total", "Reads that stopped waiting and computed their own.",
+                 self.timeouts),
+                ("songmap_single_flight_failed_total", "Computations that raised.", self.failed),
+        ):
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} counter".format(name))
+            for kind, value in sorted(counter.items()):
+                lines.append('{}{{kind="{}"}} {}'.format(name, kind, value))
+        return "\n".join(lines) + "\n"
+
+
+group = SingleFlight()
@@ -0,0 +1,355 @@
+"""In-process grid index answering the spatial part of radius queries.
+
+The index finds the ids, track ids and distances of a page, the part PostGIS spends its time on. The response
+is then hydrated with one primary key IN lookup (crud.get_song_points_by_ids, get_tracks_by_ids), so songs,
+tracks and the latest likes come from the database and the index holds only what the search needs, about
+BYTES_PER_POINT per song point.
+
+New song points are kept as pending rows scanned by every query and merged into the sorted arrays past
+MERGE_THRESHOLD. A merge sorts outside the lock on a snapshot and swaps the result in, readers keep using the
+old arrays meanwhile.
+"""
+import logging
+import math
+import os
+import threading
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import events, models
+from .pagination import PageKey
+
+try:
+    import numpy as np
+except ImportError:  # optional, only needed when the index is enabled
+    np = None
+
+logger = logging.getLogger("app")
+
+# answer radius queries from process memory instead of PostGIS, needs numpy
+SPATIAL_INDEX = os.environ.get("SONGMAP_SPATIAL_INDEX", "0") == "1"
+# seconds between polls for song points written by other workers
+REFRESH_SECONDS = float(os.environ.get("SONGMAP_SPATIAL_INDEX_REFRESH_SECONDS", 5))
+# every poll rereads this many ids below the highest one seen, to catch late commits
+REFRESH_OVERLAP = 10000
+LOAD_CHUNK = 50000
+# pending writes are scanned linearly by every query and merged into the sorted arrays past this many
+MERGE_THRESHOLD = 4096
+
+# grid cell size in degrees, points are stored sorted by cell
+CELL_DEGREES = 0.01
+CELLS_X = int(round(360 / CELL_DEGREES))
+# radius queries spanning more cell rows scan every point
+MAX_CELL_ROWS = 2000
+
+# sphere radius PostGIS uses for geography with use_spheroid = false
+EARTH_RADIUS = 6371008.7714
+
+# id, lon, lat, cell int64/float64 + song_id, owner_id, track_id, likes int32
+BYTES_PER_POINT = 4 * 8 + 4 * 4
+
+COLUMNS = ("id", "longitude", "latitude", "song_id", "owner_id", "track_id", "likes")
+
+
+class Row(NamedTuple):
+    id: int
+    track_id: Optional[int]
+    distance: float
+
+
+def _empty():
+    return {
+        "id": np.empty(0, np.int64),
+        "longitude": np.empty(0, np.float64),
+        "latitude": np.empty(0, np.float64),
+        "song_id": np.empty(0, np.int32),
+        "owner_id": np.empty(0, np.int32),
+        "track_id": np.empty(0, np.int32),
+        "likes": np.empty(0, np.int32),
+    }
+
+
+def _from_rows(rows):
+    arrays = _empty()
+    if rows:
+        columns = list(zip(*rows))
+        for name, values in zip(COLUMNS, columns):
+            if name == "track_id":
+                values = [-1 if value is None else value for value in values]
+            arrays[name] = np.asarray(values, dtype=arrays[name].dtype)
+    return arrays
+
+
+def _cells(longitude, latitude):
+    x = np.clip(np.floor((longitude + 180.0) / CELL_DEGREES), 0, CELLS_X - 1).astype(np.int64)
+    y = np.floor((latitude + 90.0) / CELL_DEGREES).astype(np.int64)
+    return y * CELLS_X + x
+
+
+def haversine(longitude, latitude, longitudes, latitudes):
+    lon1, lat1 = math.radians(longitude), math.radians(latitude)
+    lon2, lat2 = np.radians(longitudes), np.radians(latitudes)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class SpatialIndex:
+    def __init__(self):
+        self.ready = False
+        self._lock = threading.RLock()
+        self._arrays = None
+        self._cells = None
+        # song point id -> row in COLUMNS order, likes last
+        self._pending = {}
+        self._pending_arrays = None
+        self._recent_ids = set()
+        self._watermark = 0
+        # likes added while a merge runs, replayed on the merged arrays
+        self._merge_likes = None
+        # bumped by load, a merge of the arrays it replaced is dropped
+        self._generation = 0
+
+    def __len__(self):
+        with self._lock:
+            return (len(self._cells) if self._cells is not None else 0) + len(self._pending)
+
+    def memory_bytes(self):
+        with self._lock:
+            if self._arrays is None:
+                return 0
+            return self._cells.nbytes + sum(array.nbytes for array in self._arrays.values())
+
+    def _select(self):
+        sp = models.SongPoint
+        return select(sp.id, sp.longitude, sp.latitude, sp.song_id, sp.owner_id, sp.track_id, sp.likes)
+
+    def load(self, db: Session):
+        # streamed with a server side cursor, LOAD_CHUNK rows at a time
+        chunks = []
+        result = db.execute(self._select().execution_options(stream_results=True))
+        for rows in result.partitions(LOAD_CHUNK):
+            chunks.append(_from_rows(rows))
+        arrays = {name: np.concatenate([chunk[name] for chunk in chunks] or [_empty()[name]]) for name in COLUMNS}
+
+        with self._lock:
+            self._pending, self._pending_arrays = {}, None
+            self._generation += 1
+            self._set_arrays(arrays)
+            self._watermark = int(arrays["id"].max()) if len(arrays["id"]) else 0
+            recent = arrays["id"][arrays["id"] > self._watermark - REFRESH_OVERLAP]
+            self._recent_ids = set(recent.tolist())
+            self.ready = True
+        logger.info("spatial index loaded %d song points, %d bytes", len(arrays["id"]), self.memory_bytes())
+
+    def _set_arrays(self, arrays):
+        cells = _cells(arrays["longitude"], arrays["latitude"])
+        order = np.argsort(cells, kind="stable")
+        self._cells = cells[order]
+        self._arrays = {name: array[order] for name, array in arrays.items()}
+
+    def _merge(self):
+        # snapshot under the lock, sort outside it, swap in under it again
+        with self._lock:
+            if self._merge_likes is not None or self._arrays is None:
+                return
+            arrays = dict(self._arrays, likes=self._arrays["likes"].copy())
+            merged_ids = list(self._pending)
+            pending = _from_rows([list(row) for row in self._pending.values()])
+            generation = self._generation
+            self._merge_likes = {}
+
+        try:
+            merged = {name: np.concatenate([arrays[name], pending[name]]) for name in COLUMNS}
+            cells = _cells(merged["longitude"], merged["latitude"])
+            order = np.argsort(cells, kind="stable")
+            cells, merged = cells[order], {name: array[order] for name, array in merged.items()}
+        except BaseException:
+            with self._lock:
+                self._merge_likes = None
+            raise
+
+        with self._lock:
+            likes, self._merge_likes = self._merge_likes, None
+            if generation != self._generation:
+                return
+            self._cells, self._arrays = cells, merged
+            self._add_likes(likes)
+            for song_point_id in merged_ids:
+                del self._pending[song_point_id]
+            self._pending_arrays = None
+
+    def _pending_rows(self):
+        # the pending rows as arrays, rebuilt after every change, at most MERGE_THRESHOLD of them
+        if self._pending_arrays is None:
+            self._pending_arrays = _from_rows(list(self._pending.values()))
+        return self._pending_arrays
+
+    def add(self, song_points: List[dict]):
+        with self._lock:
+            if not self.ready:
+                return
+            for song_point in song_points:
+                if song_point["id"] in self._recent_ids:
+                    continue
+                self._recent_ids.add(song_point["id"])
+                self._pending[song_point["id"]] = [song_point.get(name) for name in COLUMNS[:-1]] + [
+                    song_point.get("likes") or 0
+                ]
+                self._pending_arrays = None
+            merge = len(self._pending) >= MERGE_THRESHOLD
+        if merge:
+            self._merge()
+
+    def refresh(self, db: Session):
+        # picks up song points committed by other workers
+        with self._lock:
+            since = self._watermark - REFRESH_OVERLAP
+        rows = db.execute(self._select().where(models.SongPoint.id > since)).all()
+        self.add([dict(zip(COLUMNS, row)) for row in rows])
+        with self._lock:
+            if rows:
+                self._watermark = max(self._watermark, max(row.id for row in rows))
+            floor = self._watermark - REFRESH_OVERLAP
+            self._recent_ids = {song_point_id for song_point_id in self._recent_ids if song_point_id > floor}
+
+    def update_likes(self, likes: dict):
+        # song point id -> likes to add
+        with self._lock:
+            if not likes or self._arrays is None:
+                return
+            for song_point_id, added in likes.items():
+                row = self._pending.get(song_point_id)
+                if row is not None:
+                    row[-1] += added
+                    self._pending_arrays = None
+            self._add_likes(likes)
+            if self._merge_likes is not None:
+                for song_point_id, added in likes.items():
+                    self._merge_likes[song_point_id] = self._merge_likes.get(song_point_id, 0) + added
+
+    def _add_likes(self, likes: dict):
+        # to the sorted arrays, under the lock
+        if not likes:
+            return
+        ids = np.fromiter(likes.keys(), np.int64)
+        mask = np.isin(self._arrays["id"], ids)
+        self._arrays["likes"][mask] += np.asarray(
+            [likes[song_point_id] for song_point_id in self._arrays["id"][mask].tolist()], np.int32
+        )
+
+    def _candidates(self, longitude: float, latitude: float, radius: int):
+        delta_latitude = math.degrees(radius / EARTH_RADIUS)
+        min_y = int(math.floor((max(latitude - delta_latitude, -90.0) + 90.0) / CELL_DEGREES))
+        max_y = int(math.floor((min(latitude + delta_latitude, 90.0) + 90.0) / CELL_DEGREES))
+        cos_latitude = min(
+            math.cos(math.radians(min(abs(latitude) + delta_latitude, 90.0))), math.cos(math.radians(latitude))
+        )
+        if max_y - min_y > MAX_CELL_ROWS or cos_latitude <= 0:
+            return np.arange(len(self._cells))
+        delta_longitude = min(math.degrees(radius / EARTH_RADIUS) / cos_latitude, 180.0)
+        if delta_longitude >= 180.0:
+            return np.arange(len(self._cells))
+
+        min_x = int(math.floor((longitude - delta_longitude + 180.0) / CELL_DEGREES))
+        max_x = int(math.floor((longitude + delta_longitude + 180.0) / CELL_DEGREES))
+        x_ranges = [(min_x, max_x)]
+        if min_x < 0:
+            x_ranges = [(0, max_x), (min_x + CELLS_X, CELLS_X - 1)]
+        elif max_x >= CELLS_X:
+            x_ranges = [(min_x, CELLS_X - 1), (0, max_x - CELLS_X)]
+
+        starts, ends = [], []
+        for y in range(min_y, max_y + 1):
+            for x0, x1 in x_ranges:
+                starts.append(y * CELLS_X + x0)
+                ends.append(y * CELLS_X + x1)
+        lo = np.searchsorted(self._cells, starts, side="left")
+        hi = np.searchsorted(self._cells, ends, side="right")
+        return np.concatenate([np.arange(a, b) for a, b in zip(lo, hi) if b > a] or [np.empty(0, np.int64)])
+
+    def _within(self, longitude: float, latitude: float, radius: int):
+        # ids, track ids and distances of the sorted arrays' hits followed by the pending rows' hits
+        indices = self._candidates(longitude, latitude, radius)
+        distances = haversine(longitude, latitude, self._arrays["longitude"][indices], self._arrays["latitude"][indices])
+        mask = distances <= radius
+        indices, distances = indices[mask], distances[mask]
+        ids, track_ids = self._arrays["id"][indices], self._arrays["track_id"][indices]
+        if self._pending:
+            pending = self._pending_rows()
+            pending_distances = haversine(longitude, latitude, pending["longitude"], pending["latitude"])
+            mask = pending_distances <= radius
+            ids = np.concatenate([ids, pending["id"][mask]])
+            track_ids = np.concatenate([track_ids, pending["track_id"][mask]])
+            distances = np.concatenate([distances, pending_distances[mask]])
+        return ids, track_ids, distances
+
+    @staticmethod
+    def _page(ids, track_ids, distances, after: Optional[PageKey], limit: int):
+        if after is not None:
+            mask = (distances > after[0]) | ((distances == after[0]) & (ids > after[1]))
+            ids, track_ids, distances = ids[mask], track_ids[mask], distances[mask]
+        order = np.lexsort((ids, distances))[:limit]
+        return [
+            Row(int(ids[i]), int(track_ids[i]) if track_ids[i] >= 0 else None, float(distances[i]))
+            for i in order
+        ]
+
+    def song_points_page(self, longitude: float, latitude: float, radius: int, after: Optional[PageKey], limit: int):
+        with self._lock:
+            ids, track_ids, distances = self._within(longitude, latitude, radius)
+        return self._page(ids, track_ids, distances, after, limit)
+
+    def song_points_and_tracks_page(
+            self, longitude: float, latitude: float, radius: int, after: Optional[PageKey], limit: int
+    ):
+        # loose song points plus the nearest song point of every track, as in crud._song_points_and_tracks_page
+        with self._lock:
+            ids, track_ids, distances = self._within(longitude, latitude, radius)
+
+        loose = track_ids < 0
+        tracked = np.flatnonzero(~loose)
+        tracked = tracked[np.lexsort((ids[tracked], distances[tracked], track_ids[tracked]))]
+        _, first = np.unique(track_ids[tracked], return_index=True)
+        keep = np.concatenate([np.flatnonzero(loose), tracked[first]])
+        return self._page(ids[keep], track_ids[keep], distances[keep], after, limit)
+
+
+index = SpatialIndex()
+
+
+@events.on_song_points_inserted
+def _add_song_points(song_points: List[dict]):
+    index.add(song_points)
+
+
+@events.on_song_point_likes_added
+def _update_likes(song_points: List[dict]):
+    index.update_likes({song_point["id"]: song_point["likes"] for song_point in song_points})
+
+
+def start(session_factory):
+    if np is None:
+        raise RuntimeError("SONGMAP_SPATIAL_INDEX needs numpy installed")
+
+    db = session_factory()
+    try:
+        index.load(db)
+    finally:
+        db.close()
+
+    stop = threading.Event()
+
+    def refresh_forever():
+        while not stop.wait(REFRESH_SECONDS):
+            db = session_factory()
+            try:
+                index.refresh(db)
+            except Exception:
+                logger.exception("spatial index refresh failed")
+            finally:
+                db.close()
+
+    threading.Thread(target=refresh_forever, name="spatial-index-refresh", daemon=True).start()
+    return stop
@@ -0,0 +1,41 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .database import engine as default_engine
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine: Engine = default_engine):
+    counter = QueryCounter()
+    event.listen(engine, "before_cursor_execute", counter)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", counter)
+
+
+@contextmanager
+def assert_max_queries(max_queries: int, engine: Engine = default_engine):
+    # with assert_max_queries(3): crud.get_song_points_and_tracks_within_radius(...)
+    with count_queries(engine) as counter:
+        yield counter
+    if counter.count > max_queries:
+        raise AssertionError(
+            "Expected at most {} queries, {} were executed:\n{}".format(
+                max_queries, counter.count, "\n".join(counter.statements)
+            )
+        )
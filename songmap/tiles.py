@@ -0,0 +1,39 @@
+import math
+
+from sqlalchemy import func, cast, Integer
+
+# slippy map (web mercator) tile grid
+MAX_LATITUDE = 85.0511287798
+MAX_ZOOM = 22
+
+
+def clamp_latitude(latitude: float):
+    return max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude))
+
+
+def lonlat_to_tile(longitude: float, latitude: float, zoom: int):
+    n = 2 ** zoom
+    lat = math.radians(clamp_latitude(latitude))
+    x = int((longitude + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(lat)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def bbox_to_tile_range(min_longitude: float, min_latitude: float, max_longitude: float, max_latitude: float, zoom: int):
+    # tile y grows southwards
+    min_x, min_y = lonlat_to_tile(min_longitude, max_latitude, zoom)
+    max_x, max_y = lonlat_to_tile(max_longitude, min_latitude, zoom)
+    return min_x, min_y, max_x, max_y
+
+
+# lonlat_to_tile as SQL expressions over longitude and latitude columns
+def sql_tile_x(longitude, zoom: int):
+    n = 2 ** zoom
+    return cast(func.least(func.floor((longitude + 180.0) / 360.0 * n), n - 1), Integer)
+
+
+def sql_tile_y(latitude, zoom: int):
+    n = 2 ** zoom
+    lat = func.radians(func.greatest(func.least(latitude, MAX_LATITUDE), -MAX_LATITUDE))
+    mercator = func.ln(func.tan(lat) + 1.0 / func.cos(lat))
+    return cast(func.least(func.greatest(func.floor((1.0 - mercator / math.pi) / 2.0 * n), 0), n - 1), Integer)
@@ -0,0 +1,72 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import models
+
+# track resolutions, coarsest first, a song point is shown at every resolution >= its detail_level
+RESOLUTIONS = ("low", "medium", "high", "full")
+# Douglas-Peucker tolerance in degrees of low, medium and high, about 100 m, 10 m and 1 m
+TOLERANCES = (0.001, 0.0001, 0.00001)
+
+_update_line = text("""
+    UPDATE tracks SET
+        line = points.line,
+        point_count = points.point_count,
+        min_longitude = points.min_longitude,
+        min_latitude = points.min_latitude,
+        max_longitude = points.max_longitude,
+        max_latitude = points.max_latitude
+    FROM (
+        SELECT CASE WHEN count(*) >= 2 THEN ST_MakeLine(geo ORDER BY time_added, id) END AS line,
+               count(*) AS point_count,
+               min(longitude) AS min_longitude, min(latitude) AS min_latitude,
+               max(longitude) AS max_longitude, max(latitude) AS max_latitude
+        FROM songpoints
+        WHERE track_id = :track_id
+    ) AS points
+    WHERE tracks.id = :track_id
+""")
+
+# the coarsest level whose simplified line keeps a song point as a vertex, tracks without a line have nothing
+# to simplify and their points are shown at every resolution. Only song points whose level changes are written,
+# so refreshing a track after an append rewrites the new points and the few vertices that moved.
+_update_detail_levels = text("""
+    WITH vertices AS (
+        SELECT tolerances.level - 1 AS level,
+               (ST_DumpPoints(ST_Simplify(tracks.line, tolerances.tolerance))).geom AS geom
+        FROM tracks, unnest(CAST(:tolerances AS float8[])) WITH ORDINALITY AS tolerances(tolerance, level)
+        WHERE tracks.id = :track_id
+    ), levels AS (
+        SELECT songpoints.id, songpoints.time_added, coalesce(min(vertices.level), (
+            SELECT CASE WHEN line IS NULL THEN 0 ELSE :full_detail END FROM tracks WHERE id = :track_id
+        )) AS detail_level
+        FROM songpoints
+        LEFT JOIN vertices ON songpoints.geo ~= vertices.geom
+        WHERE songpoints.track_id = :track_id
+        GROUP BY songpoints.id, songpoints.time_added
+    )
+    UPDATE songpoints SET detail_level = levels.detail_level
+    FROM levels
+    WHERE songpoints.id = levels.id AND songpoints.time_added = levels.time_added
+      AND songpoints.detail_level <> levels.detail_level
+""")
+
+
+def detail_level(resolution: str):
+    return RESOLUTIONS.index(resolution)
+
+
+def refresh_geometry(db: Session, track_id: int) -> int:
+    # rebuilds the line, bbox and song point detail levels of a track, runs in the writing transaction
+    # returns the number of song points whose detail level changed
+    db.execute(_update_line, dict(track_id=track_id))
+    return db.execute(_update_detail_levels, dict(
+        track_id=track_id, tolerances=list(TOLERANCES), full_detail=models.FULL_DETAIL
+    )).rowcount
+
+
+def rebuild(db: Session):
+    # refresh_geometry for every track, for backfills
+    for (track_id,) in db.query(models.Track.id).order_by(models.Track.id).all():
+        refresh_geometry(db, track_id)
+        db.commit()
@@ -0,0 +1,203 @@
+"""Trending songs, served from rollups of placements and likes per (tile cell, time bucket, song).
+
+Placements are counted in the transaction that inserts the song points, likes when the like aggregator
+flushes them, at most likes.FLUSH_SECONDS later. Responses are cached for cache.RESPONSE_CACHE_TTL_SECONDS.
+A trending response is therefore at most FLUSH_SECONDS + RESPONSE_CACHE_TTL_SECONDS behind, 31 s by default.
+
+Hour buckets older than COMPACT_AFTER_HOURS are compacted into day buckets, a window reaching back that far
+is resolved to whole days there. Areas are resolved to whole cells of the finest zoom with at most MAX_CELLS.
+"""
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import func, select, literal, text, and_, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from . import clusters, models, tiles
+
+# about 2500 km, 150 km and 10 km wide cells at the equator
+TRENDING_ZOOMS = (4, 8, 12)
+MAX_CELLS = 256
+# bucket widths in hours
+HOUR = 1
+DAY = 24
+COMPACT_AFTER_HOURS = 48
+RETENTION_DAYS = 90
+DEFAULT_WINDOW_HOURS = 24
+
+METERS_PER_DEGREE = 111320.0
+
+
+def _hour(time: datetime):
+    if time.tzinfo is not None:
+        time = time.astimezone(timezone.utc).replace(tzinfo=None)
+    return time.replace(minute=0, second=0, microsecond=0)
+
+
+def _day(time: datetime):
+    return time.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _upsert_buckets(db: Session, buckets: dict):
+    # sorted, so concurrent writers lock the shared rows in the same order
+    clusters.upsert_counters(db, models.SongTrendingBucket, [
+        dict(zoom=zoom, x=x, y=y, hours=hours, bucket=bucket, song_id=song_id, placements=placements, likes=likes)
+        for (zoom, x, y, hours, bucket, song_id), (placements, likes) in sorted(buckets.items())
+    ], ["zoom", "x", "y", "hours", "bucket", "song_id"], ["placements", "likes"])
+
+
+def add_song_points(db: Session, song_points: List[dict]):
+    # column values of new song points, batched by rollups
+    buckets = defaultdict(lambda: [0, 0])
+    for song_point in song_points:
+        bucket = _hour(song_point["time_added"])
+        for zoom in TRENDING_ZOOMS:
+            x, y = tiles.lonlat_to_tile(song_point["longitude"], song_point["latitude"], zoom)
+            buckets[zoom, x, y, HOUR, bucket, song_point["song_id"]][0] += 1
+    _upsert_buckets(db, buckets)
+
+
+def add_likes(db: Session, song_points: List[dict]):
+    # likes added to existing song points, dicts with longitude, latitude, song_id and likes, counted in the current hour
+    bucket = _hour(datetime.utcnow())
+    buckets = defaultdict(lambda: [0, 0])
+    for song_point in song_points:
+        for zoom in TRENDING_ZOOMS:
+            x, y = tiles.lonlat_to_tile(song_point["longitude"], song_point["latitude"], zoom)
+            buckets[zoom, x, y, HOUR, bucket, song_point["song_id"]][1] += song_point["likes"]
+    _upsert_buckets(db, buckets)
+
+
+def add_song_points_from(db: Session, source):
+    # set based add_song_points for bulk loads, source has longitude, latitude, time_added and song_id columns
+    bucket = func.date_trunc("hour", source.c.time_added)
+    for zoom in TRENDING_ZOOMS:
+        x, y = tiles.sql_tile_x(source.c.longitude, zoom), tiles.sql_tile_y(source.c.latitude, zoom)
+        stmt = pg_insert(models.SongTrendingBucket).from_select(
+            ["zoom", "x", "y", "hours", "bucket", "song_id", "placements", "likes"],
+            select(
+                literal(zoom), x, y, literal(HOUR), bucket, source.c.song_id, func.count(), literal(0)
+            ).group_by(x, y, bucket, source.c.song_id).order_by(x, y, bucket, source.c.song_id)
+        )
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["zoom", "x", "y", "hours", "bucket", "song_id"],
+            set_={"placements": models.SongTrendingBucket.placements + stmt.excluded["placements"]}
+        ))
+
+
+# moves hour buckets into day buckets in one statement, rows inserted meanwhile are left for the next run
+_compact = text("""
+    WITH moved AS (
+        DELETE FROM song_trending_buckets WHERE hours = :hour AND bucket < :cutoff
+        RETURNING zoom, x, y, bucket, song_id, placements, likes
+    )
+    INSERT INTO song_trending_buckets (zoom, x, y, hours, bucket, song_id, placements, likes)
+    SELECT zoom, x, y, :day, date_trunc('day', bucket), song_id, sum(placements), sum(likes)
+    FROM moved
+    GROUP BY zoom, x, y, date_trunc('day', bucket), song_id
+    ORDER BY zoom, x, y, date_trunc('day', bucket), song_id
+    ON CONFLICT (zoom, x, y, hours, bucket, song_id) DO UPDATE SET
+        placements = song_trending_buckets.placements + excluded.placements,
+        likes = song_trending_buckets.likes + excluded.likes
+""")
+
+
+def compact(db: Session, now: Optional[datetime] = None):
+    now = now or datetime.utcnow()
+    db.execute(_compact, dict(hour=HOUR, day=DAY, cutoff=_day(now - timedelta(hours=COMPACT_AFTER_HOURS))))
+    db.query(models.SongTrendingBucket).filter(
+        models.SongTrendingBucket.bucket < _day(now - timedelta(days=RETENTION_DAYS))
+    ).delete(synchronize_session=False)
+    db.commit()
+
+
+def rebuild(db: Session):
+    # recomputes every bucket from songpoints and likes, for backfills
+    db.query(models.SongTrendingBucket).delete(synchronize_session=False)
+    sp, like = models.SongPoint, models.Like
+    for zoom in TRENDING_ZOOMS:
+        x, y = tiles.sql_tile_x(sp.longitude, zoom), tiles.sql_tile_y(sp.latitude, zoom)
+        bucket = func.date_trunc("hour", sp.time_added)
+        db.execute(models.SongTrendingBucket.__table__.insert().from_select(
+            ["zoom", "x", "y", "hours", "bucket", "song_id", "placements", "likes"],
+            select(literal(zoom), x, y, literal(HOUR), bucket, sp.song_id, func.count(), literal(0)).group_by(
+                x, y, bucket, sp.song_id
+            )
+        ))
+        bucket = func.date_trunc("hour", like.time_added)
+        stmt = pg_insert(models.SongTrendingBucket).from_select(
+            ["zoom", "x", "y", "hours", "bucket", "song_id", "placements", "likes"],
+            select(literal(zoom), x, y, literal(HOUR), bucket, sp.song_id, literal(0), func.count()).select_from(
+                like
+            ).join(sp, sp.id == like.song_point_id).group_by(x, y, bucket, sp.song_id)
+        )
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["zoom", "x", "y", "hours", "bucket", "song_id"],
+            set_={"likes": models.SongTrendingBucket.likes + stmt.excluded["likes"]}
+        ))
+    db.commit()
+    compact(db)
+
+
+def radius_bbox(longitude: float, latitude: float, radius: int):
+    delta_latitude = radius / METERS_PER_DEGREE
+    delta_longitude = min(
+        radius / (METERS_PER_DEGREE * max(math.cos(math.radians(tiles.clamp_latitude(latitude))), 0.01)), 180.0
+    )
+    return (
+        max(longitude - delta_longitude, -180.0), max(latitude - delta_latitude, -90.0),
+        min(longitude + delta_longitude, 180.0), min(latitude + delta_latitude, 90.0)
+    )
+
+
+def window(since: Optional[datetime], until: Optional[datetime]):
+    # whole hours, so cache keys of the default window only change once an hour
+    since = _hour(since) if since is not None else _hour(datetime.utcnow()) - timedelta(hours=DEFAULT_WINDOW_HOURS - 1)
+    until = _hour(until) + timedelta(hours=1) if until is not None else None
+    return since, until
+
+
+def get_trending(
+        db: Session,
+        min_longitude: float,
+        min_latitude: float,
+        max_longitude: float,
+        max_latitude: float,
+        since: datetime,
+        until: Optional[datetime] = None,
+        order: str = "placements",
+        limit: int = 10
+):
+    for zoom in reversed(TRENDING_ZOOMS):
+        min_x, min_y, max_x, max_y = tiles.bbox_to_tile_range(min_longitude, min_latitude, max_longitude, max_latitude, zoom)
+        if (max_x - min_x + 1) * (max_y - min_y + 1) <= MAX_CELLS:
+            break
+
+    bucket = models.SongTrendingBucket
+    conditions = [
+        bucket.zoom == zoom,
+        bucket.x.between(min_x, max_x),
+        bucket.y.between(min_y, max_y),
+        or_(
+            and_(bucket.hours == HOUR, bucket.bucket >= since),
+            and_(bucket.hours == DAY, bucket.bucket >= _day(since))
+        )
+    ]
+    if until is not None:
+        conditions.append(bucket.bucket < until)
+
+    counts = select(
+        bucket.song_id,
+        func.sum(bucket.placements).label("placements"),
+        func.sum(bucket.likes).label("likes")
+    ).where(*conditions).group_by(bucket.song_id).subquery()
+    ranked_by = counts.c[order]
+    rows = db.execute(
+        select(models.Song, counts.c.placements, counts.c.likes).join(
+            counts, models.Song.id == counts.c.song_id
+        ).order_by(ranked_by.desc(), counts.c.song_id).limit(limit)
+    ).all()
+    return [{"song": row.Song, "placements": row.placements, "likes": row.likes} for row in rows]
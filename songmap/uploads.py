@@ -0,0 +1,122 @@
+"""Idempotent, resumable song point uploads for clients that record offline and sync when they can.
+
+A song point may carry an idempotency_key, unique per owner. Its key is claimed in song_point_keys in the
+transaction that inserts the point, a point whose key is already claimed is not inserted again and the id it
+got the first time is returned, see crud.insert_song_points. POST /users/{owner_id}/songpoints/ and
+/users/{owner_id}/tracks/ take an Idempotency-Key header for the whole batch, a retried batch returns what the
+first attempt stored.
+
+Long recordings go up in chunks:
+
+    POST /users/{owner_id}/uploads/                          {"key": ..., "total": ..., "track": {...}}
+    POST /users/{owner_id}/uploads/{key}/song_points/?offset=N   [song points N, N + 1, ...]
+    GET  /users/{owner_id}/uploads/{key}/
+
+The upload row counts the song points committed so far. A chunk is stored in one transaction together with
+that count, so after a dropped connection the client GETs the upload and sends the remainder from committed
+on. The part of a chunk below committed is skipped without touching songpoints, a chunk starting past
+committed would leave a gap and is refused. Keys and uploads older than UPLOAD_KEY_RETENTION_DAYS are purged by
+songmap.maintenance, a client retrying after that inserts again.
+
+The line, bbox and detail levels of the upload's track are refreshed once, by the chunk that finishes the
+upload. An upload without a total never finishes, its track is refreshed by songmap.maintenance when song points
+were committed since the last refresh.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from . import models, schemas, crud, tracks
+
+UPLOAD_KEY_RETENTION_DAYS = int(os.environ.get("SONGMAP_UPLOAD_KEY_RETENTION_DAYS", 30))
+
+
+def get_upload(db: Session, owner_id: int, key: str, lock: bool = False) -> Optional[models.Upload]:
+    query = db.query(models.Upload).filter(models.Upload.owner_id == owner_id, models.Upload.key == key)
+    if lock:
+        # chunks of one upload are stored one after another
+        query = query.with_for_update()
+    return query.first()
+
+
+def create_upload(db: Session, owner_id: int, upload: schemas.UploadCreate) -> models.Upload:
+    # creating an existing upload again returns it as it is
+    created = db.execute(pg_insert(models.Upload).values(
+        owner_id=owner_id, key=upload.key, total=upload.total, committed=0, created_at=datetime.utcnow()
+    ).on_conflict_do_nothing(index_elements=["owner_id", "key"]).returning(models.Upload.id)).first()
+    if created is not None and upload.track is not None:
+        db_track = models.Track(name=upload.track.name, owner_id=owner_id)
+        db.add(db_track)
+        db.flush()
+        db.query(models.Upload).filter(models.Upload.id == created.id).update(
+            {models.Upload.track_id: db_track.id}, synchronize_session=False
+        )
+    db.commit()
+    return get_upload(db, owner_id, upload.key)
+
+
+def append_song_points(
+        db: Session, upload: models.Upload, offset: int, song_points: List[schemas.SongPointCreate]
+) -> models.Upload:
+    # upload locked by get_upload(lock=True) and offset <= upload.committed, checked by the caller
+    if offset < 0:
+        raise ValueError("offset must not be negative")
+    if upload.total is not None and offset + len(song_points) > upload.total:
+        raise ValueError("Upload has {} song points, the chunk ends at {}".format(
+            upload.total, offset + len(song_points)
+        ))
+    remaining = song_points[upload.committed - offset:]
+    if remaining:
+        crud.insert_song_points(db, remaining, upload.owner_id, track_id=upload.track_id)
+        upload.committed += len(remaining)
+    done = upload.total is not None and upload.committed >= upload.total
+    if upload.track_id is not None and done and upload.refreshed < upload.committed:
+        tracks.refresh_geometry(db, upload.track_id)
+        upload.refreshed = upload.committed
+    if done and upload.finished_at is None:
+        upload.finished_at = datetime.utcnow()
+    db.commit()
+    db.refresh(upload)
+    return upload
+
+
+def create_track_w_song_points(
+        db: Session, owner_id: int, key: str, track: schemas.TrackCreate, song_points: List[schemas.SongPointCreate]
+):
+    # a single chunk upload, a retry returns the track the first attempt stored
+    upload = create_upload(db, owner_id, schemas.UploadCreate(
+        key="track:" + key, total=len(song_points), track=track
+    ))
+    upload = get_upload(db, owner_id, upload.key, lock=True)
+    if upload.committed < upload.total:
+        append_song_points(db, upload, 0, song_points[:upload.total])
+    return crud.get_tracks_by_ids(db, [upload.track_id])[0]
+
+
+def refresh_tracks(db: Session):
+    # tracks of uploads with song points committed since their last refresh, one transaction per upload
+    upload_ids = db.query(models.Upload.id).filter(
+        models.Upload.track_id.isnot(None), models.Upload.refreshed < models.Upload.committed
+    ).order_by(models.Upload.id).all()
+    for (upload_id,) in upload_ids:
+        # an upload taking a chunk right now is left for the next run
+        upload = db.query(models.Upload).filter(models.Upload.id == upload_id).with_for_update(skip_locked=True).first()
+        if upload is not None and upload.refreshed < upload.committed:
+            tracks.refresh_geometry(db, upload.track_id)
+            upload.refreshed = upload.committed
+        db.commit()
+
+
+def purge(db: Session, now: Optional[datetime] = None):
+    before = (now or datetime.utcnow()) - timedelta(days=UPLOAD_KEY_RETENTION_DAYS)
+    keys = db.execute(delete(models.SongPointKey).where(models.SongPointKey.created_at < before)).rowcount
+    # unfinished uploads are dropped once they are that old too
+    uploads = db.execute(delete(models.Upload).where(
+        func.coalesce(models.Upload.finished_at, models.Upload.created_at) < before
+    )).rowcount
+    db.commit()
+    return keys, uploads
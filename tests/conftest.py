@@ -0,0 +1,72 @@
+"""Fixtures shared by the tests.
+
+Tests taking the db fixture need the PostgreSQL with PostGIS songmap.database points at, see the README. The
+schema is upgraded to head once per run and every test runs in a transaction rolled back afterwards, the
+commits of the code under test only release savepoints. Without a reachable database these tests are skipped.
+"""
+import os
+import uuid
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from songmap import models, partitions
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic.ini")
+
+
+@pytest.fixture(scope="session")
+def engine():
+    from songmap.database import engine
+
+    try:
+        engine.connect().close()
+    except Exception as e:
+        pytest.skip("no database: {}".format(e))
+
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(ALEMBIC_INI)
+    config.set_main_option("script_location", os.path.join(os.path.dirname(ALEMBIC_INI), "migrations"))
+    command.upgrade(config, "head")
+    return engine
+
+
+@pytest.fixture
+def db(engine):
+    connection = engine.connect()
+    transaction = connection.begin()
+    session = Session(bind=connection)
+    nested = connection.begin_nested()
+
+    @event.listens_for(session, "after_transaction_end")
+    def restart_savepoint(session, ended):
+        nonlocal nested
+        if not nested.is_active:
+            nested = connection.begin_nested()
+
+    partitions.ensure_partitions(session)
+    try:
+        yield session
+    finally:
+        session.close()
+        transaction.rollback()
+        connection.close()
+
+
+@pytest.fixture
+def user(db):
+    db_user = models.User(username="test-{}".format(uuid.uuid4().hex), email="test@songmap", hashed_password="-")
+    db.add(db_user)
+    db.flush()
+    return db_user
+
+
+@pytest.fixture
+def song(db):
+    db_song = models.Song(artist="Test", title="Test", spotify_id="test-{}".format(uuid.uuid4().hex))
+    db.add(db_song)
+    db.flush()
+    return db_song
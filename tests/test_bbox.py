@@ -0,0 +1,42 @@
+import random
+from datetime import datetime
+
+from songmap import crud, schemas
+
+# a viewport over central Europe with the song points of one city in it
+VIEWPORT = (10.0, 45.0, 25.0, 52.0)
+CITY = (17.11, 48.15)
+
+
+def _insert(db, user, song, locations):
+    return crud.insert_song_points(db, [
+        schemas.SongPointCreate(song_id=song.id, longitude=longitude, latitude=latitude, time_added=datetime.utcnow())
+        for longitude, latitude in locations
+    ], user.id)
+
+
+def test_one_dense_city_fills_the_budget(db, user, song):
+    rng = random.Random(1)
+    _insert(db, user, song, [
+        (CITY[0] + rng.uniform(-0.05, 0.05), CITY[1] + rng.uniform(-0.03, 0.03)) for _ in range(crud.BBOX_BUDGET + 1)
+    ])
+    ids, sampled = crud.song_points_in_bbox_ids(db, *VIEWPORT)
+    assert sampled
+    assert len(ids) == crud.BBOX_BUDGET
+
+
+def test_sparse_cells_keep_their_points_and_the_rest_goes_to_the_dense_one(db, user, song):
+    rng = random.Random(2)
+    # away from the city, whose cell they would otherwise share
+    scattered = []
+    while len(scattered) < 50:
+        longitude, latitude = rng.uniform(VIEWPORT[0], VIEWPORT[2]), rng.uniform(VIEWPORT[1], VIEWPORT[3])
+        if abs(longitude - CITY[0]) > 2 or abs(latitude - CITY[1]) > 1:
+            scattered.append((longitude, latitude))
+    city = [(CITY[0] + rng.uniform(-0.05, 0.05), CITY[1] + rng.uniform(-0.03, 0.03)) for _ in range(3000)]
+    song_point_ids = _insert(db, user, song, scattered + city)
+
+    ids, sampled = crud.song_points_in_bbox_ids(db, *VIEWPORT, budget=500)
+    assert sampled
+    assert len(ids) == 500
+    assert set(song_point_ids[:len(scattered)]) <= set(ids)
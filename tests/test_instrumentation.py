@@ -0,0 +1,17 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from songmap import instrumentation
+
+
+def test_failed_statements_leave_no_start_time_behind():
+    engine = create_engine("sqlite://")
+    instrumentation.install(engine)
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM missing"))
+        conn.execute(text("SELECT 1"))
+        assert conn.info["query_started"] == {}
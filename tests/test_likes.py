@@ -0,0 +1,41 @@
+import uuid
+from datetime import datetime
+
+from songmap import crud, likes, models, rollups, schemas
+
+
+def _fan(db):
+    db_user = models.User(username="fan-{}".format(uuid.uuid4().hex), email="fan@songmap", hashed_password="-")
+    db.add(db_user)
+    db.flush()
+    return db_user
+
+
+def test_approval_ratio_follows_the_counters(db, user, song, monkeypatch):
+    # counters applied in the inserting transaction instead of the batched rollups
+    monkeypatch.setattr(rollups, "ROLLUP_AGGREGATOR", False)
+    song_point_ids = crud.insert_song_points(db, [
+        schemas.SongPointCreate(song_id=song.id, longitude=17.11, latitude=48.15, time_added=datetime.utcnow())
+        for _ in range(4)
+    ], user.id)
+    fans = [_fan(db), _fan(db)]
+
+    now = datetime.utcnow()
+    assert likes.apply_likes(db, [likes.LikeEvent(fans[0].id, song_point_ids[0], now)]) == 1
+    # a second like of the same song point raises influence, not the share of liked song points
+    assert likes.apply_likes(db, [
+        likes.LikeEvent(fans[1].id, song_point_ids[0], now), likes.LikeEvent(fans[1].id, song_point_ids[0], now)
+    ]) == 1
+    db.refresh(user)
+    assert (user.song_points_count, user.song_points_liked, user.influence, user.approval_ratio) == (4, 1, 2, 25)
+
+    crud.insert_song_points(db, [
+        schemas.SongPointCreate(song_id=song.id, longitude=17.11, latitude=48.15, time_added=datetime.utcnow())
+    ], user.id)
+    db.flush()
+    db.refresh(user)
+    assert (user.song_points_count, user.approval_ratio) == (5, 20)
+
+    likes.recount(db)
+    db.refresh(user)
+    assert (user.song_points_count, user.song_points_liked, user.approval_ratio) == (5, 1, 20)
@@ -0,0 +1,43 @@
+import uuid
+from datetime import datetime
+
+from songmap import crud, models, schemas, spatial_index
+from songmap.responses import json_body
+from songmap.testing import assert_max_queries
+
+CENTER = (17.11, 48.15)
+# the radius query, the loose song points with their songs joined, the tracks, their song points, their songs
+SONG_POINTS_AND_TRACKS_QUERIES = 5
+
+
+def test_song_points_and_tracks_within_radius_query_budget(db, user, monkeypatch):
+    monkeypatch.setattr(spatial_index.index, "ready", False)
+    songs = [models.Song(artist="Test", title=str(i), spotify_id="test-{}".format(uuid.uuid4().hex)) for i in range(5)]
+    db.add_all(songs)
+    db.flush()
+
+    def song_points(count, offset):
+        return [
+            schemas.SongPointCreate(
+                song_id=songs[i % len(songs)].id, longitude=CENTER[0] + (offset + i) * 1e-4,
+                latitude=CENTER[1], time_added=datetime.utcnow()
+            )
+            for i in range(count)
+        ]
+
+    for t in range(4):
+        db_track = models.Track(name="track {}".format(t), owner_id=user.id)
+        db.add(db_track)
+        db.flush()
+        crud.insert_song_points(db, song_points(10, t * 10), user.id, track_id=db_track.id)
+    crud.insert_song_points(db, song_points(6, 40), user.id)
+    db.expire_all()
+
+    with assert_max_queries(SONG_POINTS_AND_TRACKS_QUERIES):
+        content, _ = crud.get_song_points_and_tracks_within_radius(db, *CENTER, radius=1000)
+        body = json_body(schemas.SongPointsAndTracksResp, content)
+
+    resp = schemas.SongPointsAndTracksResp.parse_raw(body)
+    assert len(resp.tracks) == 4
+    assert sum(len(track.song_points) for track in resp.tracks) == 40
+    assert len(resp.song_points) == 6
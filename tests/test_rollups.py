@@ -0,0 +1,32 @@
+from datetime import datetime
+
+from songmap import clusters, crud, models, rollups, schemas
+
+
+def _song_points(song, n):
+    return [
+        schemas.SongPointCreate(song_id=song.id, longitude=17.11, latitude=48.15, time_added=datetime.utcnow())
+        for _ in range(n)
+    ]
+
+
+def _cell_count(db):
+    zoom = clusters.CELL_ZOOMS[-1]
+    return db.query(models.SongPointCell.count).filter(
+        models.SongPointCell.zoom == zoom, models.SongPointCell.longitude_sum > 0
+    ).scalar()
+
+
+def test_rollups_wait_for_the_commit_and_the_flush(db, user, song, monkeypatch):
+    monkeypatch.setattr(rollups, "ROLLUP_AGGREGATOR", True)
+    monkeypatch.setattr(rollups, "aggregator", rollups.RollupAggregator())
+    db.query(models.SongPointCell).delete()
+
+    crud.insert_song_points(db, _song_points(song, 3), user.id)
+    assert _cell_count(db) is None
+    db.commit()
+    assert len(rollups.aggregator) == 3
+    assert rollups.aggregator.flush(db) == 3
+    assert _cell_count(db) == 3
+    db.refresh(user)
+    assert user.song_points_count == 3
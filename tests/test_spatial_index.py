@@ -0,0 +1,169 @@
+import math
+import random
+import threading
+from datetime import datetime
+
+import pytest
+
+from songmap import crud, schemas, spatial_index
+
+pytest.importorskip("numpy")
+
+# (longitude, latitude, spread in degrees): a city, both sides of the antimeridian, near the pole, everywhere
+CLUSTERS = [(17.11, 48.15, 0.05), (179.995, 0.0, 0.02), (-179.995, 0.01, 0.02), (10.0, 89.95, 0.05), (0.0, 0.0, 90.0)]
+POINTS_PER_CLUSTER = 400
+# centers of the queries, each run with every radius
+QUERIES = [(17.11, 48.15), (17.2, 48.1), (180.0, 0.0), (-179.99, 0.0), (0.0, 89.99), (45.0, -30.0)]
+RADII = [50, 500, 5000, 50000, 3000000]
+LIMIT = 17
+
+
+def _rows(seed: int, first_id: int = 1):
+    # (id, longitude, latitude, song_id, owner_id, track_id, likes) in spatial_index.COLUMNS order
+    rng = random.Random(seed)
+    rows = []
+    for longitude, latitude, spread in CLUSTERS:
+        for _ in range(POINTS_PER_CLUSTER):
+            lon = (longitude + rng.uniform(-spread, spread) + 180.0) % 360.0 - 180.0
+            lat = max(-90.0, min(90.0, latitude + rng.uniform(-spread, spread) / 2))
+            track_id = rng.choice([None, None, 1, 2, 3])
+            rows.append((first_id + len(rows), lon, lat, 1, 1, track_id, 0))
+    return rows
+
+
+def _index(rows):
+    index = spatial_index.SpatialIndex()
+    index._set_arrays(spatial_index._from_rows(rows))
+    index.ready = True
+    return index
+
+
+def _distance(longitude, latitude, row):
+    # haversine on the PostGIS sphere, one point at a time
+    lon1, lat1, lon2, lat2 = map(math.radians, (longitude, latitude, row[1], row[2]))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * spatial_index.EARTH_RADIUS * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def _reference(rows, longitude, latitude, radius, tracks=False):
+    # every hit in (distance, id) order, for tracks only the nearest song point of each track
+    hits = sorted((_distance(longitude, latitude, row), row[0], row[5]) for row in rows)
+    hits = [hit for hit in hits if hit[0] <= radius]
+    if tracks:
+        seen = set()
+        hits = [hit for hit in hits if hit[2] is None or not (hit[2] in seen or seen.add(hit[2]))]
+    return [(song_point_id, track_id) for _, song_point_id, track_id in hits]
+
+
+def _all_pages(page, longitude, latitude, radius):
+    rows, after = [], None
+    while True:
+        found = page(longitude, latitude, radius, after, LIMIT)
+        rows.extend((row.id, row.track_id) for row in found)
+        if len(found) < LIMIT:
+            return rows
+        after = (found[-1].distance, found[-1].id)
+
+
+@pytest.mark.parametrize("radius", RADII)
+def test_pages_match_brute_force(radius):
+    rows = _rows(seed=1)
+    index = _index(rows)
+    for longitude, latitude in QUERIES:
+        assert _all_pages(index.song_points_page, longitude, latitude, radius) == _reference(
+            rows, longitude, latitude, radius
+        )
+        assert _all_pages(index.song_points_and_tracks_page, longitude, latitude, radius) == _reference(
+            rows, longitude, latitude, radius, tracks=True
+        )
+
+
+def test_pending_rows_are_found_without_a_merge():
+    rows, added = _rows(seed=2), _rows(seed=3, first_id=100000)[:500]
+    index = _index(rows)
+    index.add([dict(zip(spatial_index.COLUMNS, row)) for row in added])
+    for longitude, latitude in QUERIES:
+        for radius in RADII:
+            assert _all_pages(index.song_points_page, longitude, latitude, radius) == _reference(
+                rows + added, longitude, latitude, radius
+            )
+    # queries scan the pending rows, they are not merged below the threshold
+    assert len(index._cells) == len(rows)
+    assert len(index) == len(rows) + len(added)
+
+
+def test_pending_rows_are_merged_at_the_threshold(monkeypatch):
+    monkeypatch.setattr(spatial_index, "MERGE_THRESHOLD", 100)
+    rows, added = _rows(seed=4), _rows(seed=5, first_id=100000)[:250]
+    index = _index(rows)
+    index.add([dict(zip(spatial_index.COLUMNS, row)) for row in added[:99]])
+    assert len(index._cells) == len(rows)
+    index.add([dict(zip(spatial_index.COLUMNS, row)) for row in added[99:]])
+    assert len(index._cells) == len(rows) + len(added)
+    assert _all_pages(index.song_points_page, 17.11, 48.15, 5000) == _reference(rows + added, 17.11, 48.15, 5000)
+
+
+def test_likes_update_pending_rows_in_place():
+    rows, added = _rows(seed=6), _rows(seed=7, first_id=100000)[:10]
+    index = _index(rows)
+    index.add([dict(zip(spatial_index.COLUMNS, row)) for row in added])
+    index.update_likes({rows[0][0]: 2, added[0][0]: 3})
+    assert len(index._cells) == len(rows)
+    assert index._pending[added[0][0]][-1] == 3
+    index._merge()
+    likes = dict(zip(index._arrays["id"].tolist(), index._arrays["likes"].tolist()))
+    assert likes[rows[0][0]] == 2
+    assert likes[added[0][0]] == 3
+
+
+def test_merge_sorts_outside_the_lock_and_keeps_likes_added_meanwhile(monkeypatch):
+    rows, added = _rows(seed=9), _rows(seed=10, first_id=100000)[:10]
+    late = _rows(seed=11, first_id=200000)[:1]
+    index = _index(rows)
+    index.add([dict(zip(spatial_index.COLUMNS, row)) for row in added])
+    cells = spatial_index._cells
+
+    def cells_while_writers_run(longitude, latitude):
+        # another thread can take the lock while the merged arrays are sorted
+        acquired = []
+
+        def reader():
+            acquired.append(index._lock.acquire(timeout=1))
+            index._lock.release()
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        thread.join()
+        assert acquired == [True]
+        index.update_likes({rows[0][0]: 2, added[0][0]: 3})
+        index.add([dict(zip(spatial_index.COLUMNS, row)) for row in late])
+        return cells(longitude, latitude)
+
+    monkeypatch.setattr(spatial_index, "_cells", cells_while_writers_run)
+    index._merge()
+    likes = dict(zip(index._arrays["id"].tolist(), index._arrays["likes"].tolist()))
+    assert (likes[rows[0][0]], likes[added[0][0]]) == (2, 3)
+    # added during the merge, still pending
+    assert list(index._pending) == [late[0][0]]
+    assert len(index) == len(rows) + len(added) + len(late)
+
+
+def test_pages_match_postgis(db, user, song):
+    rows = _rows(seed=8)
+    song_points = [
+        schemas.SongPointCreate(song_id=song.id, longitude=row[1], latitude=row[2], time_added=datetime.utcnow())
+        for row in rows
+    ]
+    crud.insert_song_points(db, song_points, user.id)
+    index = spatial_index.SpatialIndex()
+    index.load(db)
+
+    for longitude, latitude in QUERIES:
+        for radius in RADII[:-1]:
+            for sql, memory in (
+                    (crud._song_points_page, index.song_points_page),
+                    (crud._song_points_and_tracks_page, index.song_points_and_tracks_page),
+            ):
+                expected = [(row.id, row.track_id) for row in db.execute(sql(longitude, latitude, radius, None, 100))]
+                actual = [(row.id, row.track_id) for row in memory(longitude, latitude, radius, None, 100)]
+                assert actual == expected
@@ -0,0 +1,82 @@
+import asyncio
+import tracemalloc
+from datetime import datetime, timedelta
+
+from songmap import auth, crud, main
+from songmap.responses import ndjson_lines
+
+ROWS = 100_000
+CHUNK = crud.STREAM_CHUNK
+# a generous ceiling on what one encoded row and its dict cost while a chunk is held
+BYTES_PER_ROW = 2048
+
+
+def fake_rows(count: int):
+    # the rows of crud.iter_song_points_and_tracks_by_user, made up one at a time
+    started = datetime(2026, 1, 1)
+    for i in range(count):
+        yield {
+            "type": "song_point",
+            "track_id": i // 500,
+            "song_id": i % 97,
+            "longitude": 17.1 + i * 1e-6,
+            "latitude": 48.1 + i * 1e-6,
+            "time_added": started + timedelta(seconds=i),
+            "owner_id": 1,
+            "likes": i % 13,
+            "song": {"artist": "Artist {}".format(i % 97), "title": "Title {}".format(i % 97),
+                     "spotify_id": "spotify-{}".format(i % 97), "id": i % 97},
+        }
+
+
+def peak_while(consume):
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        written = consume()
+        return written, tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+
+def test_ndjson_lines_memory_follows_the_chunk_not_the_rows():
+    def consume():
+        lines = 0
+        for block in ndjson_lines(fake_rows(ROWS), CHUNK):
+            lines += block.count(b"\n")
+        return lines
+
+    lines, peak = peak_while(consume)
+    assert lines == ROWS
+    assert peak < CHUNK * BYTES_PER_ROW
+
+
+class FakeSession:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_stream_endpoint_memory_follows_the_chunk_not_the_rows(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(main, "SessionLocal", lambda: session)
+    monkeypatch.setattr(crud, "iter_song_points_and_tracks_by_user", lambda db, owner_id: fake_rows(ROWS))
+
+    async def consume_body(response):
+        lines = 0
+        async for block in response.body_iterator:
+            lines += block.count(b"\n")
+        return lines
+
+    def consume():
+        response = main.stream_song_points_and_tracks_by_user(
+            owner_id=1, principal=auth.Principal(id=1, username="test")
+        )
+        return asyncio.run(consume_body(response))
+
+    lines, peak = peak_while(consume)
+    assert lines == ROWS
+    assert peak < CHUNK * BYTES_PER_ROW
+    assert session.closed
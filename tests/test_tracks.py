@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+
+from songmap import crud, models, schemas, tracks
+
+
+def _zigzag(song, start: int, n: int):
+    # every other point 1 km off the line, so it is kept at every resolution
+    started = datetime(2026, 1, 1)
+    return [
+        schemas.SongPointCreate(
+            song_id=song.id, longitude=17.0 + i * 0.01, latitude=48.0 + (0.01 if i % 2 else 0.0),
+            time_added=started + timedelta(minutes=i)
+        )
+        for i in range(start, start + n)
+    ]
+
+
+def _levels(db, track_id):
+    return [level for (level,) in db.query(models.SongPoint.detail_level).filter(
+        models.SongPoint.track_id == track_id
+    ).order_by(models.SongPoint.time_added)]
+
+
+def test_refresh_writes_only_the_song_points_whose_level_changes(db, user, song):
+    db_track = models.Track(name="zigzag", owner_id=user.id)
+    db.add(db_track)
+    db.flush()
+    crud.insert_song_points(db, _zigzag(song, 0, 10), user.id, track_id=db_track.id)
+
+    assert tracks.refresh_geometry(db, db_track.id) == 10
+    assert _levels(db, db_track.id) == [0] * 10
+    assert tracks.refresh_geometry(db, db_track.id) == 0
+
+    crud.insert_song_points(db, _zigzag(song, 10, 4), user.id, track_id=db_track.id)
+    assert tracks.refresh_geometry(db, db_track.id) == 4
+    assert _levels(db, db_track.id) == [0] * 14
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+from songmap import schemas, tracks, uploads
+
+
+def _song_points(song, start: int, n: int):
+    started = datetime(2026, 1, 1)
+    return [
+        schemas.SongPointCreate(
+            song_id=song.id, longitude=17.0 + i * 0.01, latitude=48.0, time_added=started + timedelta(minutes=i)
+        )
+        for i in range(start, start + n)
+    ]
+
+
+def _upload(db, user, key, total):
+    uploads.create_upload(db, user.id, schemas.UploadCreate(key=key, total=total, track=schemas.TrackCreate()))
+    return uploads.get_upload(db, user.id, key, lock=True)
+
+
+def test_track_is_refreshed_once_when_the_upload_finishes(db, user, song, monkeypatch):
+    refreshed = []
+    monkeypatch.setattr(tracks, "refresh_geometry", lambda db, track_id: refreshed.append(track_id))
+    upload = _upload(db, user, "finishing", 30)
+    for offset in range(0, 30, 10):
+        upload = uploads.append_song_points(db, uploads.get_upload(db, user.id, "finishing", lock=True), offset,
+                                            _song_points(song, offset, 10))
+    assert refreshed == [upload.track_id]
+    assert upload.refreshed == upload.committed == 30
+
+
+def test_track_of_an_open_upload_is_refreshed_by_maintenance(db, user, song, monkeypatch):
+    refreshed = []
+    monkeypatch.setattr(tracks, "refresh_geometry", lambda db, track_id: refreshed.append(track_id))
+    _upload(db, user, "open", None)
+    for offset in range(0, 30, 10):
+        upload = uploads.append_song_points(db, uploads.get_upload(db, user.id, "open", lock=True), offset,
+                                            _song_points(song, offset, 10))
+    assert refreshed == []
+
+    uploads.refresh_tracks(db)
+    uploads.refresh_tracks(db)
+    assert refreshed.count(upload.track_id) == 1